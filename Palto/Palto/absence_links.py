@@ -0,0 +1,96 @@
+"""
+Absences links for the Palto project.
+
+The sessions covered by every absence are stored in the AbsenceSession table instead of being computed again with
+range joins through the groups of the students. The links are updated when the absences, the sessions or the groups
+are modified, and can be entirely rebuilt with the "palto_rebuild_absence_links" command.
+"""
+
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Q, F
+
+from Palto.Palto import models
+
+
+# path from an absence to the sessions of its student
+SESSIONS_PATH: str = "student__student_groups__teaching_sessions"
+
+
+def compute(absences_filter: Q) -> set[tuple]:
+    """
+    Return the (absence id, session id) links of the absences matching a filter, in a single query.
+    """
+
+    return set(
+        models.Absence.objects.filter(
+            absences_filter,
+            # the sessions of the department of the absence
+            **{f"{SESSIONS_PATH}__unit__department": F("department")},
+            # the sessions starting between the start and the end of the absence
+            **{f"{SESSIONS_PATH}__start__range": (F("start"), F("end"))},
+        ).values_list("pk", SESSIONS_PATH).distinct()
+    )
+
+
+def _update(links_filter: Q, absences_filter: Q) -> None:
+    with transaction.atomic():
+        models.AbsenceSession.objects.filter(links_filter).delete()
+        models.AbsenceSession.objects.bulk_create(
+            [
+                models.AbsenceSession(absence_id=absence_id, session_id=session_id)
+                for absence_id, session_id in compute(absences_filter)
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def update_absences(absence_ids: Iterable) -> None:
+    """
+    Update the links of some absences, after they were created or modified.
+    """
+
+    absence_ids = set(absence_ids)
+    _update(Q(absence_id__in=absence_ids), Q(pk__in=absence_ids))
+
+
+def update_sessions(session_ids: Iterable) -> None:
+    """
+    Update the links of some sessions, after they were created or moved.
+    """
+
+    session_ids = set(session_ids)
+    _update(Q(session_id__in=session_ids), Q(**{f"{SESSIONS_PATH}__in": session_ids}))
+
+
+def update_students(student_ids: Iterable) -> None:
+    """
+    Update the links of the absences of some students, after their groups changed.
+    """
+
+    student_ids = set(student_ids)
+    _update(Q(absence__student_id__in=student_ids), Q(student_id__in=student_ids))
+
+
+def rebuild(chunk_size: int = 1000) -> int:
+    """
+    Rebuild all the links from scratch, by chunks of absences.
+    Return the number of links.
+    """
+
+    count = 0
+
+    with transaction.atomic():
+        models.AbsenceSession.objects.all().delete()
+
+        absence_ids = list(models.Absence.objects.order_by("pk").values_list("pk", flat=True))
+        for index in range(0, len(absence_ids), chunk_size):
+            links = compute(Q(pk__in=absence_ids[index:index + chunk_size]))
+            models.AbsenceSession.objects.bulk_create(
+                models.AbsenceSession(absence_id=absence_id, session_id=session_id)
+                for absence_id, session_id in links
+            )
+            count += len(links)
+
+    return count
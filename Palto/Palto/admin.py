@@ -4,33 +4,88 @@ Admin for the Palto project.
 The admin is the admin page configuration, describing which model should be visible and which field in the admin page.
 """
 
+import uuid
+
 from django.contrib import admin
+from django.db.models import Q
 
-from . import models
+from . import counts, models, search
 
 
 # TODO(Faraphel): plus de list_filter sur "department" ?
 
 
+class UserIndexSearchMixin:
+    """
+    Search the users of the objects with the users search index instead of scanning their names, and the objects by
+    their exact id. The search_fields only contain the other fields of the objects.
+    """
+
+    # the relations to the users searched with the index, "pk" for the users themselves
+    user_search_relations: tuple[str, ...] = ()
+
+    def get_search_fields(self, request):
+        # show the search box even without other fields
+        return super().get_search_fields(request) or ("pk",)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        results, may_have_duplicates = queryset.none(), False
+        if self.search_fields:
+            results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+
+        found = Q()
+
+        users = search.filter_users(models.User.objects.all(), search_term)
+        for relation in self.user_search_relations:
+            found |= Q(**{f"{relation}__in": users})
+
+        # an id is searched exactly
+        try:
+            found |= Q(pk=uuid.UUID(search_term))
+        except ValueError:
+            pass
+
+        return results | queryset.filter(found), may_have_duplicates
+
+
+class EstimatedCountAdminMixin:
+    """
+    Count the objects of the big tables with the estimated or cached counts, and never count the whole table.
+    """
+
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return counts.EstimatedCountPaginator(
+            queryset, per_page, orphans, allow_empty_first_page, user_id=request.user.pk
+        )
+
+
 # Register your models here.
 @admin.register(models.User)
-class AdminUser(admin.ModelAdmin):
+class AdminUser(UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "username", "email", "first_name", "last_name", "is_staff")
-    search_fields = ("id", "username", "email", "first_name", "last_name", "is_staff")
+    search_fields = ()
+    user_search_relations = ("pk",)
     list_filter = ("is_staff",)
 
 
 @admin.register(models.Department)
 class AdminDepartment(admin.ModelAdmin):
     list_display = ("id", "name", "email")
-    search_fields = ("id", "name", "email")
+    search_fields = ("=id", "name", "email")
     readonly_fields = ("id",)
 
 
 @admin.register(models.StudentGroup)
-class AdminStudentGroup(admin.ModelAdmin):
+class AdminStudentGroup(UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "name", "owner", "department")
-    search_fields = ("id", "name", "owner", "department")
+    search_fields = ("name", "department__name")
+    user_search_relations = ("owner",)
     list_filter = ("department",)
     readonly_fields = ("id",)
 
@@ -38,44 +93,109 @@ class AdminStudentGroup(admin.ModelAdmin):
 @admin.register(models.TeachingUnit)
 class AdminTeachingUnit(admin.ModelAdmin):
     list_display = ("id", "name", "email")
-    search_fields = ("id", "name", "email")
+    search_fields = ("=id", "name", "email")
     readonly_fields = ("id",)
 
 
 @admin.register(models.StudentCard)
-class AdminStudentCard(admin.ModelAdmin):
+class AdminStudentCard(UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "uid", "department", "owner")
-    search_fields = ("id", "uid", "department", "owner")
+    search_fields = ("department__name",)
+    user_search_relations = ("owner",)
     readonly_fields = ("id", "uid",)
     list_filter = ("department",)
 
 
+@admin.register(models.ScannerDevice)
+class AdminScannerDevice(UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "name", "department", "teacher", "is_active", "created_at")
+    search_fields = ("name",)
+    user_search_relations = ("teacher",)
+    readonly_fields = ("id", "token_hash", "created_at")
+    list_filter = ("department", "is_active")
+    actions = ("reset_tokens",)
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            # only the hash of the token is saved, it is shown once
+            token = obj.reset_token()
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.message_user(request, f"The token of the device {obj} is {token}, it won't be shown again.")
+
+    @admin.action(description="Reset the tokens of the selected devices")
+    def reset_tokens(self, request, queryset):
+        for device in queryset:
+            token = device.reset_token()
+            device.save(update_fields=["token_hash", "updated_at"])
+            self.message_user(request, f"The new token of the device {device} is {token}, it won't be shown again.")
+
+
 @admin.register(models.TeachingSession)
-class AdminTeachingSession(admin.ModelAdmin):
+class AdminTeachingSession(EstimatedCountAdminMixin, UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "start", "end", "unit", "duration", "teacher")
-    search_fields = ("id", "start", "end", "unit", "duration", "teacher")
+    search_fields = ("unit__name", "group__name")
+    user_search_relations = ("teacher",)
     readonly_fields = ("id",)
     list_filter = ("unit",)
 
 
+@admin.register(models.TeachingSessionSeries)
+class AdminTeachingSessionSeries(UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "unit", "group", "teacher", "weekday", "time", "start_date", "end_date")
+    search_fields = ("unit__name", "group__name")
+    user_search_relations = ("teacher",)
+    readonly_fields = ("id",)
+    list_filter = ("unit", "weekday")
+
+
 @admin.register(models.Attendance)
-class AdminAttendance(admin.ModelAdmin):
+class AdminAttendance(EstimatedCountAdminMixin, UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "date", "student")
-    search_fields = ("id", "date", "student")
+    search_fields = ()
+    user_search_relations = ("student",)
     readonly_fields = ("id",)
     list_filter = ("date",)
 
 
 @admin.register(models.Absence)
-class AdminAbsence(admin.ModelAdmin):
+class AdminAbsence(UserIndexSearchMixin, admin.ModelAdmin):
     list_display = ("id", "message", "student", "start", "end")
-    search_fields = ("id", "message", "student", "start", "end")
+    search_fields = ("message",)
+    user_search_relations = ("student",)
     readonly_fields = ("id",)
     list_filter = ("start", "end")
 
 
 @admin.register(models.AbsenceAttachment)
-class AdminAbsenceAttachment(admin.ModelAdmin):
-    list_display = ("id", "content", "absence")
-    search_fields = ("id", "content", "absence")
+class AdminAbsenceAttachment(UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "filename", "content", "absence")
+    search_fields = ("filename", "content")
+    user_search_relations = ("absence__student",)
+    readonly_fields = ("id",)
+
+
+@admin.register(models.Job)
+class AdminJob(UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "created_at", "finished_at", "owner")
+    search_fields = ("name",)
+    user_search_relations = ("owner",)
+    readonly_fields = ("id", "created_at", "started_at", "finished_at")
+    list_filter = ("status",)
+
+
+@admin.register(models.ArchivedTeachingSession)
+class AdminArchivedTeachingSession(EstimatedCountAdminMixin, UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "academic_year", "start", "unit_name", "group_name", "teacher", "department")
+    search_fields = ("unit_name", "group_name")
+    user_search_relations = ("teacher",)
+    readonly_fields = ("id", "archived_at")
+    list_filter = ("academic_year",)
+
+
+@admin.register(models.ArchivedAttendance)
+class AdminArchivedAttendance(EstimatedCountAdminMixin, UserIndexSearchMixin, admin.ModelAdmin):
+    list_display = ("id", "date", "student", "session")
+    search_fields = ()
+    user_search_relations = ("student",)
     readonly_fields = ("id",)
@@ -0,0 +1,94 @@
+"""
+Tokens for the Palto project's API.
+
+When enabled with JWT_ROLE_CLAIMS, the access tokens contain the ids of the departments and units of their user.
+The API permissions then use these claims instead of querying the memberships on every request. The claims are ignored
+once the roles of the user changed, since the version of his roles no longer match the one of the token.
+"""
+
+import uuid
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Palto.Palto import models
+
+
+ROLES_CLAIM: str = "roles"
+# short names of the roles in the claim, to keep the tokens small
+ROLES_KEYS: dict[str, str] = {
+    "md": "managing_departments",
+    "td": "teaching_departments",
+    "sd": "studying_departments",
+    "mu": "managing_units",
+    "tu": "teaching_units",
+}
+
+
+def make_roles_claim(user: models.User) -> dict:
+    """
+    Return the roles claim of a user.
+    """
+
+    claim = {"v": user.roles_version}
+    for key, name in ROLES_KEYS.items():
+        claim[key] = sorted(str(pk) for pk in getattr(user.roles, name))
+
+    return claim
+
+
+def roles_from_claim(user: models.User, claim: dict) -> models.UserRoles:
+    """
+    Return the roles of a user from a roles claim.
+    """
+
+    return models.UserRoles(user, **{
+        name: [uuid.UUID(pk) for pk in claim.get(key, [])]
+        for key, name in ROLES_KEYS.items()
+    })
+
+
+class RolesTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Same as the base serializer, but the tokens contain the roles of the user.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[ROLES_CLAIM] = make_roles_claim(user)
+        return token
+
+
+class RolesTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Same as the base serializer, but the roles of the new access token are updated.
+    """
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+
+        access = AccessToken(data["access"])
+        user = models.User.objects.filter(**{api_settings.USER_ID_FIELD: access[api_settings.USER_ID_CLAIM]}).first()
+        if user is not None:
+            access[ROLES_CLAIM] = make_roles_claim(user)
+            data["access"] = str(access)
+
+        return data
+
+
+class RolesJWTAuthentication(JWTAuthentication):
+    """
+    Same as the base authentication, but the roles of the user are read from the token when they are up to date.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+
+        claim = validated_token.get(ROLES_CLAIM)
+        if claim is not None and claim.get("v") == user.roles_version:
+            user.roles = roles_from_claim(user, claim)
+
+        return user
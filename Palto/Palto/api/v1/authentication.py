@@ -0,0 +1,113 @@
+"""
+Authentication for the Palto project's API v1.
+
+The scanner devices authenticate with their own token instead of a user account.
+The tokens are checked against an in-memory cache, so the scans don't need to query the database.
+"""
+
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from rest_framework import authentication, exceptions
+
+from Palto.Palto import models, sharding
+
+
+@dataclass(frozen=True)
+class ScannerIdentity:
+    """
+    The authenticated scanner device of a request, used as its "user".
+    """
+
+    id: uuid.UUID
+    department_id: uuid.UUID
+    teacher_id: Optional[uuid.UUID]
+
+    is_authenticated = True
+    is_superuser = False
+
+    @property
+    def pk(self) -> uuid.UUID:
+        return self.id
+
+
+# the identities of the recently used tokens, by hash of the token, with their expiration time.
+# the least recently used ones come first.
+_identities: OrderedDict[str, tuple[float, ScannerIdentity]] = OrderedDict()
+
+
+def forget_device(device_id: uuid.UUID) -> None:
+    """
+    Remove the tokens of a device from the cache of this process, for example when it is disabled.
+    The other processes will forget it once their cache expires.
+    """
+
+    for token_hash, (_, identity) in list(_identities.items()):
+        if identity.id == device_id:
+            _identities.pop(token_hash, None)
+
+
+def get_identity(token: str) -> Optional[ScannerIdentity]:
+    """
+    Return the identity of the device of a token, or None if the token is invalid.
+    """
+
+    token_hash = models.ScannerDevice.hash_token(token)
+
+    cached = _identities.get(token_hash)
+    if cached is not None and cached[0] > time.monotonic():
+        _identities.move_to_end(token_hash)
+        return cached[1]
+
+    # the device can be in any shard
+    device = sharding.find(models.ScannerDevice.objects.filter(
+        token_hash=token_hash, is_active=True
+    ).values_list("id", "department_id", "teacher_id"))
+    if device is None:
+        return None
+
+    # avoid an unbounded growth of the cache, the least recently used entries are removed once it is full
+    _identities.pop(token_hash, None)
+    while _identities and len(_identities) >= settings.SCANNER_TOKEN_CACHE_SIZE:
+        _identities.popitem(last=False)
+
+    identity = ScannerIdentity(*device)
+    _identities[token_hash] = (time.monotonic() + settings.SCANNER_TOKEN_CACHE_TIMEOUT, identity)
+    return identity
+
+
+class ScannerDeviceAuthentication(authentication.BaseAuthentication):
+    """
+    Authenticate the scanner devices with the header "Authorization: Device <token>".
+    """
+
+    keyword: str = "Device"
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed("Invalid device token header.")
+
+        try:
+            token = header[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid device token header.")
+
+        identity = get_identity(token)
+        if identity is None:
+            raise exceptions.AuthenticationFailed("Invalid device token.")
+
+        # the scans of the device are stored in the shard of its department
+        sharding.set_department(identity.department_id)
+
+        return identity, token
+
+    def authenticate_header(self, request):
+        return self.keyword
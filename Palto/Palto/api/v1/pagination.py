@@ -0,0 +1,63 @@
+"""
+Pagination for the Palto project's API v1.
+
+The pagination splits the long lists of objects into pages, with the links to the next and previous ones.
+"""
+
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from ... import counts
+
+
+class EstimatedCountPagination(PageNumberPagination):
+    """
+    Paginate by page number, with the estimated count of the big lists and the cached exact count of the others.
+
+    With "count=none", the objects are not counted at all, for example for an infinite scroll : the "count" is null and
+    only the link to the next page tells if there are more objects.
+    """
+
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.user_id = getattr(request.user, "pk", None)
+        self.uncounted = request.query_params.get(self.count_query_param) == "none"
+        if not self.uncounted:
+            return super().paginate_queryset(queryset, request, view)
+
+        # the number of pages is unknown, the browsable API doesn't show the page controls
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            self.page = counts.UncountedPaginator(queryset, page_size).page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        return list(self.page)
+
+    def django_paginator_class(self, object_list, per_page):
+        return counts.EstimatedCountPaginator(object_list, per_page, user_id=self.user_id)
+
+    def get_paginated_response(self, data):
+        paginator = self.page.paginator
+
+        return Response({
+            "count": paginator.count,
+            "count_estimated": getattr(paginator, "estimated", False),
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count"]["nullable"] = True
+        response_schema["properties"]["count_estimated"] = {"type": "boolean", "example": False}
+        return response_schema
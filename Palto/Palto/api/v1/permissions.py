@@ -9,6 +9,7 @@ from typing import Type
 from rest_framework import permissions
 
 from Palto.Palto import models
+from .authentication import ScannerIdentity
 
 
 def permission_from_helper_class(model: Type[models.ModelPermissionHelper]) -> Type[permissions.BasePermission]:
@@ -30,11 +31,11 @@ def permission_from_helper_class(model: Type[models.ModelPermissionHelper]) -> T
         def has_object_permission(self, request, view, obj: models.User) -> bool:
             if request.method in permissions.SAFE_METHODS:
                 # for reading, only allow if the user can see the object
-                return obj in model.all_visible_by_user(request.user)
+                return obj.is_visible_by_user(request.user)
 
             else:
                 # for writing, only allow if the user can edit the object
-                return obj in model.all_editable_by_user(request.user)
+                return obj.is_editable_by_user(request.user)
 
     return Permission
 
@@ -45,6 +46,29 @@ StudentGroupPermission = permission_from_helper_class(models.StudentGroup)
 TeachingUnitPermission = permission_from_helper_class(models.TeachingUnit)
 StudentCardPermission = permission_from_helper_class(models.StudentCard)
 TeachingSessionPermission = permission_from_helper_class(models.TeachingSession)
+TeachingSessionSeriesPermission = permission_from_helper_class(models.TeachingSessionSeries)
 AttendancePermission = permission_from_helper_class(models.Attendance)
 AbsencePermission = permission_from_helper_class(models.Absence)
 AbsenceAttachmentPermission = permission_from_helper_class(models.AbsenceAttachment)
+JobPermission = permission_from_helper_class(models.Job)
+ScannerDevicePermission = permission_from_helper_class(models.ScannerDevice)
+ArchivedTeachingSessionPermission = permission_from_helper_class(models.ArchivedTeachingSession)
+ArchivedAttendancePermission = permission_from_helper_class(models.ArchivedAttendance)
+
+
+class IsScannerDevice(permissions.BasePermission):
+    """
+    Only allow the requests authenticated as a scanner device.
+    """
+
+    def has_permission(self, request, view) -> bool:
+        return isinstance(request.user, ScannerIdentity)
+
+
+class IsObjectEditable(permissions.BasePermission):
+    """
+    Only allow the users that can edit the object, for the actions on an existing object.
+    """
+
+    def has_object_permission(self, request, view, obj: models.ModelPermissionHelper) -> bool:
+        return obj.is_editable_by_user(request.user)
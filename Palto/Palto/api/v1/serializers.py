@@ -3,19 +3,38 @@ Serializers for the Palto project's API v1.
 
 A serializers tell the API how should a model should be serialized to be used by an external user.
 """
+import copy
+from datetime import date
 from typing import Type
 
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from django.forms import model_to_dict
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
 
-from Palto.Palto import models
+from Palto.Palto import models, changes, conflicts, instrumentation, rosters, series, sharding
 
 
 # TODO(Faraphel): voir les relations inversées ?
 
 
-class ModelSerializerContrains(serializers.ModelSerializer):
+class TimedSerializerMixin:
+    """
+    Measure the time spent validating and representing the data for the Server-Timing header.
+    """
+
+    def run_validation(self, data=serializers.empty):
+        with instrumentation.measure("serializer"):
+            return super().run_validation(data)
+
+    def to_representation(self, instance):
+        with instrumentation.measure("serializer"):
+            return super().to_representation(instance)
+
+
+class ModelSerializerContrains(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Similar to the base ModelSerializer, but automatically check for contrains for the user
     when trying to create a new instance or modifying a field.
@@ -30,9 +49,12 @@ class ModelSerializerContrains(serializers.ModelSerializer):
 
         # for every constraint
         for field, constraints in field_contraints.items():
+            # the fields missing from the request are not set by the user
+            if field not in validated_data:
+                continue
+
             # check if the value is in the constraints.
-            value = validated_data.get(field)
-            if value in constraints(validated_data):
+            if validated_data[field] not in constraints(validated_data):
                 raise PermissionDenied(f"You are not allowed to use this value for the field {field}.")
 
         return super().create(validated_data)
@@ -41,21 +63,24 @@ class ModelSerializerContrains(serializers.ModelSerializer):
         # get the fields that this user can modify
         field_constraints = self.Meta.model.user_fields_contraints(self.context["request"].user)
 
+        # the values of the instance, with the ones of the request, for the fields missing from a partial update
+        data = {field.name: getattr(instance, field.name) for field in instance._meta.concrete_fields}
+        data.update(validated_data)
+
         # for every constraint
         for field, constraints in field_constraints.items():
             # check if the value of the request is in the constraints.
-            value = validated_data.get(field)
-            if value in constraints(validated_data):
+            if field in validated_data and validated_data[field] not in constraints(data):
                 raise PermissionDenied(f"You are not allowed to use this value for the field {field}.")
 
             # check if the value of the already existing instance is in the constraints.
             value = getattr(instance, field, None)
-            if value in constraints(model_to_dict(instance)):
+            if value not in constraints(model_to_dict(instance)):
                 raise PermissionDenied(f"You are not allowed to use this value for the field {field}.")
 
-        # check that the user is managing the department
-        if instance.department not in self.context["request"].user.managing_departments:
-            raise PermissionDenied("You don't manage this department.")
+        # check that the user can edit this instance
+        if not instance.is_editable_by_user(self.context["request"].user):
+            raise PermissionDenied("You are not allowed to edit this object.")
 
         return super().update(instance, validated_data)
 
@@ -71,6 +96,12 @@ class DepartmentSerializer(ModelSerializerContrains):
         model = models.Department
         fields = ['id', 'name', 'email', 'managers', 'teachers', 'students']
 
+    def validate_name(self, value):
+        # the unique validator only checks the shard of the request
+        if sharding.is_department_name_taken(value, self.instance.pk if self.instance is not None else None):
+            raise serializers.ValidationError("department with this name already exists.")
+        return value
+
 
 class StudentGroupSerializer(ModelSerializerContrains):
     class Meta:
@@ -95,6 +126,78 @@ class TeachingSessionSerializer(ModelSerializerContrains):
         model = models.TeachingSession
         fields = ['id', 'start', 'duration', 'note', 'unit', 'group', 'teacher']
 
+    def validate(self, data):
+        data = super().validate(data)
+
+        # check that the session does not overlap with another session of the teacher or the students
+        session = copy.copy(self.instance) if self.instance is not None else models.TeachingSession()
+        for field, value in data.items():
+            setattr(session, field, value)
+
+        session_conflicts = conflicts.check([session])
+        if session_conflicts:
+            raise serializers.ValidationError([str(conflict) for conflict in session_conflicts])
+
+        return data
+
+
+class TeachingSessionSeriesSerializer(ModelSerializerContrains):
+    class Meta:
+        model = models.TeachingSessionSeries
+        fields = [
+            'id', 'weekday', 'time', 'duration', 'start_date', 'end_date', 'exclusions', 'note',
+            'unit', 'group', 'teacher',
+        ]
+
+    def validate_exclusions(self, value):
+        # the exclusions are a list of dates
+        try:
+            return [date.fromisoformat(exclusion).isoformat() for exclusion in value]
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("The exclusions should be a list of dates.")
+
+    def create(self, validated_data):
+        # create the series and all its sessions at once
+        with transaction.atomic():
+            instance = super().create(validated_data)
+
+            try:
+                series.materialize(instance)
+            except DjangoValidationError as error:
+                raise serializers.ValidationError(error.messages)
+
+        return instance
+
+    def update(self, instance, validated_data):
+        # apply the modifications to the future sessions
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+
+            try:
+                series.regenerate(instance)
+            except DjangoValidationError as error:
+                raise serializers.ValidationError(error.messages)
+
+        return instance
+
+
+class TeachingSessionSeriesShiftSerializer(TimedSerializerMixin, serializers.Serializer):
+    delta = serializers.DurationField()
+
+
+class DepartmentPurgeSerializer(TimedSerializerMixin, serializers.Serializer):
+    # only the rows older than this moment, or the whole department if not given
+    before = serializers.DateTimeField(required=False)
+
+
+class TimetableImportSerializer(TimedSerializerMixin, serializers.Serializer):
+    file = serializers.FileField()
+    # the format of the file, guessed from its extension if not given
+    format = serializers.ChoiceField(choices=["ics", "csv"], required=False)
+    # the period of the timetable, the one of its events if not given
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
 
 class AttendanceSerializer(ModelSerializerContrains):
     class Meta:
@@ -111,4 +214,105 @@ class AbsenceSerializer(ModelSerializerContrains):
 class AbsenceAttachmentSerializer(ModelSerializerContrains):
     class Meta:
         model = models.AbsenceAttachment
-        fields = ['id', 'content', 'absence']
+        fields = ['id', 'content', 'filename', 'absence']
+
+
+class JobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = models.Job
+        fields = [
+            'id', 'name', 'status', 'attempts', 'max_attempts', 'result', 'error',
+            'created_at', 'run_after', 'started_at', 'finished_at', 'owner',
+        ]
+        read_only_fields = fields
+
+
+class ArchivedTeachingSessionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = models.ArchivedTeachingSession
+        fields = [
+            'id', 'academic_year', 'start', 'duration', 'note', 'department',
+            'unit_id', 'unit_name', 'group_id', 'group_name', 'teacher', 'archived_at',
+        ]
+        read_only_fields = fields
+
+
+class ArchivedAttendanceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = models.ArchivedAttendance
+        fields = ['id', 'date', 'student', 'session']
+        read_only_fields = fields
+
+
+class ScannerDeviceSerializer(ModelSerializerContrains):
+    # the token is only shown once, when the device is created
+    token = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ScannerDevice
+        fields = ['id', 'name', 'is_active', 'created_at', 'department', 'teacher', 'token']
+
+    def get_token(self, instance: models.ScannerDevice):
+        return getattr(instance, "token", None)
+
+    def validate(self, data):
+        data = super().validate(data)
+
+        # the model validations are not run by the serializers
+        device = copy.copy(self.instance) if self.instance is not None else models.ScannerDevice()
+        for field, value in data.items():
+            setattr(device, field, value)
+
+        try:
+            device.clean()
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.messages)
+
+        return data
+
+    def create(self, validated_data):
+        token = models.ScannerDevice.generate_token()
+        instance = super().create({**validated_data, "token_hash": models.ScannerDevice.hash_token(token)})
+        instance.token = token
+        return instance
+
+
+class UserSearchSerializer(TimedSerializerMixin, serializers.Serializer):
+    # the start of the words of the names, the username or the email of the users
+    q = serializers.CharField()
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        return min(value, settings.USER_SEARCH_LIMIT)
+
+
+class ChangesSerializer(TimedSerializerMixin, serializers.Serializer):
+    # the cursor of the last change already known by the client, to only receive the next ones
+    since = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_since(self, value):
+        try:
+            return changes.decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+    def validate_limit(self, value):
+        return min(value, settings.CHANGES_PAGE_SIZE)
+
+
+class RosterSerializer(TimedSerializerMixin, serializers.Serializer):
+    kind = serializers.ChoiceField(choices=[rosters.EXACT, rosters.BLOOM], required=False)
+    # the version already known by the device, to only receive the differences
+    since = serializers.RegexField(r"^[0-9a-f]{32}$", required=False)
+
+
+class ScanSerializer(TimedSerializerMixin, serializers.Serializer):
+    card = serializers.CharField(help_text="hexadecimal uid of the student card")
+    session = serializers.UUIDField()
+
+    def validate_card(self, value):
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            raise serializers.ValidationError("The card uid should be hexadecimal.")
@@ -3,21 +3,86 @@ Tests for the Palto project's API v1.
 
 Everything to test the API v1 is described here.
 """
-
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework import test
+from rest_framework_simplejwt.tokens import AccessToken
+
+from Palto.Palto import changes, factories, jobs, metrics, models, rosters, sharding
+from Palto.Palto.api import tokens
+from Palto.Palto.api.v1 import authentication, serializers
+
 
-from Palto.Palto import factories, models
-from Palto.Palto.api.v1 import serializers
+@override_settings(DATABASE_REPLICAS=[])
+class ApiTestCase(test.APITestCase):
+    # the replicas are mirrors of the default database in the tests, but the sqlite test databases can't share the
+    # transaction of a test between two connections : the reads are sent to the default database directly.
+    # the routing to the replicas is tested by DatabaseReplicaTestCase.
 
+    # the partitioned models are saved in the shards when they are configured
+    databases = {"default", *settings.DATABASE_SHARDS}
 
-class TokenJwtTestCase(test.APITestCase):
+
+class TokenJwtTestCase(ApiTestCase):
     """
     Test the JWT token creation
     """
 
 
-class UserApiTestCase(test.APITestCase):
+class RolesTokenTestCase(ApiTestCase):
+    """
+    Test the roles claims of the JWT tokens
+    """
+
+    def setUp(self):
+        user = factories.FakeUserFactory()
+        self.department = factories.FakeDepartmentFactory(managers=[user], teachers=[], students=[])
+        self.user = models.User.objects.get(pk=user.pk)
+
+    def _authenticate(self, refresh) -> models.User:
+        return tokens.RolesJWTAuthentication().get_user(AccessToken(str(refresh.access_token)))
+
+    def test_claims(self):
+        """ Test that the roles are read from the token without querying the memberships """
+
+        refresh = tokens.RolesTokenObtainPairSerializer.get_token(self.user)
+        user = self._authenticate(refresh)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(user.roles.managing_departments, {self.department.pk})
+            self.assertEqual(user.roles.teaching_units, set())
+
+    def test_claims_outdated(self):
+        """ Test that the roles claims are ignored once the roles of the user changed """
+
+        refresh = tokens.RolesTokenObtainPairSerializer.get_token(self.user)
+
+        other_department = factories.FakeDepartmentFactory(managers=[], teachers=[], students=[])
+        other_department.managers.add(self.user)
+
+        user = self._authenticate(refresh)
+        self.assertEqual(user.roles.managing_departments, {self.department.pk, other_department.pk})
+
+        # a new token contain the new roles
+        refresh = tokens.RolesTokenObtainPairSerializer.get_token(models.User.objects.get(pk=self.user.pk))
+        user = self._authenticate(refresh)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(user.roles.managing_departments), 2)
+
+
+class UserApiTestCase(ApiTestCase):
     # fake user data for creations test
     USER_CREATION_DATA: dict = {
         "username": "billybob",
@@ -93,7 +158,102 @@ class UserApiTestCase(test.APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
 
-class DepartmentApiTestCase(test.APITestCase):
+class UserImportApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_manager = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory()
+
+        # the names of the fake departments can contain commas
+        self.department = factories.FakeDepartmentFactory(
+            name="Sciences", managers=[self.user_manager], teachers=[], students=[self.user_student]
+        )
+        self.other_department = factories.FakeDepartmentFactory(name="Letters", managers=[], teachers=[], students=[])
+
+    def upload(self, content: str):
+        file = SimpleUploadedFile("students.csv", content.encode(), content_type="text/csv")
+        return self.client.post("/api/v1/users/import/", data={"file": file}, format="multipart")
+
+    def test_permission_manager(self):
+        """ Test that the managers can only import students into their departments """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.upload(
+            "username,department\n"
+            f"new,{self.department.name}\n"
+            f"other,{self.other_department.name}\n"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertEqual([error["line"] for error in response.json()["errors"]], [3])
+        self.assertFalse(models.User.objects.filter(username="other").exists())
+
+        # the file must have the required columns
+        response = self.upload("username\nnew\n")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_permission_existing_users(self):
+        """ Test that the managers can only update the existing students of their departments """
+
+        user_admin = factories.FakeUserFactory(is_superuser=True, email="admin@palto.invalid")
+        user_outsider = factories.FakeUserFactory(email="outsider@palto.invalid")
+        self.client.force_login(self.user_manager)
+
+        response = self.upload(
+            "username,email,department\n"
+            f"{user_admin.username},attacker@palto.invalid,{self.department.name}\n"
+            f"{user_outsider.username},attacker@palto.invalid,{self.department.name}\n"
+            f"{self.user_student.username},student@palto.invalid,{self.department.name}\n"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["updated"], 1)
+        self.assertEqual([error["line"] for error in response.json()["errors"]], [2, 3])
+
+        user_admin.refresh_from_db()
+        self.assertEqual(user_admin.email, "admin@palto.invalid")
+        self.assertFalse(user_admin.studying_departments.exists())
+        user_outsider.refresh_from_db()
+        self.assertEqual(user_outsider.email, "outsider@palto.invalid")
+        self.user_student.refresh_from_db()
+        self.assertEqual(self.user_student.email, "student@palto.invalid")
+
+    def test_permission_student(self):
+        """ Test that the students can't import students """
+
+        self.client.force_login(self.user_student)
+
+        response = self.upload(f"username,department\nnew,{self.department.name}\n")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class UserSearchApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_teacher = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory(first_name="Jérôme", last_name="Dupont")
+        # a student of another department with the same name
+        self.user_other = factories.FakeUserFactory(first_name="Jérôme", last_name="Dupond")
+
+        factories.FakeDepartmentFactory(managers=[], teachers=[self.user_teacher], students=[self.user_student])
+        factories.FakeDepartmentFactory(managers=[], teachers=[], students=[self.user_other])
+
+    def test_search(self):
+        """ Test the autocompletion of the visible users """
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.get("/api/v1/users/search/", data={"q": "jer dup"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([user["id"] for user in response.json()], [str(self.user_student.pk)])
+
+        response = self.client.get("/api/v1/users/search/", data={"q": "jer", "limit": 1000})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn(str(self.user_other.pk), [user["id"] for user in response.json()])
+
+        response = self.client.get("/api/v1/users/search/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DepartmentApiTestCase(ApiTestCase):
     # fake department creation test
     DEPARTMENT_CREATION_DATA: dict = {
         "name": "UFR des Sciences",
@@ -120,7 +280,82 @@ class DepartmentApiTestCase(test.APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 
-class StudentGroupApiTestCase(test.APITestCase):
+class DepartmentPurgeApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_manager = factories.FakeUserFactory()
+        self.user_teacher = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[self.user_manager], teachers=[self.user_teacher], students=[]
+        )
+
+    def test_permission_manager(self):
+        """ Test that the managers can purge their department in the background """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.client.post(
+            f"/api/v1/departments/{self.department.pk}/purge/", data={"before": "2020-09-01T00:00:00Z"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        job = models.Job.objects.get(pk=response.json()["id"])
+        self.assertEqual(job.name, "Palto.Palto.purge.run")
+        self.assertEqual(job.arguments["department_id"], str(self.department.pk))
+
+    def test_permission_manager_whole(self):
+        """ Test that the managers can't purge their whole department """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.client.post(f"/api/v1/departments/{self.department.pk}/purge/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(models.Job.objects.exists())
+
+        # the superusers can
+        self.client.force_login(factories.FakeUserFactory(is_superuser=True))
+        response = self.client.post(f"/api/v1/departments/{self.department.pk}/purge/")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_permission_teacher(self):
+        """ Test that the teachers can't purge their department """
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.post(f"/api/v1/departments/{self.department.pk}/purge/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(models.Job.objects.exists())
+
+
+class DepartmentTimetableApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_manager = factories.FakeUserFactory(username="manager")
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[self.user_manager], teachers=[self.user_manager], students=[]
+        )
+        factories.FakeTeachingUnitFactory(name="Algebra", department=self.department, managers=[], teachers=[])
+        factories.FakeStudentGroupFactory(name="Group A", department=self.department, students=[])
+
+    def test_permission_manager(self):
+        """ Test that the managers can import the timetable of their department """
+
+        self.client.force_login(self.user_manager)
+
+        file = SimpleUploadedFile("timetable.csv", (
+            "uid,start,end,unit,group,teacher\n"
+            "1,2030-01-07T08:00:00+00:00,2030-01-07T10:00:00+00:00,Algebra,Group A,manager\n"
+        ).encode(), content_type="text/csv")
+
+        response = self.client.post(
+            f"/api/v1/departments/{self.department.pk}/timetable/", data={"file": file}, format="multipart"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["created"], 1)
+        self.assertTrue(models.TeachingSession.objects.filter(source_uid="1").exists())
+
+
+class StudentGroupApiTestCase(ApiTestCase):
     def setUp(self):
         self.user_admin = factories.FakeUserFactory(is_superuser=True)
         self.user_other = factories.FakeUserFactory()
@@ -178,25 +413,566 @@ class StudentGroupApiTestCase(test.APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class TeachingUnitApiTestCase(test.APITestCase):
+class TeachingUnitApiTestCase(ApiTestCase):
     pass
 
 
-class StudentCardApiTestCase(test.APITestCase):
+class StudentCardApiTestCase(ApiTestCase):
     pass
 
 
-class TeachingSessionApiTestCase(test.APITestCase):
-    pass
+class TeachingSessionApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_teacher = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(teachers=[self.user_teacher])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.user_teacher])
+        self.session = factories.FakeTeachingSessionFactory(unit=self.unit, teacher=self.user_teacher)
+
+    def test_partial_update(self):
+        """ Test that a teacher can partially update his session without giving the constrained fields """
+
+        self.client.force_login(self.user_teacher)
 
+        response = self.client.patch(f"/api/v1/teaching_sessions/{self.session.pk}/", data={"note": "x"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.note, "x")
+
+    def test_permission_partial_update(self):
+        """ Test that a teacher can't move his session to a unit of another department with a partial update """
+
+        other_unit = factories.FakeTeachingUnitFactory()
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.patch(f"/api/v1/teaching_sessions/{self.session.pk}/", data={"unit": other_unit.pk})
+        # a unit stored in another shard doesn't even exist for the session
+        if sharding.is_enabled() and sharding.shard_of(other_unit) != sharding.shard_of(self.session):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        else:
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.unit, self.unit)
+
+
+class TeachingSessionSeriesApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_manager = factories.FakeUserFactory()
+        self.user_teacher = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(managers=[self.user_manager], teachers=[self.user_teacher])
+        self.group = factories.FakeStudentGroupFactory(department=self.department)
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.user_teacher])
+
+        self.start_date = timezone.localdate() + timedelta(days=1)
+
+    def test_create_and_shift(self):
+        """ Test that a series create all its sessions in a single request, and can be shifted """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.client.post("/api/v1/teaching_sessions_series/", data={
+            "weekday": self.start_date.weekday(),
+            "time": "10:00",
+            "duration": "01:30:00",
+            "start_date": self.start_date.isoformat(),
+            "end_date": (self.start_date + timedelta(weeks=4)).isoformat(),
+            "exclusions": [(self.start_date + timedelta(weeks=1)).isoformat()],
+            "unit": self.unit.pk,
+            "group": self.group.pk,
+            "teacher": self.user_teacher.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        series = models.TeachingSessionSeries.objects.get(pk=response.json()["id"])
+        self.assertEqual(series.sessions.count(), 4)
+
+        response = self.client.post(
+            f"/api/v1/teaching_sessions_series/{series.pk}/shift/",
+            data={"delta": "00:30:00"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["shifted"], 4)
+        self.assertTrue(all(
+            timezone.localtime(session.start).minute == 30
+            for session in series.sessions.all()
+        ))
+
+    def test_permission_unrelated(self):
+        """ Test that a teacher of another unit can't create a series for this unit """
+
+        user_other = factories.FakeUserFactory()
+        other_department = factories.FakeDepartmentFactory(teachers=[user_other])
+        factories.FakeTeachingUnitFactory(department=other_department, teachers=[user_other])
+
+        self.client.force_login(user_other)
+
+        response = self.client.post("/api/v1/teaching_sessions_series/", data={
+            "weekday": self.start_date.weekday(),
+            "time": "10:00",
+            "duration": "01:30:00",
+            "start_date": self.start_date.isoformat(),
+            "end_date": (self.start_date + timedelta(weeks=4)).isoformat(),
+            "unit": self.unit.pk,
+            "group": self.group.pk,
+            "teacher": self.user_teacher.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(models.TeachingSessionSeries.objects.exists())
 
-class AttendanceApiTestCase(test.APITestCase):
+
+class AttendanceApiTestCase(ApiTestCase):
     pass
 
 
-class AbsenceApiTestCase(test.APITestCase):
+class AbsenceApiTestCase(ApiTestCase):
     pass
 
 
-class AbsenceAttachmentApiTestCase(test.APITestCase):
+class AbsenceAttachmentApiTestCase(ApiTestCase):
     pass
+
+
+class JobApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_owner = factories.FakeUserFactory()
+        self.user_other = factories.FakeUserFactory()
+
+        self.job = jobs.enqueue("Palto.Palto.tests.job_add", owner=self.user_owner, a=1, b=2)
+
+    def test_permission_owner(self):
+        """ Test the API permission for the owner of the job """
+
+        self.client.force_login(self.user_owner)
+
+        # check for a get request
+        response = self.client.get(f"/api/v1/jobs/{self.job.pk}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["status"], models.Job.Status.PENDING)
+
+        # check that the jobs can't be created from the API
+        response = self.client.post("/api/v1/jobs/", data={"name": "os.system"})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_permission_unrelated(self):
+        """ Test the API permission for an unrelated user """
+
+        self.client.force_login(self.user_other)
+
+        response = self.client.get("/api/v1/jobs/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 0)
+
+
+class ScannerDeviceApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_manager = factories.FakeUserFactory()
+        self.user_teacher = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[self.user_manager], teachers=[self.user_teacher], students=[self.user_student]
+        )
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.user_student])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.user_teacher])
+        self.session = factories.FakeTeachingSessionFactory(
+            unit=self.unit, group=self.group, teacher=self.user_teacher
+        )
+        self.card = models.StudentCard.objects.create(
+            uid=bytes.fromhex("04a1b2c3d4e5f6"), department=self.department, owner=self.user_student
+        )
+
+        self.device = models.ScannerDevice(name="reader", department=self.department)
+        self.token = self.device.reset_token()
+        self.device.save()
+
+    def _scan(self, token: str):
+        return self.client.post(
+            "/api/v1/scans/",
+            data={"card": "04a1b2c3d4e5f6", "session": str(self.session.pk)},
+            format="json",
+            HTTP_AUTHORIZATION=f"Device {token}",
+        )
+
+    def test_create(self):
+        """ Test that the token of a new device is only given once """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.client.post("/api/v1/scanner_devices/", data={
+            "name": "entrance", "department": self.department.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        token = response.json()["token"]
+        self.assertIsNotNone(token)
+
+        response = self.client.get(f"/api/v1/scanner_devices/{response.json()['id']}/")
+        self.assertIsNone(response.json()["token"])
+
+        self.client.logout()
+        self.assertEqual(self._scan(token).status_code, status.HTTP_201_CREATED)
+
+    def test_create_teacher(self):
+        """ Test that the teacher of a device must teach in its department """
+
+        self.client.force_login(self.user_manager)
+
+        response = self.client.post("/api/v1/scanner_devices/", data={
+            "name": "office", "department": self.department.pk, "teacher": self.user_student.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post("/api/v1/scanner_devices/", data={
+            "name": "office", "department": self.department.pk, "teacher": self.user_teacher.pk,
+        }, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_scan(self):
+        """ Test that a scan register the attendance without checking the device in the database again """
+
+        response = self._scan(self.token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(models.Attendance.objects.filter(session=self.session, student=self.user_student).exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self._scan(self.token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any("scannerdevice" in query["sql"].lower() for query in queries.captured_queries))
+
+    @override_settings(SCANNER_TOKEN_CACHE_SIZE=2)
+    def test_token_cache_size(self):
+        """ Test that the cache of the tokens evicts the least recently used ones once it is full """
+
+        authentication._identities.clear()
+
+        tokens = [self.token]
+        for index in range(2):
+            device = models.ScannerDevice(name=f"reader {index}", department=self.department)
+            tokens.append(device.reset_token())
+            device.save()
+
+        for token in tokens:
+            self.assertIsNotNone(authentication.get_identity(token))
+
+        self.assertEqual(len(authentication._identities), 2)
+        self.assertNotIn(models.ScannerDevice.hash_token(tokens[0]), authentication._identities)
+
+    def test_scan_metrics(self):
+        """ Test that the outcome of every scan is counted """
+
+        def outcomes():
+            return {json.loads(key)[0][1]: value for key, value in metrics.snapshot()["palto_scans"].items()}
+
+        before = outcomes()
+        self._scan(self.token)
+        self._scan(self.token)
+        self.group.students.remove(self.user_student)
+        self._scan(self.token)
+        self.card.delete()
+        self._scan(self.token)
+
+        after = outcomes()
+        for outcome in ("accepted", "duplicate", "not_on_roster", "unknown_card"):
+            self.assertEqual(after[outcome], before.get(outcome, 0) + 1)
+
+    def test_scan_disabled(self):
+        """ Test that a disabled device can't scan anymore """
+
+        self.assertEqual(self._scan(self.token).status_code, status.HTTP_201_CREATED)
+
+        self.device.is_active = False
+        self.device.save()
+
+        self.assertEqual(self._scan(self.token).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._scan("invalid").status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_scan_other_teacher(self):
+        """ Test that a device registered to a teacher can't scan for the sessions of another teacher """
+
+        self.device.teacher = factories.FakeUserFactory()
+        self.device.save()
+
+        self.assertEqual(self._scan(self.token).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_scan_user(self):
+        """ Test that a user can't use the scan endpoint """
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.post(
+            "/api/v1/scans/", data={"card": "04a1b2c3d4e5f6", "session": str(self.session.pk)}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class RosterApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_teacher = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[], teachers=[self.user_teacher], students=[self.user_student]
+        )
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.user_student])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.user_teacher])
+        self.session = factories.FakeTeachingSessionFactory(
+            start=timezone.now() + timedelta(hours=1), duration=timedelta(hours=2),
+            unit=self.unit, group=self.group, teacher=self.user_teacher,
+        )
+        # a finished session, absent from the roster
+        factories.FakeTeachingSessionFactory(
+            start=timezone.now() - timedelta(hours=3), duration=timedelta(hours=2),
+            unit=self.unit, group=self.group, teacher=self.user_teacher,
+        )
+        models.StudentCard.objects.create(
+            uid=bytes.fromhex("04a1b2c3d4e5f6"), department=self.department, owner=self.user_student
+        )
+
+        self.device = models.ScannerDevice(name="reader", department=self.department)
+        self.token = self.device.reset_token()
+        self.device.save()
+
+    def _roster(self, **kwargs):
+        return self.client.get("/api/v1/scans/roster/", HTTP_AUTHORIZATION=f"Device {self.token}", **kwargs)
+
+    def test_exact(self):
+        """ Test the roster with the exact cards of the students """
+
+        response = self._roster()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        roster = response.json()
+        self.assertEqual(list(roster["sessions"]), [str(self.session.pk)])
+        self.assertEqual(roster["groups"], {str(self.group.pk): [str(self.user_student.pk)]})
+        self.assertEqual(roster["cards"], {"04a1b2c3d4e5f6": str(self.user_student.pk)})
+        self.assertEqual(response["ETag"], f'"{roster["version"]}"')
+
+        # the unchanged roster is not sent again
+        response = self._roster(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_delta(self):
+        """ Test that only the differences with a known version are sent """
+
+        version = self._roster().json()["version"]
+
+        models.StudentCard.objects.create(
+            uid=bytes.fromhex("04ffffffffffff"), department=self.department, owner=self.user_student
+        )
+
+        roster = self._roster(data={"since": version}).json()
+        self.assertEqual(roster["since"], version)
+        self.assertEqual(roster["changed"]["cards"], {"04ffffffffffff": str(self.user_student.pk)})
+        self.assertEqual(roster["changed"]["sessions"], {})
+        self.assertEqual(roster["removed"]["cards"], [])
+
+        # an unknown version gives the whole roster
+        roster = self._roster(data={"since": "0" * 32}).json()
+        self.assertEqual(len(roster["cards"]), 2)
+
+    def test_bloom(self):
+        """ Test the roster with a Bloom filter of the cards of every group """
+
+        roster = self._roster(data={"kind": "bloom"}).json()
+
+        self.assertNotIn("cards", roster)
+        bloom = roster["groups"][str(self.group.pk)]
+        self.assertTrue(rosters.bloom_contains(bloom, bytes.fromhex("04a1b2c3d4e5f6")))
+
+    def test_user(self):
+        """ Test that a user can't download a roster """
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.get("/api/v1/scans/roster/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class ChangesApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_teacher = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory()
+        self.user_other = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[], teachers=[self.user_teacher], students=[self.user_student]
+        )
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.user_student])
+        self.unit = factories.FakeTeachingUnitFactory(
+            department=self.department, managers=[], teachers=[self.user_teacher], student_groups=[self.group]
+        )
+        self.sessions = [
+            factories.FakeTeachingSessionFactory(unit=self.unit, group=self.group, teacher=self.user_teacher)
+            for _ in range(3)
+        ]
+
+        # the sessions of another department
+        factories.FakeTeachingSessionFactory()
+
+    def _changes(self, **params):
+        return self.client.get("/api/v1/teaching_sessions/changes/", data=params)
+
+    def test_feed(self):
+        """ Test the changes of the sessions since a cursor """
+
+        self.client.force_login(self.user_teacher)
+
+        # the first synchronisation gives every visible session, page by page
+        response = self._changes(limit=2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.json()
+        self.assertTrue(first["more"])
+
+        second = self._changes(since=first["cursor"], limit=2).json()
+        self.assertFalse(second["more"])
+
+        results = [*first["results"], *second["results"]]
+        self.assertEqual({result["id"] for result in results}, {str(session.pk) for session in self.sessions})
+        self.assertEqual({result["change"] for result in results}, {"created"})
+        self.assertEqual(results[0]["object"]["id"], results[0]["id"])
+
+        # nothing changed since then
+        third = self._changes(since=second["cursor"]).json()
+        self.assertEqual((third["results"], third["cursor"]), ([], second["cursor"]))
+
+        # the next synchronisation only gives the changes
+        updated, deleted = self.sessions[0], self.sessions[1]
+        deleted_id = deleted.pk
+        updated.note = "moved"
+        updated.save()
+        deleted.delete()
+        created = factories.FakeTeachingSessionFactory(unit=self.unit, group=self.group, teacher=self.user_teacher)
+
+        results = self._changes(since=second["cursor"]).json()["results"]
+        self.assertEqual([(result["id"], result["change"]) for result in results], [
+            (str(updated.pk), "updated"),
+            (str(deleted_id), "deleted"),
+            (str(created.pk), "created"),
+        ])
+        self.assertNotIn("object", results[1])
+
+    def test_visibility(self):
+        """ Test that the changes only concern the objects visible by the user """
+
+        self.client.force_login(self.user_other)
+        cursor = changes.encode_cursor(timezone.now(), uuid.UUID(int=0))
+
+        self.sessions[0].save()
+        self.sessions[1].delete()
+        factories.FakeTeachingSessionFactory(unit=self.unit, group=self.group, teacher=self.user_teacher)
+
+        self.assertEqual(self._changes().json()["results"], [])
+        self.assertEqual(self._changes(since=cursor).json()["results"], [])
+
+    def test_expired(self):
+        """ Test that a too old cursor requires a full synchronisation """
+
+        self.client.force_login(self.user_teacher)
+
+        cursor = changes.encode_cursor(timezone.now() - timedelta(days=365), uuid.UUID(int=0))
+        self.assertEqual(self._changes(since=cursor).status_code, status.HTTP_410_GONE)
+        self.assertEqual(self._changes(since="invalid").status_code, status.HTTP_400_BAD_REQUEST)
+        # a cursor without timezone
+        cursor = changes.encode_cursor(datetime(2099, 1, 1), uuid.UUID(int=0))
+        self.assertEqual(self._changes(since=cursor).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PaginationApiTestCase(ApiTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user_admin = factories.FakeUserFactory(is_superuser=True)
+        models.Department.objects.bulk_create([
+            models.Department(name=f"Department {index}", email=f"department{index}@palto.invalid")
+            for index in range(31)
+        ])
+
+    def test_count(self):
+        """ Test the count of the lists """
+
+        self.client.force_login(self.user_admin)
+
+        response = self.client.get("/api/v1/departments/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 31)
+        self.assertFalse(response.json()["count_estimated"])
+        self.assertEqual(len(response.json()["results"]), 30)
+
+    def test_uncounted(self):
+        """ Test the lists without their count """
+
+        self.client.force_login(self.user_admin)
+
+        response = self.client.get("/api/v1/departments/", data={"count": "none"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()["count"])
+        self.assertIn("count=none", response.json()["next"])
+        self.assertEqual(len(response.json()["results"]), 30)
+
+        response = self.client.get(response.json()["next"])
+        self.assertIsNone(response.json()["next"])
+        self.assertEqual(len(response.json()["results"]), 1)
+
+        response = self.client.get("/api/v1/departments/", data={"count": "none", "page": 3})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ArchivedAttendanceApiTestCase(ApiTestCase):
+    def setUp(self):
+        self.user_teacher = factories.FakeUserFactory()
+        self.user_student = factories.FakeUserFactory()
+        self.user_other = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[], teachers=[self.user_teacher], students=[self.user_student, self.user_other]
+        )
+        self.session = models.ArchivedTeachingSession.objects.create(
+            id=uuid.uuid4(), academic_year=2020, start=timezone.now(), duration=timedelta(hours=2),
+            department=self.department, unit_id=uuid.uuid4(), unit_name="Algebra",
+            group_id=uuid.uuid4(), group_name="Group A", teacher=self.user_teacher,
+        )
+        self.attendance = models.ArchivedAttendance.objects.create(
+            id=uuid.uuid4(), date=timezone.now(), student=self.user_student, session=self.session,
+        )
+
+    def test_permission_student(self):
+        """ Test the API permission for the student of the archived attendance """
+
+        self.client.force_login(self.user_student)
+
+        response = self.client.get("/api/v1/archived_attendances/", data={"academic_year": 2020})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["count"], 1)
+
+        response = self.client.get("/api/v1/archived_attendances/", data={"academic_year": 2021})
+        self.assertEqual(response.json()["count"], 0)
+
+        # check that the archives are read-only
+        response = self.client.delete(f"/api/v1/archived_attendances/{self.attendance.pk}/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_permission_unrelated(self):
+        """ Test the API permission for an unrelated user """
+
+        self.client.force_login(self.user_other)
+
+        response = self.client.get("/api/v1/archived_sessions/")
+        self.assertEqual(response.json()["count"], 0)
+
+        response = self.client.get(f"/api/v1/archived_attendances/{self.attendance.pk}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export(self):
+        """ Test the CSV export of the archived attendances """
+
+        self.client.force_login(self.user_teacher)
+
+        response = self.client.get("/api/v1/archived_attendances/export/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][0], "academic_year")
+        self.assertEqual(rows[1][3:7], ["Algebra", "Group A", str(self.user_student.pk), self.user_student.username])
@@ -0,0 +1,24 @@
+"""
+Throttling for the Palto project's API v1.
+
+A throttle limit the number of requests that a user or a device can make in a period.
+"""
+
+from rest_framework.throttling import SimpleRateThrottle
+
+from .authentication import ScannerIdentity
+
+
+class ScannerDeviceRateThrottle(SimpleRateThrottle):
+    """
+    Limit the rate of the scans of every device.
+    The scans come in bursts at the start of the sessions, so their rate is much higher than the users one.
+    """
+
+    scope = "scanner"
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.user, ScannerIdentity):
+            return None
+
+        return self.cache_format % {"scope": self.scope, "ident": request.user.pk}
@@ -5,6 +5,7 @@ All the urls for every model of the API are described here.
 """
 
 
+from django.urls import path
 from rest_framework import routers
 
 from . import views
@@ -19,8 +20,16 @@ router.register(r'student_groups', views.StudentGroupViewSet, basename="StudentG
 router.register(r'teaching_units', views.TeachingUnitViewSet, basename="TeachingUnit")
 router.register(r'student_cards', views.StudentCardViewSet, basename="StudentCard")
 router.register(r'teaching_sessions', views.TeachingSessionViewSet, basename="TeachingSession")
+router.register(r'teaching_sessions_series', views.TeachingSessionSeriesViewSet, basename="TeachingSessionSeries")
 router.register(r'attendances', views.AttendanceViewSet, basename="Attendance")
 router.register(r'absences', views.AbsenceViewSet, basename="Absence")
 router.register(r'absence_attachments', views.AbsenceAttachmentViewSet, basename="AbsenceAttachment")
-
-urlpatterns = router.urls
+router.register(r'jobs', views.JobViewSet, basename="Job")
+router.register(r'scanner_devices', views.ScannerDeviceViewSet, basename="ScannerDevice")
+router.register(r'archived_sessions', views.ArchivedTeachingSessionViewSet, basename="ArchivedTeachingSession")
+router.register(r'archived_attendances', views.ArchivedAttendanceViewSet, basename="ArchivedAttendance")
+
+urlpatterns = router.urls + [
+    path('scans/', views.ScanView.as_view(), name="scan"),
+    path('scans/roster/', views.RosterView.as_view(), name="roster"),
+]
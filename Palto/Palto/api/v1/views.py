@@ -3,28 +3,45 @@ Views for the Palto project's API v1.
 
 An API view describe which models should display which files to user with which permissions.
 """
+import csv
+import io
 from typing import Type
 
-from rest_framework import viewsets
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, NotFound, PermissionDenied
+from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, BasePermission
+from rest_framework.response import Response
 from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
 
+from . import authentication
 from . import permissions
 from . import serializers
-from ... import models
+from . import throttling
+from ... import changes as changes_feeds, imports, jobs, models, metrics, rosters, search, series, sharding
 
 
 def view_from_helper_class(
         model_class: Type[models.ModelPermissionHelper],
         serializer_class: Type[BaseSerializer],
         permission_classes: list[Type[BasePermission]],
-) -> Type[viewsets.ModelViewSet]:
+        viewset_class: Type[viewsets.GenericViewSet] = viewsets.ModelViewSet,
+) -> Type[viewsets.GenericViewSet]:
     """
     Create a view class from a model if it implements ModelPermissionHelper.
     This make creating view easier to understand and less redundant.
     """
 
-    class ViewSet(viewsets.ModelViewSet):
+    class ViewSet(viewset_class):
         nonlocal serializer_class, permission_classes, model_class
 
         def get_serializer_class(self):
@@ -36,19 +53,171 @@ def view_from_helper_class(
         def get_queryset(self):
             return model_class.all_visible_by_user(self.request.user)
 
+        def list(self, request, *args, **kwargs):
+            # without the department of the request, the objects of every shard are listed
+            queryset = sharding.fan_out(self.filter_queryset(self.get_queryset()))
+
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        @action(detail=False, methods=["get"])
+        def changes(self, request):
+            """
+            List the ids of the visible objects created, updated and deleted since a cursor, in the order of their
+            changes, with the created and updated objects.
+            """
+
+            serializer = serializers.ChangesSerializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+
+            since = serializer.validated_data.get("since")
+            if since is not None and since[0] < changes_feeds.prune_before():
+                # the tombstones of the deletions since then might not exist anymore
+                return Response(
+                    {"detail": "The cursor is too old, the objects should be synchronised again from the start."},
+                    status=status.HTTP_410_GONE,
+                )
+
+            results, more = changes_feeds.feed(
+                self.filter_queryset(self.get_queryset()),
+                request.user,
+                since,
+                serializer.validated_data.get("limit", settings.CHANGES_PAGE_SIZE),
+            )
+
+            entries = []
+            for change in results:
+                entry = {"id": change.id, "change": change.change, "at": change.at.isoformat()}
+                if change.instance is not None:
+                    entry["object"] = self.get_serializer(change.instance).data
+                entries.append(entry)
+
+            return Response({
+                "results": entries,
+                # the cursor to give to the next request, unchanged if nothing changed
+                "cursor": results[-1].cursor if results else request.query_params.get("since"),
+                "more": more,
+            })
+
+    # the model of the objects, used to find their shard from the url
+    ViewSet.model_class = model_class
+
     return ViewSet
 
 
-UserViewSet = view_from_helper_class(
+class UserViewSet(view_from_helper_class(
     model_class=models.User,
     serializer_class=serializers.UserSerializer,
     permission_classes=[IsAuthenticated, permissions.UserPermission]
-)
-DepartmentViewSet = view_from_helper_class(
+)):
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser])
+    def import_students(self, request):
+        """
+        Import the students, their cards and their groups of a CSV file into the departments managed by the user.
+        """
+
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "A CSV file is required."})
+
+        try:
+            report = imports.import_students(
+                io.TextIOWrapper(upload.file, encoding="utf-8-sig"),
+                imports.editable_departments(request.user),
+                user=request.user,
+            )
+        except (DjangoValidationError, UnicodeDecodeError) as error:
+            raise ValidationError({"file": getattr(error, "messages", [str(error)])})
+
+        return Response(report.as_dict())
+
+    @action(detail=False, methods=["get"], url_path="search")
+    def autocomplete(self, request):
+        """
+        Autocomplete the visible users from the start of the words of their names, username or email.
+        """
+
+        serializer = serializers.UserSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        users = search.search_users(
+            request.user,
+            serializer.validated_data["q"],
+            serializer.validated_data.get("limit", settings.USER_SEARCH_LIMIT),
+        )
+
+        return Response(self.get_serializer(users, many=True).data)
+
+
+class DepartmentViewSet(view_from_helper_class(
     model_class=models.Department,
     serializer_class=serializers.DepartmentSerializer,
     permission_classes=[IsAuthenticated, permissions.DepartmentPermission]
-)
+)):
+    def get_permissions(self):
+        if self.action in ("purge", "import_timetable"):
+            # the managers can manage their department without being allowed to create departments
+            return [IsAuthenticated(), permissions.IsObjectEditable()]
+        return super().get_permissions()
+
+    @action(detail=True, methods=["post"])
+    def purge(self, request, pk=None):
+        """
+        Delete in the background the department, or only its rows older than a moment, by small batches.
+        """
+
+        instance = self.get_object()
+
+        serializer = serializers.DepartmentPurgeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        before = serializer.validated_data.get("before")
+        if before is None and not request.user.is_superuser:
+            # like its deletion, only the superusers can purge a whole department
+            raise PermissionDenied("Only the superusers can purge a whole department.")
+
+        job = jobs.enqueue(
+            "Palto.Palto.purge.run",
+            owner=request.user,
+            department_id=str(instance.pk),
+            before=before.isoformat() if before is not None else None,
+        )
+
+        return Response(serializers.JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["post"], url_path="timetable", parser_classes=[MultiPartParser])
+    def import_timetable(self, request, pk=None):
+        """
+        Import the sessions of an ICS or CSV timetable, updating the sessions of the previous imports.
+        """
+
+        instance = self.get_object()
+
+        serializer = serializers.TimetableImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        upload = serializer.validated_data["file"]
+        file_format = serializer.validated_data.get("format")
+        if file_format is None:
+            file_format = "csv" if upload.name.lower().endswith(".csv") else "ics"
+
+        try:
+            report = imports.import_timetable(
+                io.TextIOWrapper(upload.file, encoding="utf-8-sig"),
+                instance,
+                file_format,
+                serializer.validated_data.get("start"),
+                serializer.validated_data.get("end"),
+            )
+        except (DjangoValidationError, UnicodeDecodeError) as error:
+            raise ValidationError({"file": getattr(error, "messages", [str(error)])})
+
+        return Response(report.as_dict())
+
+
 StudentGroupViewSet = view_from_helper_class(
     model_class=models.StudentGroup,
     serializer_class=serializers.StudentGroupSerializer,
@@ -69,6 +238,32 @@ TeachingSessionViewSet = view_from_helper_class(
     serializer_class=serializers.TeachingSessionSerializer,
     permission_classes=[IsAuthenticated, permissions.TeachingSessionPermission]
 )
+
+
+class TeachingSessionSeriesViewSet(view_from_helper_class(
+    model_class=models.TeachingSessionSeries,
+    serializer_class=serializers.TeachingSessionSeriesSerializer,
+    permission_classes=[IsAuthenticated, permissions.TeachingSessionSeriesPermission]
+)):
+    @action(detail=True, methods=["post"])
+    def shift(self, request, pk=None):
+        """
+        Move all the future sessions of the series by a duration.
+        """
+
+        instance = self.get_object()
+
+        serializer = serializers.TeachingSessionSeriesShiftSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            count = series.shift(instance, serializer.validated_data["delta"])
+        except DjangoValidationError as error:
+            raise ValidationError(error.messages)
+
+        return Response({"shifted": count})
+
+
 AttendanceViewSet = view_from_helper_class(
     model_class=models.Attendance,
     serializer_class=serializers.AttendanceSerializer,
@@ -84,3 +279,166 @@ AbsenceAttachmentViewSet = view_from_helper_class(
     serializer_class=serializers.AbsenceAttachmentSerializer,
     permission_classes=[IsAuthenticated, permissions.AbsenceAttachmentPermission]
 )
+JobViewSet = view_from_helper_class(
+    model_class=models.Job,
+    serializer_class=serializers.JobSerializer,
+    permission_classes=[IsAuthenticated, permissions.JobPermission],
+    viewset_class=viewsets.ReadOnlyModelViewSet,
+)
+ScannerDeviceViewSet = view_from_helper_class(
+    model_class=models.ScannerDevice,
+    serializer_class=serializers.ScannerDeviceSerializer,
+    permission_classes=[IsAuthenticated, permissions.ScannerDevicePermission]
+)
+
+
+class ArchivedTeachingSessionViewSet(view_from_helper_class(
+    model_class=models.ArchivedTeachingSession,
+    serializer_class=serializers.ArchivedTeachingSessionSerializer,
+    permission_classes=[IsAuthenticated, permissions.ArchivedTeachingSessionPermission],
+    viewset_class=viewsets.ReadOnlyModelViewSet,
+)):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # only the sessions of an academic year
+        academic_year = self.request.query_params.get("academic_year")
+        if academic_year is not None:
+            queryset = queryset.filter(academic_year=academic_year)
+
+        return queryset
+
+
+class ArchivedAttendanceViewSet(view_from_helper_class(
+    model_class=models.ArchivedAttendance,
+    serializer_class=serializers.ArchivedAttendanceSerializer,
+    permission_classes=[IsAuthenticated, permissions.ArchivedAttendancePermission],
+    viewset_class=viewsets.ReadOnlyModelViewSet,
+)):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # only the attendances of an academic year
+        academic_year = self.request.query_params.get("academic_year")
+        if academic_year is not None:
+            queryset = queryset.filter(session__academic_year=academic_year)
+
+        return queryset
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """
+        Export the visible archived attendances in CSV, with their session.
+        """
+
+        rows = sharding.fan_out(self.filter_queryset(self.get_queryset()).select_related("session", "student"))
+
+        def lines():
+            buffer = _CsvBuffer()
+            writer = csv.writer(buffer)
+
+            yield writer.writerow([
+                "academic_year", "session", "start", "unit", "group", "student", "username", "date",
+            ])
+            for attendance in rows.iterator() if isinstance(rows, QuerySet) else rows:
+                yield writer.writerow([
+                    attendance.session.academic_year,
+                    attendance.session_id,
+                    attendance.session.start.isoformat(),
+                    attendance.session.unit_name,
+                    attendance.session.group_name,
+                    attendance.student_id,
+                    attendance.student.username,
+                    attendance.date.isoformat(),
+                ])
+
+        response = StreamingHttpResponse(lines(), content_type="text/csv")
+        response["Content-Disposition"] = 'attachment; filename="archived_attendances.csv"'
+        return response
+
+
+class _CsvBuffer:
+    # the csv writer returns the written line instead of buffering it
+    @staticmethod
+    def write(value: str) -> str:
+        return value
+
+
+class ScanView(APIView):
+    """
+    Register the attendance of the owner of a student card to a session.
+
+    Only used by the scanner devices, authenticated by their token and throttled separately from the users.
+    """
+
+    authentication_classes = [authentication.ScannerDeviceAuthentication]
+    permission_classes = [permissions.IsScannerDevice]
+    throttle_classes = [throttling.ScannerDeviceRateThrottle]
+
+    def post(self, request):
+        serializer = serializers.ScanSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        device = request.user
+
+        # the device can only scan for the sessions of its department, or of its teacher
+        sessions = models.TeachingSession.objects.filter(unit__department_id=device.department_id)
+        if device.teacher_id is not None:
+            sessions = sessions.filter(teacher_id=device.teacher_id)
+        try:
+            session = get_object_or_404(sessions, pk=serializer.validated_data["session"])
+        except NotFound:
+            metrics.SCANS.inc(outcome="unknown_session")
+            raise
+
+        card = models.StudentCard.objects.filter(
+            uid=serializer.validated_data["card"], department_id=device.department_id
+        ).values_list("owner_id", flat=True).first()
+        if card is None:
+            metrics.SCANS.inc(outcome="unknown_card")
+            raise NotFound("Unknown student card.")
+
+        if not models.StudentGroup.students.through.objects.filter(
+            studentgroup_id=session.group_id, user_id=card
+        ).exists():
+            metrics.SCANS.inc(outcome="not_on_roster")
+            raise ValidationError("The student is not related to the student group.")
+
+        attendance, created = models.Attendance.objects.get_or_create(
+            student_id=card, session=session, defaults={"date": timezone.now()}
+        )
+        metrics.SCANS.inc(outcome="accepted" if created else "duplicate")
+
+        return Response(
+            {"attendance": attendance.pk, "student": card},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
+class RosterView(APIView):
+    """
+    Give to a scanner device the roster of its upcoming sessions, to validate the scans by itself.
+
+    The roster is only sent again if its version differs from the "If-None-Match" header, and only its differences
+    with the version given by "since" if this version is still known.
+    """
+
+    authentication_classes = [authentication.ScannerDeviceAuthentication]
+    permission_classes = [permissions.IsScannerDevice]
+    throttle_classes = [throttling.ScannerDeviceRateThrottle]
+
+    def get(self, request):
+        serializer = serializers.RosterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        version, roster = rosters.get(
+            request.user,
+            serializer.validated_data.get("kind", settings.ROSTER_KIND),
+            serializer.validated_data.get("since"),
+        )
+        etag = f'"{version}"'
+
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        return Response(roster, headers={"ETag": etag})
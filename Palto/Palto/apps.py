@@ -11,3 +11,7 @@ class PaltoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = "Palto.Palto"
     label = "Palto"
+
+    def ready(self):
+        # register the signals receivers
+        from Palto.Palto import instrumentation, signals  # NOQA
@@ -0,0 +1,95 @@
+"""
+Archival for the Palto project.
+
+The sessions of the completed academic years and their attendances are moved from their tables into the archive
+tables, so the daily queries on the sessions and the attendances only read the current year. Every batch is moved in
+its own transaction : an interrupted archival is resumed by running it again.
+"""
+
+from datetime import datetime
+from typing import Iterator
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from Palto.Palto import models
+
+
+def academic_year(moment: datetime) -> int:
+    """
+    Return the academic year of a moment, designated by the calendar year it starts in.
+    """
+
+    moment = timezone.localtime(moment)
+    return moment.year if moment.month >= settings.ACADEMIC_YEAR_START_MONTH else moment.year - 1
+
+
+def academic_year_start(year: int) -> datetime:
+    """
+    Return the moment an academic year starts.
+    """
+
+    return timezone.make_aware(datetime(year, settings.ACADEMIC_YEAR_START_MONTH, 1))
+
+
+def archive_batch(before: datetime, batch_size: int, using: str = DEFAULT_DB_ALIAS) -> int:
+    """
+    Move the oldest sessions starting before a moment, with their attendances, into the archive tables.
+    Return the number of moved sessions, 0 once everything is archived.
+    """
+
+    with transaction.atomic(using=using):
+        sessions = list(
+            models.TeachingSession.objects.using(using)
+            .filter(start__lt=before)
+            .select_related("unit", "group")
+            .order_by("start", "pk")[:batch_size]
+        )
+        if not sessions:
+            return 0
+
+        # ignore the rows already archived, for example by a previous archival interrupted before its deletion
+        models.ArchivedTeachingSession.objects.using(using).bulk_create([
+            models.ArchivedTeachingSession(
+                id=session.id,
+                academic_year=academic_year(session.start),
+                start=session.start,
+                duration=session.duration,
+                note=session.note,
+                department_id=session.unit.department_id,
+                unit_id=session.unit_id,
+                unit_name=session.unit.name,
+                group_id=session.group_id,
+                group_name=session.group.name,
+                teacher_id=session.teacher_id,
+            )
+            for session in sessions
+        ], ignore_conflicts=True)
+
+        attendances = models.Attendance.objects.using(using).filter(session__in=sessions)
+        models.ArchivedAttendance.objects.using(using).bulk_create([
+            models.ArchivedAttendance(
+                id=attendance_id, date=date, student_id=student_id, session_id=session_id,
+            )
+            for attendance_id, date, student_id, session_id
+            in attendances.values_list("id", "date", "student_id", "session_id").iterator()
+        ], ignore_conflicts=True)
+
+        # the attendances and the absences links are removed with their sessions
+        models.TeachingSession.objects.using(using).filter(pk__in=[session.pk for session in sessions]).delete()
+
+    return len(sessions)
+
+
+def archive(before: datetime, batch_size: int = 500, using: str = DEFAULT_DB_ALIAS) -> Iterator[int]:
+    """
+    Move all the sessions starting before a moment into the archive tables.
+    Yield the number of sessions moved by every batch.
+    """
+
+    while True:
+        count = archive_batch(before, batch_size, using)
+        if count == 0:
+            return
+        yield count
@@ -0,0 +1,275 @@
+"""
+Changes feeds for the Palto project.
+
+The clients synchronising a model ask for what changed since their last synchronisation : the objects created or
+updated since then, found by their modification date, and the deleted ones, found by their tombstones. The changes are
+given in the order they happened, with a cursor to continue from, so the cost of a synchronisation depends on the
+amount of changes instead of the amount of objects.
+"""
+
+import base64
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Type
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Model, Q, QuerySet
+from django.utils import timezone
+
+from Palto.Palto import models, sharding
+
+
+# the relation giving the department of the objects of every tracked model, None for the models outside the departments
+DEPARTMENTS: dict[str, Optional[str]] = {
+    "Palto.user": None,
+    "Palto.department": "pk",
+    "Palto.studentgroup": "department_id",
+    "Palto.teachingunit": "department_id",
+    "Palto.studentcard": "department_id",
+    "Palto.scannerdevice": "department_id",
+    "Palto.teachingsession": "unit__department_id",
+    "Palto.teachingsessionseries": "unit__department_id",
+    "Palto.attendance": "session__unit__department_id",
+    "Palto.absence": "department_id",
+    "Palto.absenceattachment": "absence__department_id",
+    "Palto.job": None,
+    "Palto.archivedteachingsession": "department_id",
+    "Palto.archivedattendance": "session__department_id",
+}
+
+
+def is_tracked(model: Type[Model]) -> bool:
+    return model._meta.label_lower in DEPARTMENTS
+
+
+# tombstones
+
+
+def department_of(instance: Model, using: str = DEFAULT_DB_ALIAS):
+    """
+    Return the id of the department of an object, or None for the objects outside the departments.
+    """
+
+    path = DEPARTMENTS[instance._meta.label_lower]
+    if path is None:
+        return None
+    if path == "pk":
+        return instance.pk
+
+    name, _, rest = path.partition("__")
+    if not rest:
+        return getattr(instance, name)
+
+    # avoid a query if the parent is already loaded
+    field = instance._meta.get_field(name)
+    if field.is_cached(instance):
+        return department_of(getattr(instance, name), using)
+
+    return field.related_model._base_manager.using(using).filter(
+        pk=getattr(instance, field.attname)
+    ).values_list(rest, flat=True).first()
+
+
+def record_deletion(instance: Model, using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    Keep the tombstone of a deleted object, in the database it was deleted from.
+    """
+
+    # the copies of the users in the shards are deleted with the user of the default database
+    if sharding.is_mirrored(type(instance)) and using != DEFAULT_DB_ALIAS:
+        return
+
+    models.Tombstone.objects.using(using).create(
+        model=instance._meta.label_lower,
+        object_id=instance.pk,
+        department_id=department_of(instance, using),
+    )
+
+
+def bury(queryset: QuerySet, using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    Keep the tombstones of the objects of a queryset, before they are deleted directly without the signals.
+    """
+
+    if not is_tracked(queryset.model):
+        return
+
+    label = queryset.model._meta.label_lower
+    path = DEPARTMENTS[label]
+    now = timezone.now()
+
+    if path is None:
+        rows = ((pk, None) for pk in queryset.using(using).values_list("pk", flat=True))
+    else:
+        rows = queryset.using(using).values_list("pk", path).iterator()
+
+    models.Tombstone.objects.using(using).bulk_create([
+        models.Tombstone(model=label, object_id=pk, department_id=department_id, deleted_at=now)
+        for pk, department_id in rows
+    ])
+
+
+def remember_members(members: Iterable[tuple], using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    Keep the members of a deleted department, given as (user id, department id), to give them its tombstones.
+    """
+
+    models.FormerMember.objects.using(using).bulk_create(
+        [models.FormerMember(user_id=user_id, department_id=department_id) for user_id, department_id in members],
+        ignore_conflicts=True,
+    )
+
+
+def touch(model: Type[Model], pks: Iterable, using: str = DEFAULT_DB_ALIAS) -> None:
+    """
+    Mark some objects as updated, for example when their relations were modified.
+    """
+
+    model._base_manager.using(using).filter(pk__in=set(pks)).update(updated_at=timezone.now())
+
+
+def prune_before() -> datetime:
+    """
+    Return the moment before which the tombstones are not kept anymore.
+    """
+
+    return timezone.now() - timedelta(days=settings.TOMBSTONE_RETENTION_DAYS)
+
+
+# feeds
+
+
+@dataclass
+class Change:
+    """
+    A change of an object : "created", "updated" or "deleted".
+    """
+
+    id: str
+    change: str
+    at: datetime
+    instance: Optional[Model] = None
+
+    @property
+    def cursor(self) -> str:
+        return encode_cursor(self.at, self.id)
+
+
+def encode_cursor(at: datetime, object_id) -> str:
+    return base64.urlsafe_b64encode(f"{at.isoformat()}|{object_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """
+    Return the moment and the id of the last change of a cursor.
+    Raise ValueError if the cursor is invalid.
+    """
+
+    try:
+        at, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        at, object_id = datetime.fromisoformat(at), uuid.UUID(object_id)
+    except (UnicodeError, ValueError) as error:
+        raise ValueError("Invalid cursor.") from error
+
+    # the cursors are always given with their timezone, and can't be compared to the dates without one
+    if timezone.is_naive(at):
+        raise ValueError("Invalid cursor.")
+
+    return at, object_id
+
+
+def _after(field: str, since: Optional[tuple[datetime, uuid.UUID]], id_field: str) -> Q:
+    if since is None:
+        return Q()
+
+    at, object_id = since
+    return Q(**{f"{field}__gt": at}) | Q(**{field: at, f"{id_field}__gt": object_id})
+
+
+def _first(queryset: QuerySet, limit: int) -> list:
+    # without the department of the request, the changes of every shard are merged
+    if sharding.is_enabled() and sharding.get_shard() is None and sharding.is_partitioned(queryset.model):
+        results = [result for shard_queryset in sharding.each(queryset) for result in shard_queryset[:limit]]
+    else:
+        results = list(queryset[:limit])
+
+    return results
+
+
+def visible_tombstones(model: Type[Model], user) -> QuerySet:
+    """
+    Return the tombstones of a model that a user can see.
+
+    The deleted objects can't be checked anymore : only the tombstones of the departments of the user, of the objects
+    outside the departments and of the deleted departments the user was a member of are given. They only contain ids.
+    """
+
+    queryset = models.Tombstone.objects.filter(model=model._meta.label_lower)
+    if not sharding.is_partitioned(model):
+        queryset = queryset.using(DEFAULT_DB_ALIAS)
+
+    if not user.is_superuser:
+        queryset = queryset.filter(
+            # the objects outside the departments
+            Q(department_id__isnull=True) |
+            # the objects of the departments of the user
+            Q(department_id__in=(
+                user.roles.managing_departments | user.roles.teaching_departments | user.roles.studying_departments
+            )) |
+            # the objects of a deleted department the user was a member of
+            Q(department_id__in=models.FormerMember.objects.filter(user_id=user.pk).values("department_id"))
+        )
+
+    return queryset
+
+
+def feed(
+        queryset: QuerySet,
+        user,
+        since: Optional[tuple[datetime, uuid.UUID]] = None,
+        limit: int = 100,
+) -> tuple[list[Change], bool]:
+    """
+    Return the first changes of the objects of a queryset since a cursor, in the order they happened, and whether
+    there are more changes after them.
+    Without cursor, every object is given as created and the deletions are ignored.
+
+    The dates of the changes are set before their transaction is committed : only the changes older than the settle
+    window are given, so the cursor never passes a change that could still be committed later.
+    """
+
+    model = queryset.model
+    settled = timezone.now() - timedelta(seconds=settings.CHANGES_SETTLE_SECONDS)
+
+    # one more change than the limit, to know if there are others
+    objects = _first(
+        queryset.filter(_after("updated_at", since, "pk"), updated_at__lte=settled).order_by("updated_at", "pk"),
+        limit + 1,
+    )
+    changes = [
+        Change(
+            id=str(instance.pk),
+            change="created" if since is None or instance.created_at > since[0] else "updated",
+            at=instance.updated_at,
+            instance=instance,
+        )
+        for instance in objects
+    ]
+
+    if since is not None:
+        tombstones = _first(
+            visible_tombstones(model, user)
+            .filter(_after("deleted_at", since, "object_id"), deleted_at__lte=settled)
+            .order_by("deleted_at", "object_id")
+            .values_list("object_id", "deleted_at"),
+            limit + 1,
+        )
+        changes.extend(
+            Change(id=str(object_id), change="deleted", at=deleted_at)
+            for object_id, deleted_at in tombstones
+        )
+
+    changes.sort(key=lambda change: (change.at, change.id))
+    return changes[:limit], len(changes) > limit
@@ -0,0 +1,179 @@
+"""
+Timetable conflicts for the Palto project.
+
+Detect the teaching sessions that overlap for a same teacher, a same group or students shared between groups.
+The sessions are fetched in bulk and compared with a sort-and-sweep over their intervals instead of by pairs.
+"""
+
+import heapq
+import itertools
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from django.db.models import Q, F, ExpressionWrapper, DateTimeField
+
+from Palto.Palto import models, sharding
+
+
+class Conflict(NamedTuple):
+    """
+    Two sessions overlapping for the same teacher, the same group or for some students.
+    """
+
+    kind: str  # "teacher", "group" or "students"
+    first: models.TeachingSession
+    second: models.TeachingSession
+    students: frozenset = frozenset()
+
+    def __str__(self):
+        return f"{self.first} and {self.second} overlap for the same {self.kind}."
+
+
+def _sweep(sessions: Iterable[models.TeachingSession]) -> Iterator[tuple[models.TeachingSession, ...]]:
+    """
+    Yield every pair of overlapping sessions.
+    """
+
+    # the sessions that are still running, sorted by their end
+    active: list[tuple[datetime, int, models.TeachingSession]] = []
+    counter = itertools.count()
+
+    for session in sorted(sessions, key=lambda session: session.start):
+        # forget the sessions finished before this one start
+        while active and active[0][0] <= session.start:
+            heapq.heappop(active)
+
+        for _, _, other in active:
+            yield other, session
+
+        heapq.heappush(active, (session.end, next(counter), session))
+
+
+def detect(
+        sessions: Iterable[models.TeachingSession],
+        memberships: dict,
+        only: Optional[set] = None,
+) -> list[Conflict]:
+    """
+    Return the conflicts between the sessions.
+    The memberships associate the id of the groups with the id of their students.
+    If "only" is given, only the conflicts involving one of these sessions ids are returned.
+    """
+
+    by_teacher = defaultdict(list)
+    by_group = defaultdict(list)
+    by_student = defaultdict(list)
+
+    for session in sessions:
+        by_teacher[session.teacher_id].append(session)
+        by_group[session.group_id].append(session)
+        for student_id in memberships.get(session.group_id, ()):
+            by_student[student_id].append(session)
+
+    def is_relevant(first: models.TeachingSession, second: models.TeachingSession) -> bool:
+        return only is None or first.pk in only or second.pk in only
+
+    conflicts = []
+
+    for kind, resources in (("teacher", by_teacher), ("group", by_group)):
+        for resource_sessions in resources.values():
+            for first, second in _sweep(resource_sessions):
+                if is_relevant(first, second):
+                    conflicts.append(Conflict(kind, first, second))
+
+    # the students of different groups, merged by pair of sessions
+    students_conflicts = defaultdict(set)
+    for student_id, student_sessions in by_student.items():
+        for first, second in _sweep(student_sessions):
+            # the sessions of a same group are already a group conflict
+            if first.group_id != second.group_id and is_relevant(first, second):
+                students_conflicts[(first, second)].add(student_id)
+
+    for (first, second), students in students_conflicts.items():
+        conflicts.append(Conflict("students", first, second, frozenset(students)))
+
+    return conflicts
+
+
+def load_memberships(group_ids: Iterable) -> dict:
+    """
+    Return the id of the students of every group, in a single query.
+    """
+
+    memberships = defaultdict(set)
+
+    for group_id, student_id in models.StudentGroup.students.through.objects.filter(
+        studentgroup_id__in=group_ids
+    ).values_list("studentgroup_id", "user_id"):
+        memberships[group_id].add(student_id)
+
+    return memberships
+
+
+def _with_end(queryset):
+    return queryset.annotate(
+        annotated_end=ExpressionWrapper(F("start") + F("duration"), output_field=DateTimeField())
+    )
+
+
+def check(sessions: list[models.TeachingSession]) -> list[Conflict]:
+    """
+    Return the conflicts of new or modified sessions between themselves and with the existing sessions.
+    """
+
+    if not sessions:
+        return []
+
+    # the sessions are checked in the shard of their department
+    with sharding.object_scope(sessions[0]):
+        return _check(sessions)
+
+
+def _check(sessions: list[models.TeachingSession]) -> list[Conflict]:
+    first_start = min(session.start for session in sessions)
+    last_end = max(session.end for session in sessions)
+
+    # the groups that share students with the groups of the sessions
+    group_ids = {session.group_id for session in sessions}
+    students = models.StudentGroup.students.through.objects.filter(studentgroup_id__in=group_ids).values("user_id")
+    related_group_ids = models.StudentGroup.students.through.objects.filter(
+        user_id__in=students
+    ).values("studentgroup_id")
+
+    # the existing sessions in the same period that could conflict
+    existing = _with_end(models.TeachingSession.objects).filter(
+        Q(teacher_id__in={session.teacher_id for session in sessions}) |
+        Q(group_id__in=group_ids) |
+        Q(group_id__in=related_group_ids),
+        start__lt=last_end,
+        annotated_end__gt=first_start,
+    ).exclude(pk__in=[session.pk for session in sessions]).select_related("unit")
+
+    all_sessions = [*sessions, *existing]
+    memberships = load_memberships({session.group_id for session in all_sessions})
+
+    return detect(all_sessions, memberships, only={session.pk for session in sessions})
+
+
+def audit(
+        department: models.Department,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+) -> list[Conflict]:
+    """
+    Return all the conflicts between the sessions of a department in a period.
+    """
+
+    # the sessions of the department are in its shard
+    with sharding.object_scope(department):
+        sessions = models.TeachingSession.objects.filter(unit__department=department).select_related("unit")
+        if start is not None:
+            sessions = _with_end(sessions).filter(annotated_end__gt=start)
+        if end is not None:
+            sessions = sessions.filter(start__lt=end)
+
+        sessions = list(sessions)
+        memberships = load_memberships({session.group_id for session in sessions})
+
+    return detect(sessions, memberships)
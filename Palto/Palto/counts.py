@@ -0,0 +1,175 @@
+"""
+Counts for the Palto project.
+
+Counting the objects of a list runs its whole query, often with the DISTINCT joins of the visibility : on the big
+tables, counting the objects takes longer than reading the page. Above a threshold, the counts are estimated by the
+planner of the database when it can, and the exact counts are cached for a short time by user and query. The lists
+browsed from page to page, or by infinite scroll, can also skip the count entirely.
+"""
+
+import hashlib
+import json
+from typing import Optional, Union
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Page, Paginator, PageNotAnInteger
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from Palto.Palto import sharding
+
+
+def _cache_key(queryset: QuerySet, user_id) -> str:
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.sha256(repr((queryset.db, sql, params)).encode()).hexdigest()[:32]
+    return f"palto:count:{user_id}:{digest}"
+
+
+def estimate(queryset: QuerySet) -> Optional[int]:
+    """
+    Return the number of objects of a queryset estimated by the planner of the database, or None if the database
+    can't estimate it.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count(object_list: Union[QuerySet, sharding.MergedResults, list], user_id=None) -> tuple[int, bool]:
+    """
+    Return the number of objects of a list, and whether this number is estimated.
+    """
+
+    # the objects of several shards are counted in every shard
+    if isinstance(object_list, sharding.MergedResults) or (
+        isinstance(object_list, QuerySet) and sharding.is_unscoped(object_list)
+    ):
+        querysets = object_list.querysets if isinstance(object_list, sharding.MergedResults) else (
+            sharding.each(object_list)
+        )
+        counts = [count(queryset, user_id) for queryset in querysets]
+        return sum(value for value, _ in counts), any(estimated for _, estimated in counts)
+
+    # the objects of several shards are already merged in a list
+    if not isinstance(object_list, QuerySet):
+        return len(object_list), False
+
+    try:
+        key = _cache_key(object_list, user_id)
+    except EmptyResultSet:
+        # the conditions of the query can't match any object, like an empty list of ids
+        return 0, False
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached, False
+
+    estimated = estimate(object_list)
+    if estimated is not None and estimated > settings.COUNT_ESTIMATE_THRESHOLD:
+        return estimated, True
+
+    exact = object_list.count()
+    cache.set(key, exact, settings.COUNT_CACHE_TIMEOUT)
+    return exact, False
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using the estimated count of the big lists, and the cached exact count of the others.
+    With an estimated count, the last pages might be missing or empty.
+    """
+
+    def __init__(self, *args, user_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+        self.estimated = False
+
+    @cached_property
+    def count(self) -> int:
+        value, self.estimated = count(self.object_list, self.user_id)
+        return value
+
+
+class UncountedPage(Page):
+    """
+    A page of an uncounted paginator, knowing only if there is a next page.
+    """
+
+    def __init__(self, object_list, number: int, paginator: "UncountedPaginator", next_exists: bool):
+        super().__init__(object_list, number, paginator)
+        self.next_exists = next_exists
+
+    def __repr__(self):
+        return f"<Page {self.number}>"
+
+    def has_next(self) -> bool:
+        return self.next_exists
+
+    def next_page_number(self) -> int:
+        if not self.next_exists:
+            raise EmptyPage("That page contains no results")
+        return self.number + 1
+
+    def previous_page_number(self) -> int:
+        if self.number <= 1:
+            raise EmptyPage("That page number is less than 1")
+        return self.number - 1
+
+    def end_index(self) -> int:
+        return self.start_index() + len(self.object_list) - 1 if self.object_list else 0
+
+
+class UncountedPaginator:
+    """
+    Paginator of the lists browsed from page to page, or by infinite scroll, without counting their objects : every
+    page reads one more object to know if there is a next page.
+    """
+
+    # the objects are not counted
+    count = None
+
+    def __init__(self, object_list, per_page: int):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    def page(self, number) -> UncountedPage:
+        """
+        Return a page, or raise InvalidPage if it doesn't exist.
+        """
+
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and number > 1:
+            raise EmptyPage("That page contains no results")
+
+        return UncountedPage(objects[:self.per_page], number, self, len(objects) > self.per_page)
+
+    def get_page(self, number) -> UncountedPage:
+        """
+        Return a page, or the first one if the number is invalid.
+        """
+
+        try:
+            return self.page(number)
+        except (PageNotAnInteger, EmptyPage):
+            return self.page(1)
@@ -150,7 +150,10 @@ class FakeTeachingSessionFactory(factory.django.DjangoModelFactory):
 
     unit: models.TeachingUnit = factory.SubFactory(FakeTeachingUnitFactory)
 
-    group: models.StudentGroup = factory.SubFactory(FakeStudentGroupFactory)
+    # the group of the session is in the department of its unit
+    group: models.StudentGroup = factory.SubFactory(
+        FakeStudentGroupFactory, department=factory.SelfAttribute("..unit.department")
+    )
     teacher: models.User = factory.SubFactory(FakeUserFactory)
 
 
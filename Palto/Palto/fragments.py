@@ -0,0 +1,31 @@
+"""
+Pages fragments for the Palto project.
+
+The expensive parts of the pages are cached with a version per object, changed by the signals when the object or its
+relations are modified. The cached fragments of an unmodified object are then rendered without any query.
+"""
+
+import uuid
+from typing import Iterable
+
+from django.core.cache import cache
+
+
+def _version_key(kind: str, pk) -> str:
+    return f"Palto:fragments:version:{kind}:{pk}"
+
+
+def get_version(kind: str, pk) -> str:
+    """
+    Return the current version of the fragments of an object, used as a key of the cache tag.
+    """
+
+    return cache.get_or_set(_version_key(kind, pk), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def invalidate(kind: str, pks: Iterable) -> None:
+    """
+    Invalidate the fragments of some objects. They will be rendered again on their next request.
+    """
+
+    cache.delete_many([_version_key(kind, pk) for pk in pks])
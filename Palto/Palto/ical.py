@@ -0,0 +1,187 @@
+"""
+iCalendar feeds for the Palto project.
+
+Every user has a private feed of his teaching sessions that calendar applications can subscribe to.
+The feeds are cached per user and their version change when one of their sessions or groups is modified.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from Palto.Palto import models
+
+
+TOKEN_SALT: str = "Palto.calendar"
+# number of sessions fetched from the database at once when generating a feed
+CHUNK_SIZE: int = 500
+
+
+# tokens
+
+def make_token(user_id: uuid.UUID) -> str:
+    """
+    Return the token giving access to the calendar feed of a user.
+    """
+
+    return signing.Signer(salt=TOKEN_SALT).sign(str(user_id))
+
+
+def user_id_from_token(token: str) -> uuid.UUID:
+    """
+    Return the user id of a calendar feed token.
+    Raise BadSignature if the token is invalid.
+    """
+
+    return uuid.UUID(signing.Signer(salt=TOKEN_SALT).unsign(token))
+
+
+# cache
+
+def _version_key(user_id) -> str:
+    return f"Palto:calendar:version:{user_id}"
+
+
+def _body_key(user_id, version: str) -> str:
+    return f"Palto:calendar:body:{user_id}:{version}"
+
+
+def get_version(user_id) -> str:
+    """
+    Return the current version of the calendar feed of a user.
+    """
+
+    return cache.get_or_set(_version_key(user_id), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def get_cached_body(user_id, version: str):
+    """
+    Return the cached content of a calendar feed, or None if it needs to be generated.
+    """
+
+    return cache.get(_body_key(user_id, version))
+
+
+def invalidate(user_ids: Iterable) -> None:
+    """
+    Invalidate the calendar feeds of some users. A new version will be generated on their next request.
+    """
+
+    cache.delete_many([_version_key(user_id) for user_id in user_ids])
+
+
+def invalidate_sessions(group_ids: Iterable, teacher_ids: Iterable) -> None:
+    """
+    Invalidate the calendar feeds of the teachers and the students of some groups.
+    Used when the sessions are modified in bulk, without signals.
+    """
+
+    invalidate({
+        *teacher_ids,
+        *models.StudentGroup.students.through.objects.filter(
+            studentgroup_id__in=set(group_ids)
+        ).values_list("user_id", flat=True),
+    })
+
+
+# generation
+
+def _escape(text: str) -> str:
+    return (
+        text
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _fold(line: str) -> str:
+    # the lines should be folded to 75 octets, a continuation line starts with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        # don't split a multibytes character
+        while (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+    parts.append(encoded.decode())
+
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _format_datetime(value: datetime) -> str:
+    return value.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _session_event(session: models.TeachingSession, stamp: str) -> str:
+    return "".join(map(_fold, [
+        "BEGIN:VEVENT",
+        f"UID:{session.id}@palto",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{_format_datetime(session.start)}",
+        f"DTEND:{_format_datetime(session.end)}",
+        f"SUMMARY:{_escape(f'{session.unit.name} ({session.group.name})')}",
+        f"DESCRIPTION:{_escape(f'{session.teacher}' + (f' - {session.note}' if session.note else ''))}",
+        "END:VEVENT",
+    ]))
+
+
+def user_sessions(user_id) -> QuerySet[models.TeachingSession]:
+    """
+    Return the sessions of the calendar feed of a user : the sessions he studies in and the sessions he teaches.
+    """
+
+    return models.TeachingSession.objects.filter(
+        Q(group__students__id=user_id) |
+        Q(teacher_id=user_id),
+        start__gte=timezone.now() - timedelta(days=settings.CALENDAR_FEED_PAST_DAYS),
+    ).distinct().select_related("unit", "group", "teacher").order_by("start")
+
+
+def generate(user_id) -> Iterator[str]:
+    """
+    Generate the calendar feed of a user piece by piece.
+    """
+
+    stamp = _format_datetime(timezone.now())
+
+    yield "".join(map(_fold, [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Palto//Palto Server//FR",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:Palto",
+    ]))
+
+    # the sessions of the departments of every shard are merged by their start
+    for session in user_sessions(user_id).iterator(chunk_size=CHUNK_SIZE):
+        yield _session_event(session, stamp)
+
+    yield _fold("END:VCALENDAR")
+
+
+def stream(user_id, version: str) -> Iterator[str]:
+    """
+    Generate the calendar feed of a user piece by piece and save it in the cache once complete.
+    """
+
+    chunks = []
+
+    for chunk in generate(user_id):
+        chunks.append(chunk)
+        yield chunk
+
+    cache.set(_body_key(user_id, version), "".join(chunks), timeout=settings.CALENDAR_FEED_CACHE_TIMEOUT)
@@ -0,0 +1,706 @@
+"""
+Imports for the Palto project.
+
+The imports read large files, like the lists of students or the timetables, incrementally and write them with a few
+bulk queries, instead of one API request and one validation per object. The invalid rows are reported with their line
+and skipped, the others are imported.
+"""
+
+import csv
+import re
+import unicodedata
+import zoneinfo
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain, islice
+from typing import IO, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from Palto.Palto import absence_links, changes, ical, models, search, sharding
+
+
+@dataclass
+class ImportReport:
+    """
+    The result of an import, with the errors of every skipped row.
+    """
+
+    created: int = 0
+    updated: int = 0
+    # the errors of the skipped rows, by line of the file
+    errors: dict[int, list[str]] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "errors": [{"line": line, "errors": errors} for line, errors in self.errors.items()],
+        }
+
+
+def read_csv(file: IO[str], columns: Iterable[str]) -> Iterator[tuple[int, dict[str, str]]]:
+    """
+    Yield the line and the values of every row of a CSV file, checking that its header has the required columns.
+    """
+
+    reader = csv.DictReader(file)
+
+    missing = set(columns) - set(reader.fieldnames or ())
+    if missing:
+        raise ValidationError(f"Missing columns: {', '.join(sorted(missing))}.")
+
+    for row in reader:
+        yield reader.line_num, {name: (value or "").strip() for name, value in row.items() if name is not None}
+
+
+def _chunks(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+# students
+
+
+STUDENT_COLUMNS: tuple[str, ...] = ("username", "first_name", "last_name", "email", "card", "department", "groups")
+# the other columns can be absent or empty
+STUDENT_REQUIRED_COLUMNS: tuple[str, ...] = ("username", "department")
+
+# separator of the groups of a student in the groups column
+GROUPS_SEPARATOR: str = ";"
+
+
+class StudentImporter:
+    """
+    Import students, their cards and their groups memberships into the given departments.
+
+    Every row gives the username, the names and the email of a student, the hexadecimal uid of their card (optional),
+    the name or the id of their department and the names of their groups in this department, separated by semicolons.
+    The existing students are updated, and the existing cards of the department given to their new owner. Unless the
+    import is done by a superuser or without user, only the existing students of the departments can be updated : the
+    rows of the other existing users are reported as errors.
+    """
+
+    def __init__(self, departments: Iterable[models.Department], user: Optional[models.User] = None):
+        self.departments: dict[str, models.Department] = {}
+        for department in departments:
+            self.departments[department.name] = self.departments[str(department.pk)] = department
+        self.user = user
+
+        # the groups of every department, loaded when the department is first met
+        self._groups: dict[object, dict[str, models.StudentGroup]] = {}
+
+    def groups_of(self, department: models.Department) -> dict[str, models.StudentGroup]:
+        groups = self._groups.get(department.pk)
+        if groups is None:
+            groups = self._groups[department.pk] = {
+                group.name: group
+                for group in models.StudentGroup.objects.using(self.database_of(department)).filter(
+                    department=department
+                ).only("id", "name")
+            }
+        return groups
+
+    @staticmethod
+    def database_of(department: models.Department) -> str:
+        return sharding.shard_for_department(department.pk) if sharding.is_enabled() else DEFAULT_DB_ALIAS
+
+    def locked_usernames(self, usernames: Iterable[str]) -> set[str]:
+        """
+        Return the usernames of the existing users that the import can't update.
+        """
+
+        if self.user is None or self.user.is_superuser:
+            return set()
+
+        # the superusers and the staff can never be updated, the other users only if they are students of a department
+        locked, students = set(), {}
+        for pk, username, privileged in models.User.objects.filter(username__in=list(usernames)).values_list(
+            "pk", "username", Q(is_superuser=True) | Q(is_staff=True)
+        ):
+            locked.add(username)
+            if not privileged:
+                students[pk] = username
+        if not students:
+            return locked
+
+        # the students of the departments, in the database of every department
+        by_database: dict[str, set] = {}
+        for department in self.departments.values():
+            by_database.setdefault(self.database_of(department), set()).add(department.pk)
+
+        for using, department_ids in by_database.items():
+            locked.difference_update(
+                students[user_id]
+                for user_id in models.Department.students.through.objects.using(using).filter(
+                    department_id__in=department_ids, user_id__in=students
+                ).values_list("user_id", flat=True)
+            )
+
+        return locked
+
+    def validate(self, rows: list[tuple[int, dict[str, str]]], report: ImportReport) -> list[dict]:
+        """
+        Return the valid rows of a chunk with their department, card and groups, and report the errors of the others.
+        """
+
+        valid = []
+        usernames: set[str] = set()
+        cards: set[tuple] = set()
+        locked = self.locked_usernames(row.get("username", "") for _, row in rows)
+
+        for line, row in rows:
+            errors = []
+
+            username = row.get("username", "")
+            if not username:
+                errors.append("The username is required.")
+            elif len(username) > 150:
+                errors.append("The username is longer than 150 characters.")
+            elif username in usernames:
+                errors.append(f"The username {username!r} is already in the file.")
+            elif username in locked:
+                errors.append(f"The user {username!r} already exists and is not a student of the departments.")
+
+            if row.get("email"):
+                try:
+                    validate_email(row["email"])
+                except ValidationError:
+                    errors.append(f"The email {row['email']!r} is invalid.")
+
+            department = self.departments.get(row.get("department", ""))
+            if department is None:
+                errors.append(f"The department {row.get('department')!r} is unknown or not editable.")
+
+            card = None
+            if row.get("card"):
+                try:
+                    card = bytes.fromhex(row["card"])
+                except ValueError:
+                    errors.append(f"The card {row['card']!r} is not hexadecimal.")
+                else:
+                    if not 1 <= len(card) <= 7:
+                        errors.append(f"The card {row['card']!r} should have between 1 and 7 bytes.")
+                    elif department is not None and (department.pk, card) in cards:
+                        errors.append(f"The card {row['card']!r} is already in the file.")
+
+            groups = []
+            if department is not None:
+                department_groups = self.groups_of(department)
+                for name in filter(None, (name.strip() for name in row.get("groups", "").split(GROUPS_SEPARATOR))):
+                    group = department_groups.get(name)
+                    if group is None:
+                        errors.append(f"The group {name!r} is unknown in the department.")
+                    else:
+                        groups.append(group)
+
+            if errors:
+                report.errors[line] = errors
+                continue
+
+            usernames.add(username)
+            if card is not None:
+                cards.add((department.pk, card))
+
+            valid.append({**row, "department": department, "card": card, "groups": groups})
+
+        return valid
+
+    def write(self, rows: list[dict], report: ImportReport) -> None:
+        """
+        Create or update the students of the valid rows of a chunk, then their cards and their memberships.
+        """
+
+        usernames = [row["username"] for row in rows]
+        existing = set(models.User.objects.filter(username__in=usernames).values_list("username", flat=True))
+
+        with transaction.atomic():
+            models.User.objects.bulk_create(
+                [
+                    models.User(
+                        username=row["username"],
+                        first_name=row.get("first_name", ""),
+                        last_name=row.get("last_name", ""),
+                        email=row.get("email", ""),
+                        # the new students have no usable password until an administrator sets one
+                        password=make_password(None),
+                    )
+                    for row in rows
+                ],
+                update_conflicts=True,
+                unique_fields=["username"],
+                update_fields=["first_name", "last_name", "email", "updated_at"],
+            )
+
+        # the ids of the existing users were not changed by the update
+        users = {user.username: user for user in models.User.objects.filter(username__in=usernames)}
+        # the bulk creation skips the signals copying the users into the shards and indexing them
+        sharding.mirror_many(list(users.values()))
+        search.index_users(users.values())
+
+        report.created += len(users) - len(existing)
+        report.updated += len(existing)
+
+        by_database: dict[str, list[dict]] = {}
+        for row in rows:
+            by_database.setdefault(self.database_of(row["department"]), []).append(row)
+
+        for using, database_rows in by_database.items():
+            with transaction.atomic(using=using):
+                models.StudentCard.objects.using(using).bulk_create(
+                    [
+                        models.StudentCard(
+                            uid=row["card"], department=row["department"], owner_id=users[row["username"]].pk
+                        )
+                        for row in database_rows if row["card"] is not None
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["department", "uid"],
+                    update_fields=["owner", "updated_at"],
+                )
+                models.Department.students.through.objects.using(using).bulk_create(
+                    [
+                        models.Department.students.through(
+                            department_id=row["department"].pk, user_id=users[row["username"]].pk
+                        )
+                        for row in database_rows
+                    ],
+                    ignore_conflicts=True,
+                )
+                models.StudentGroup.students.through.objects.using(using).bulk_create(
+                    [
+                        models.StudentGroup.students.through(
+                            studentgroup_id=group.pk, user_id=users[row["username"]].pk
+                        )
+                        for row in database_rows for group in row["groups"]
+                    ],
+                    ignore_conflicts=True,
+                )
+
+                # the members are part of the departments and the groups given by the changes feeds
+                changes.touch(models.Department, {row["department"].pk for row in database_rows}, using)
+                changes.touch(
+                    models.StudentGroup, {group.pk for row in database_rows for group in row["groups"]}, using
+                )
+
+            # the bulk creations skip the signals of the memberships
+            student_ids = [users[row["username"]].pk for row in database_rows]
+            with sharding.shard_scope(using if sharding.is_enabled() else None):
+                models.User.bump_roles_version(student_ids)
+                ical.invalidate(student_ids)
+                absence_links.update_students(student_ids)
+
+    def run(self, rows: Iterable[tuple[int, dict[str, str]]], batch_size: int = 1000) -> ImportReport:
+        """
+        Import the rows by chunks, each validated and written together.
+        """
+
+        report = ImportReport()
+
+        for chunk in _chunks(rows, batch_size):
+            valid = self.validate(chunk, report)
+            if valid:
+                self.write(valid, report)
+
+        return report
+
+
+def import_students(
+        file: IO[str],
+        departments: Iterable[models.Department],
+        batch_size: Optional[int] = None,
+        user: Optional[models.User] = None,
+) -> ImportReport:
+    """
+    Import the students of a CSV file into the given departments, updating only the existing users the user can edit.
+    """
+
+    return StudentImporter(departments, user).run(
+        read_csv(file, STUDENT_REQUIRED_COLUMNS), batch_size or settings.IMPORT_BATCH_SIZE
+    )
+
+
+def editable_departments(user: models.User) -> list[models.Department]:
+    """
+    Return the departments a user can import into, in every shard.
+    """
+
+    return list(chain.from_iterable(sharding.each(models.Department.all_editable_by_user(user))))
+
+
+# timetables
+
+
+TIMETABLE_REQUIRED_COLUMNS: tuple[str, ...] = ("uid", "start", "end", "unit", "group", "teacher")
+
+# the fields of the sessions compared to the imported events
+TIMETABLE_FIELDS: tuple[str, ...] = ("start", "duration", "note", "unit", "group", "teacher")
+
+_ICS_DURATION_PATTERN = re.compile(
+    r"^P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+
+
+@dataclass
+class TimetableReport(ImportReport):
+    deleted: int = 0
+    unchanged: int = 0
+    # the sessions absent from the timetable but not deleted, since they started or have attendances
+    kept: int = 0
+
+    def as_dict(self) -> dict:
+        return {**super().as_dict(), "deleted": self.deleted, "unchanged": self.unchanged, "kept": self.kept}
+
+
+def normalize_name(name: str) -> str:
+    """
+    Return a name without its case, its accents and its extra spaces, to compare the names of different sources.
+    """
+
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(character for character in name if not unicodedata.combining(character))
+    return " ".join(name.casefold().split())
+
+
+def _unfold(file: IO[str]) -> Iterator[tuple[int, str]]:
+    # the long lines of a calendar are folded, the continuation lines starting with a space
+    current, current_number = None, 0
+
+    for number, line in enumerate(file, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+
+        if current is not None:
+            yield current_number, current
+        current, current_number = line, number
+
+    if current is not None:
+        yield current_number, current
+
+
+def _unescape(text: str) -> str:
+    return re.sub(r"\\([\;,nN])", lambda match: "\n" if match[1] in "nN" else match[1], text)
+
+
+def _parse_ics_datetime(value: str, parameters: dict[str, str]) -> datetime:
+    if "T" not in value:
+        raise ValueError("The all-day events are not sessions.")
+
+    moment = datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return moment.replace(tzinfo=dt_timezone.utc)
+    if "TZID" in parameters:
+        return moment.replace(tzinfo=zoneinfo.ZoneInfo(parameters["TZID"]))
+    # the floating times are in the local time
+    return timezone.make_aware(moment)
+
+
+def read_ics(file: IO[str]) -> Iterator[tuple[int, dict]]:
+    """
+    Yield the line and the properties of every event of a calendar, reading it line by line.
+    Every property is given with its parameters and its value.
+    """
+
+    event: Optional[dict] = None
+    event_line = 0
+    # the components inside an event, like the alarms, are ignored
+    depth = 0
+
+    for number, line in _unfold(file):
+        name, _, value = line.partition(":")
+        name, *raw_parameters = name.split(";")
+        name = name.upper()
+
+        if name == "BEGIN":
+            if event is not None:
+                depth += 1
+            elif value.upper() == "VEVENT":
+                event, event_line = {}, number
+        elif name == "END":
+            if depth:
+                depth -= 1
+            elif event is not None and value.upper() == "VEVENT":
+                yield event_line, event
+                event = None
+        elif event is not None and not depth:
+            parameters = dict(parameter.partition("=")[::2] for parameter in raw_parameters)
+            event[name] = (parameters, value)
+
+
+def ics_events(file: IO[str], summary_pattern: str, description_pattern: str) -> Iterator[tuple[int, dict]]:
+    """
+    Yield the line and the fields of every session of a calendar, the names being extracted with the patterns.
+    """
+
+    summary_regex = re.compile(summary_pattern)
+    description_regex = re.compile(description_pattern)
+
+    for line, properties in read_ics(file):
+        # the cancelled events are removed from the timetable
+        if properties.get("STATUS", ({}, ""))[1].upper() == "CANCELLED":
+            continue
+
+        fields = {"uid": properties.get("UID", ({}, ""))[1].strip()}
+
+        try:
+            if "RRULE" in properties:
+                raise ValueError("The recurring events are not supported, the occurrences should be exported.")
+            if "DTSTART" not in properties:
+                raise ValueError("The event has no start.")
+
+            fields["start"] = _parse_ics_datetime(properties["DTSTART"][1], properties["DTSTART"][0])
+
+            if "DTEND" in properties:
+                fields["end"] = _parse_ics_datetime(properties["DTEND"][1], properties["DTEND"][0])
+            elif "DURATION" in properties:
+                match = _ICS_DURATION_PATTERN.match(properties["DURATION"][1])
+                if match is None:
+                    raise ValueError(f"The duration {properties['DURATION'][1]!r} is invalid.")
+                fields["end"] = fields["start"] + timedelta(**{
+                    name: int(amount) for name, amount in match.groupdict().items() if amount is not None
+                })
+            else:
+                raise ValueError("The event has no end.")
+
+        except (ValueError, zoneinfo.ZoneInfoNotFoundError) as error:
+            fields["error"] = str(error)
+
+        for regex, name in ((summary_regex, "SUMMARY"), (description_regex, "DESCRIPTION")):
+            match = regex.match(_unescape(properties.get(name, ({}, ""))[1]).strip())
+            if match is not None:
+                fields.update({key: value for key, value in match.groupdict().items() if value is not None})
+
+        yield line, fields
+
+
+def csv_events(file: IO[str]) -> Iterator[tuple[int, dict]]:
+    """
+    Yield the line and the fields of every session of a CSV timetable, with the dates in the ISO 8601 format.
+    """
+
+    for line, row in read_csv(file, TIMETABLE_REQUIRED_COLUMNS):
+        fields: dict = dict(row)
+
+        try:
+            for name in ("start", "end"):
+                moment = datetime.fromisoformat(row[name])
+                fields[name] = timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+        except ValueError as error:
+            fields["error"] = str(error)
+
+        yield line, fields
+
+
+class TimetableImporter:
+    """
+    Import the sessions of a timetable into a department.
+
+    The unit, the group and the teacher of every event are found by their name in lookup dictionaries loaded once. The
+    events are compared by their uid to the sessions of the previous imports : the changed sessions are updated in
+    place, keeping their attendances, the new ones created and the imported sessions absent from the timetable in its
+    period deleted, unless they already started or have attendances. The sessions created by hand are never modified.
+    """
+
+    def __init__(self, department: models.Department):
+        self.department = department
+        self.using = StudentImporter.database_of(department)
+
+        self.units = self._lookup(
+            (unit, [unit.name]) for unit in models.TeachingUnit.objects.using(self.using).filter(department=department)
+        )
+        self.groups = self._lookup(
+            (group, [group.name])
+            for group in models.StudentGroup.objects.using(self.using).filter(department=department)
+        )
+        self.teachers = self._lookup(
+            (teacher, [
+                teacher.username, teacher.email, str(teacher),
+                f"{teacher.first_name} {teacher.last_name}", f"{teacher.last_name} {teacher.first_name}",
+            ])
+            for teacher in models.User.objects.using(self.using).filter(
+                Q(teaching_departments=department) | Q(managing_departments=department)
+            ).distinct()
+        )
+
+    @staticmethod
+    def _lookup(objects: Iterable[tuple[object, list[str]]]) -> dict[str, Optional[object]]:
+        # the names shared by several objects are ambiguous, they are kept to report it
+        lookup: dict[str, Optional[object]] = {}
+        for instance, names in objects:
+            for name in {normalize_name(name) for name in names if name and name.strip()}:
+                lookup[name] = None if lookup.get(name, instance) is not instance else instance
+        return lookup
+
+    @staticmethod
+    def _find(lookup: dict, kind: str, name: str, errors: list[str]):
+        key = normalize_name(name or "")
+        if key not in lookup:
+            errors.append(f"The {kind} {name!r} is unknown in the department.")
+        elif lookup[key] is None:
+            errors.append(f"The {kind} {name!r} is ambiguous in the department.")
+        return lookup.get(key)
+
+    def build(self, line: int, fields: dict, report: TimetableReport) -> Optional[models.TeachingSession]:
+        """
+        Return the session of an event, or None if it is invalid.
+        """
+
+        errors = []
+
+        if not fields.get("uid"):
+            errors.append("The uid is required.")
+        if fields.get("error"):
+            errors.append(fields["error"])
+        elif fields["end"] <= fields["start"]:
+            errors.append("The event ends before it starts.")
+
+        unit = self._find(self.units, "unit", fields.get("unit"), errors)
+        group = self._find(self.groups, "group", fields.get("group"), errors)
+        teacher = self._find(self.teachers, "teacher", fields.get("teacher"), errors)
+
+        if errors:
+            report.errors[line] = errors
+            return None
+
+        return models.TeachingSession(
+            source_uid=fields["uid"][:255],
+            start=fields["start"],
+            duration=fields["end"] - fields["start"],
+            note=fields.get("note", ""),
+            unit=unit,
+            group=group,
+            teacher=teacher,
+        )
+
+    def run(
+            self,
+            events: Iterable[tuple[int, dict]],
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+    ) -> TimetableReport:
+        """
+        Apply the events of a timetable to the sessions of the department.
+        The period of the timetable is the one of its events, unless given.
+        """
+
+        report = TimetableReport()
+        sessions: dict[str, models.TeachingSession] = {}
+        # the uids of the invalid events, their sessions should not be deleted
+        kept_uids: set[str] = set()
+
+        for line, fields in events:
+            uid = (fields.get("uid") or "")[:255]
+            if uid in sessions or uid in kept_uids:
+                report.errors[line] = [f"The uid {uid!r} is already in the timetable."]
+                continue
+
+            session = self.build(line, fields, report)
+            if session is None:
+                kept_uids.add(uid)
+            else:
+                sessions[uid] = session
+
+        if sessions:
+            start = start or min(session.start for session in sessions.values())
+            end = end or max(session.start for session in sessions.values())
+
+        imported = models.TeachingSession.objects.using(self.using).filter(unit__department=self.department)
+        existing: dict[str, models.TeachingSession] = {}
+        if start is not None and end is not None:
+            existing = {
+                session.source_uid: session
+                for session in imported.exclude(source_uid="").filter(start__gte=start, start__lte=end)
+            }
+
+        # the sessions moved into the period from outside of it
+        missing = [uid for uid in sessions if uid not in existing]
+        for chunk in _chunks(missing, 500):
+            existing.update({session.source_uid: session for session in imported.filter(source_uid__in=chunk)})
+
+        created, updated = [], []
+        # the previous groups and teachers of the updated sessions also see the change in their calendar
+        previous_groups, previous_teachers = set(), set()
+
+        for uid, session in sessions.items():
+            previous = existing.pop(uid, None)
+            if previous is None:
+                created.append(session)
+                continue
+
+            if all(
+                getattr(previous, attname) == getattr(session, attname)
+                for attname in (models.TeachingSession._meta.get_field(name).attname for name in TIMETABLE_FIELDS)
+            ):
+                report.unchanged += 1
+                continue
+
+            previous_groups.add(previous.group_id)
+            previous_teachers.add(previous.teacher_id)
+            session.pk, session.series_id = previous.pk, previous.series_id
+            session.updated_at = timezone.now()
+            updated.append(session)
+
+        deleted = [session for uid, session in existing.items() if uid not in kept_uids]
+
+        # a partial timetable should not destroy the attendances : the past and attended sessions are kept
+        attended = set()
+        for chunk in _chunks([session.pk for session in deleted], 500):
+            attended.update(models.Attendance.objects.using(self.using).filter(
+                session_id__in=chunk
+            ).values_list("session_id", flat=True).distinct())
+        now = timezone.now()
+        kept = [session for session in deleted if session.start <= now or session.pk in attended]
+        deleted = [session for session in deleted if not (session.start <= now or session.pk in attended)]
+
+        report.created, report.updated, report.deleted = len(created), len(updated), len(deleted)
+        report.kept = len(kept)
+        if not (created or updated or deleted):
+            return report
+
+        with sharding.shard_scope(self.using if sharding.is_enabled() else None):
+            with transaction.atomic(using=self.using):
+                models.TeachingSession.objects.using(self.using).bulk_update(updated, [*TIMETABLE_FIELDS, "updated_at"])
+                models.TeachingSession.objects.using(self.using).bulk_create(created)
+                # the attendances and the absences links are removed with their sessions
+                models.TeachingSession.objects.using(self.using).filter(
+                    pk__in=[session.pk for session in deleted]
+                ).delete()
+                absence_links.update_sessions([session.pk for session in [*updated, *created]])
+
+            changed = [*created, *updated, *deleted]
+            ical.invalidate_sessions(
+                previous_groups | {session.group_id for session in changed},
+                previous_teachers | {session.teacher_id for session in changed},
+            )
+
+        return report
+
+
+def import_timetable(
+        file: IO[str],
+        department: models.Department,
+        file_format: str = "ics",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+) -> TimetableReport:
+    """
+    Import the sessions of an ICS or CSV timetable into a department.
+    """
+
+    if file_format == "ics":
+        events = ics_events(file, settings.TIMETABLE_SUMMARY_PATTERN, settings.TIMETABLE_DESCRIPTION_PATTERN)
+    elif file_format == "csv":
+        events = csv_events(file)
+    else:
+        raise ValidationError(f"Unknown timetable format {file_format!r}.")
+
+    return TimetableImporter(department).run(events, start, end)
@@ -0,0 +1,168 @@
+"""
+Instrumentation for the Palto project.
+
+The instrumentation collects statistics about the server, for example to check the effect of a setting under load.
+"""
+
+import contextlib
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+
+_connections_created_lock = threading.Lock()
+_connections_created: Counter[str] = Counter()
+
+
+@receiver(connection_created)
+def _count_connection_created(sender, connection, **kwargs):
+    with _connections_created_lock:
+        _connections_created[connection.alias] += 1
+
+
+def database_connection_stats() -> dict[str, dict[str, Any]]:
+    """
+    Return the statistics of the connections of every database, in this process.
+    If the database use a connection pool, the statistics of the pool are included.
+    """
+
+    stats = {}
+
+    for alias in connections:
+        connection = connections[alias]
+
+        alias_stats = {
+            "mode": settings.DATABASE_CONNECTION_MODE,
+            "max_age": connection.settings_dict["CONN_MAX_AGE"],
+            "health_checks": connection.settings_dict["CONN_HEALTH_CHECKS"],
+            # number of connections opened since the start of the process
+            "created": _connections_created[alias],
+        }
+
+        # only the backends supporting the pools have this attribute
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            alias_stats["pool"] = pool.get_stats()
+
+        stats[alias] = alias_stats
+
+    return stats
+
+
+# requests timings
+
+
+class RequestTimings:
+    """
+    The time spent by a request in its different steps.
+    """
+
+    def __init__(self):
+        self.start: float = time.perf_counter()
+        self.sql_count: int = 0
+        # duration of every kind of step, in seconds
+        self.durations: defaultdict[str, float] = defaultdict(float)
+        # number of measures of every kind in progress, to ignore the nested ones
+        self._depths: Counter[str] = Counter()
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextlib.contextmanager
+    def measure(self, kind: str) -> Iterator[None]:
+        self._depths[kind] += 1
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self._depths[kind] -= 1
+            # a serializer nested in another one is already measured by its parent
+            if self._depths[kind] == 0:
+                self.durations[kind] += time.perf_counter() - start
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        self.sql_count += 1
+        with self.measure("sql"):
+            return execute(sql, params, many, context)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def get_request_timings() -> Optional[RequestTimings]:
+    """
+    Return the timings of the current request, or None if the request is not measured.
+    """
+
+    return _request_timings.get()
+
+
+@contextlib.contextmanager
+def measure_request() -> Iterator[RequestTimings]:
+    """
+    Measure the timings of a request, including all the queries made on every database.
+    If the request is already measured, its timings are shared.
+    """
+
+    timings = get_request_timings()
+    if timings is not None:
+        yield timings
+        return
+
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+
+    try:
+        with contextlib.ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timings.sql_wrapper))
+            yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+@contextlib.contextmanager
+def measure(kind: str) -> Iterator[None]:
+    """
+    Add the duration of a step to the timings of the current request, if it is measured.
+    """
+
+    timings = get_request_timings()
+    if timings is None:
+        yield
+        return
+
+    with timings.measure(kind):
+        yield
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with measure("template"):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django templates engine, measuring the time spent rendering the templates.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,153 @@
+"""
+Jobs for the Palto project.
+
+A job is a function executed in the background by the "run_palto_worker" command, allowing the views to enqueue
+heavy work and return immediately. The jobs are stored in the database, so no external broker is required.
+"""
+
+import json
+import logging
+import traceback
+from datetime import timedelta
+from typing import Callable, Optional, Union
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from Palto.Palto import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(
+        function: Union[Callable, str],
+        owner: Optional[models.User] = None,
+        max_attempts: int = 3,
+        delay: timedelta = timedelta(),
+        **arguments
+) -> models.Job:
+    """
+    Enqueue a function to be executed by a worker with the given keyword arguments.
+    The function must be defined at the top level of a module and the arguments must be serializable in JSON.
+    """
+
+    name = function if isinstance(function, str) else f"{function.__module__}.{function.__qualname__}"
+
+    return models.Job.objects.create(
+        name=name,
+        arguments=arguments,
+        owner=owner,
+        max_attempts=max_attempts,
+        run_after=timezone.now() + delay,
+    )
+
+
+def claim(job_id) -> bool:
+    """
+    Mark a pending job as running. Return False if another worker already claimed it.
+    """
+
+    return models.Job.objects.filter(pk=job_id, status=models.Job.Status.PENDING).update(
+        status=models.Job.Status.RUNNING,
+        started_at=timezone.now(),
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """
+    Return the delay before the next attempt of a job, longer after every failure.
+    """
+
+    return timedelta(seconds=2 ** attempts)
+
+
+def release(job_id, error: str = "") -> bool:
+    """
+    Put back in the queue a running job interrupted by an error of its worker, for example a locked database.
+    The interruption counts as an attempt, so a job always interrupting its worker ends up failed.
+    Return False if the job was not running anymore.
+    """
+
+    job = models.Job.objects.filter(pk=job_id, status=models.Job.Status.RUNNING).first()
+    if job is None:
+        return False
+
+    attempts = job.attempts + 1
+    if attempts < job.max_attempts:
+        fields = {"status": models.Job.Status.PENDING, "run_after": timezone.now() + retry_delay(attempts)}
+    else:
+        fields = {"status": models.Job.Status.FAILED, "finished_at": timezone.now()}
+
+    # the job could have been released by another worker meanwhile
+    return models.Job.objects.filter(
+        pk=job_id, status=models.Job.Status.RUNNING, attempts=job.attempts
+    ).update(attempts=attempts, error=error, updated_at=timezone.now(), **fields) == 1
+
+
+def requeue_stale(timeout: timedelta) -> int:
+    """
+    Put back in the queue the jobs that are running for too long, for example because their worker crashed.
+    The interruption counts as an attempt, so a job always crashing its worker ends up failed.
+    Return the number of requeued jobs.
+    """
+
+    stale = models.Job.objects.filter(
+        status=models.Job.Status.RUNNING,
+        started_at__lt=timezone.now() - timeout,
+    )
+
+    failed = stale.filter(attempts__gte=F("max_attempts") - 1).update(
+        status=models.Job.Status.FAILED,
+        attempts=F("attempts") + 1,
+        error="The worker stopped while running the job.",
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    if failed > 0:
+        logger.warning("%s stale job(s) failed after their last attempt.", failed)
+
+    return stale.update(
+        status=models.Job.Status.PENDING,
+        attempts=F("attempts") + 1,
+        updated_at=timezone.now(),
+    )
+
+
+def run_job(job_id) -> str:
+    """
+    Execute a claimed job and save its result. If the job fails, it is retried later until its maximum attempts.
+    Return the new status of the job.
+    """
+
+    job = models.Job.objects.get(pk=job_id)
+    job.attempts += 1
+
+    try:
+        function = import_string(job.name)
+        job.result = function(**job.arguments)
+        # the result is saved in the database, check that it can be serialized
+        json.dumps(job.result)
+
+    except Exception:  # NOQA: the errors of the jobs should not stop the worker
+        logger.exception("Job %r failed (attempt %s/%s).", job, job.attempts, job.max_attempts)
+        job.result = None
+        job.error = traceback.format_exc()
+
+        if job.attempts < job.max_attempts:
+            # retry later, waiting longer after every failure
+            job.status = models.Job.Status.PENDING
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = models.Job.Status.FAILED
+            job.finished_at = timezone.now()
+
+    else:
+        job.status = models.Job.Status.SUCCEEDED
+        job.error = ""
+        job.finished_at = timezone.now()
+
+    job.save(update_fields=["attempts", "result", "error", "status", "run_after", "finished_at", "updated_at"])
+    return job.status
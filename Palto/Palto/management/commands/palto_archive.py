@@ -0,0 +1,44 @@
+"""
+Command to move the sessions of the completed academic years into the archive tables.
+
+The sessions are moved by batches in their own transaction, so the command can be interrupted and run again.
+"""
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from Palto.Palto import archive, sharding
+
+
+class Command(BaseCommand):
+    help = "Move the sessions and the attendances of the completed academic years into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--year", type=int,
+            help="Last academic year to archive, designated by the year it starts in. The last completed by default."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.ARCHIVE_BATCH_SIZE, help="Number of sessions moved at once."
+        )
+
+    def handle(self, *args, **options):
+        current_year = archive.academic_year(timezone.now())
+
+        year: int = options["year"] if options["year"] is not None else current_year - 1
+        if year >= current_year:
+            raise CommandError(f"The academic year {year} is not completed yet.")
+
+        before = archive.academic_year_start(year + 1)
+        total = 0
+
+        for alias in settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]:
+            # the signals of the deleted sessions query the same shard
+            with sharding.shard_scope(alias if sharding.is_enabled() else None):
+                for count in archive.archive(before, options["batch_size"], alias):
+                    total += count
+                    self.stdout.write(f"{alias}: {count} session(s) archived.")
+
+        self.stdout.write(f"{total} session(s) starting before {before:%Y-%m-%d} archived.")
@@ -0,0 +1,52 @@
+"""
+Command to measure the cost of the database connections per request.
+
+Every simulated request goes through the same connection lifecycle as a real request,
+allowing to compare the "DATABASE_CONNECTION_MODE" settings.
+"""
+
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.core.signals import request_started, request_finished
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from Palto.Palto import instrumentation
+
+
+class Command(BaseCommand):
+    help = "Simulate requests doing a single query and report the connections opened and the latency per request."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Number of simulated requests.")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="Database alias to use.")
+
+    def handle(self, *args, **options):
+        alias: str = options["database"]
+        connection = connections[alias]
+
+        created_before = instrumentation.database_connection_stats()[alias]["created"]
+        durations: list[float] = []
+
+        for _ in range(options["requests"]):
+            start = time.perf_counter()
+
+            # the request signals close the connections depending on their lifecycle settings
+            request_started.send(sender=self.__class__)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            request_finished.send(sender=self.__class__)
+
+            durations.append(time.perf_counter() - start)
+
+        stats = instrumentation.database_connection_stats()[alias]
+        created = stats["created"] - created_before
+
+        self.stdout.write(f"mode: {stats['mode']} (max age: {stats['max_age']})")
+        self.stdout.write(f"connections opened: {created} ({created / len(durations):.2f} per request)")
+        self.stdout.write(f"latency mean: {statistics.mean(durations) * 1000:.3f}ms")
+        self.stdout.write(f"latency p95: {statistics.quantiles(durations, n=20)[-1] * 1000:.3f}ms")
+
+        if "pool" in stats:
+            self.stdout.write(f"pool: {stats['pool']}")
@@ -0,0 +1,53 @@
+"""
+Command to import the students, their cards and their groups from a CSV file.
+
+The file is read by chunks, every chunk being validated and written with a few bulk queries.
+"""
+
+from itertools import chain
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+
+from Palto.Palto import imports, models, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the students of a CSV file with the columns " + ", ".join(imports.STUDENT_COLUMNS) + ". "
+        "The groups are separated by semicolons."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="Path of the CSV file, encoded in UTF-8.")
+        parser.add_argument(
+            "--user", help="Username of the user importing the students, only into the departments they manage."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.IMPORT_BATCH_SIZE, help="Number of rows written at once."
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"] is not None:
+            user = models.User.objects.filter(username=options["user"]).first()
+            if user is None:
+                raise CommandError(f"Unknown user {options['user']!r}.")
+            departments = imports.editable_departments(user)
+        else:
+            # all the departments, in every shard
+            departments = list(chain.from_iterable(sharding.each(models.Department.objects.all())))
+
+        with open(options["file"], encoding="utf-8-sig", newline="") as file:
+            try:
+                report = imports.import_students(file, departments, options["batch_size"], user)
+            except ValidationError as error:
+                raise CommandError(" ".join(error.messages))
+
+        for line, errors in report.errors.items():
+            self.stderr.write(f"line {line}: {' '.join(errors)}")
+
+        self.stdout.write(
+            f"{report.created} student(s) created, {report.updated} updated, {len(report.errors)} row(s) skipped."
+        )
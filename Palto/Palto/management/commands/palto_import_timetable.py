@@ -0,0 +1,58 @@
+"""
+Command to import the sessions of an ICS or CSV timetable into a department.
+
+The events are compared to the sessions of the previous imports, and only the differences are written.
+"""
+
+import uuid
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from Palto.Palto import imports, models, sharding
+
+
+def aware_datetime(value: str) -> datetime:
+    moment = datetime.fromisoformat(value)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class Command(BaseCommand):
+    help = "Import the sessions of an ICS or CSV timetable into a department, updating the previously imported ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("department", help="Name or id of the department.")
+        parser.add_argument("file", help="Path of the timetable, encoded in UTF-8.")
+        parser.add_argument(
+            "--format", choices=["ics", "csv"], help="Format of the timetable, guessed from its extension by default."
+        )
+        parser.add_argument("--start", type=aware_datetime, help="Start of the period of the timetable.")
+        parser.add_argument("--end", type=aware_datetime, help="End of the period of the timetable.")
+
+    def handle(self, *args, **options):
+        try:
+            department_filter = {"pk": uuid.UUID(options["department"])}
+        except ValueError:
+            department_filter = {"name": options["department"]}
+
+        department = sharding.find(models.Department.objects.filter(**department_filter))
+        if department is None:
+            raise CommandError(f"Unknown department {options['department']!r}.")
+
+        file_format = options["format"] or ("csv" if options["file"].lower().endswith(".csv") else "ics")
+
+        with open(options["file"], encoding="utf-8-sig", newline="") as file:
+            try:
+                report = imports.import_timetable(file, department, file_format, options["start"], options["end"])
+            except ValidationError as error:
+                raise CommandError(" ".join(error.messages))
+
+        for line, errors in report.errors.items():
+            self.stderr.write(f"line {line}: {' '.join(errors)}")
+
+        self.stdout.write(
+            f"{report.created} session(s) created, {report.updated} updated, {report.deleted} deleted, "
+            f"{report.unchanged} unchanged, {report.kept} kept, {len(report.errors)} event(s) skipped."
+        )
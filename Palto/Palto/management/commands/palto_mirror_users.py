@@ -0,0 +1,27 @@
+"""
+Command to copy the users of the default database into every shard.
+
+The users are copied automatically when they are saved, this command is only needed when enabling the sharding
+on an existing database, or after modifying the users without their signals.
+"""
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from Palto.Palto import models, sharding
+
+
+class Command(BaseCommand):
+    help = "Copy all the users of the default database into every shard."
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("No shard configured in DATABASE_SHARDS.")
+
+        count = 0
+        for user in models.User.objects.using(DEFAULT_DB_ALIAS).iterator():
+            sharding.mirror(user)
+            count += 1
+
+        self.stdout.write(f"{count} user(s) copied into {len(settings.DATABASE_SHARDS)} shard(s).")
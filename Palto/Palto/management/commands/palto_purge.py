@@ -0,0 +1,43 @@
+"""
+Command to delete a department, or the rows older than a moment, by small batches.
+
+Every batch is deleted in its own transaction, so the command can be interrupted and run again.
+"""
+
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from Palto.Palto import purge
+
+
+class Command(BaseCommand):
+    help = "Delete a department, or the sessions, the archived sessions and the absences older than a date."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--department", help="Id of the department to delete, or to purge with --before.")
+        parser.add_argument(
+            "--before", type=datetime.fromisoformat,
+            help="Only delete the rows older than this date, for example 2020-09-01."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.PURGE_BATCH_SIZE, help="Number of rows deleted at once."
+        )
+
+    def handle(self, *args, **options):
+        before = options["before"]
+        if before is not None and timezone.is_naive(before):
+            before = timezone.make_aware(before)
+
+        if options["department"] is None and before is None:
+            raise CommandError("A department or a date is required.")
+
+        totals: dict[str, int] = {}
+
+        for alias, kind, count in purge.purge(options["department"], before, options["batch_size"]):
+            totals[kind] = totals.get(kind, 0) + count
+            self.stdout.write(f"{alias}: {count} {kind} deleted ({totals[kind]} in total).")
+
+        self.stdout.write(", ".join(f"{count} {kind}" for kind, count in totals.items()) + " deleted.")
@@ -0,0 +1,25 @@
+"""
+Command to rebuild the links between the absences and the sessions.
+
+The links are normally maintained automatically, this command fix them after raw modifications of the database.
+"""
+
+import time
+
+from django.core.management import BaseCommand
+
+from Palto.Palto import absence_links
+
+
+class Command(BaseCommand):
+    help = "Rebuild the links between the absences and the sessions they cover."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of absences processed at once.")
+
+    def handle(self, *args, **options):
+        start_time = time.perf_counter()
+        count = absence_links.rebuild(chunk_size=options["chunk_size"])
+        duration = time.perf_counter() - start_time
+
+        self.stdout.write(f"{count} link(s) rebuilt in {duration:.2f}s.")
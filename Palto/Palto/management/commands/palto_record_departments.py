@@ -0,0 +1,32 @@
+"""
+Command to record the shard of every department in the directory of the default database.
+
+The departments are recorded automatically when they are saved, this command is only needed when enabling the
+sharding on an existing database, and must be run before adding a shard.
+"""
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from Palto.Palto import models, sharding
+
+
+class Command(BaseCommand):
+    help = "Record the shard and the name of every department in the directory of the default database."
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("No shard configured in DATABASE_SHARDS.")
+
+        count = 0
+        for alias in settings.DATABASE_SHARDS:
+            for department in models.Department.objects.using(alias).iterator():
+                try:
+                    sharding.record_department(department, alias)
+                except IntegrityError:
+                    self.stderr.write(f"The name of the department {department.pk} is used in another shard.")
+                    continue
+                count += 1
+
+        self.stdout.write(f"{count} department(s) recorded.")
@@ -0,0 +1,240 @@
+"""
+Command to simulate the scans storm of the beginning of the day against a started server.
+
+A dataset is created in the database of the server : a department with sessions starting now, students with a card
+and a scanner device per session. The readers then post the cards of the students while teachers display their
+sessions and students list theirs, and the throughput, the latency and the errors of every kind of request are reported.
+"""
+
+import math
+import random
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import timedelta
+from importlib import import_module
+from typing import Optional
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from Palto.Palto import models, sharding
+
+
+# the statuses expected for every kind of request, the other ones are errors
+EXPECTED_STATUSES: dict[str, set[int]] = {
+    # the unknown cards are rejected with a 404
+    "scan": {200, 201, 404},
+    "teacher": {200},
+    "student": {200},
+}
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # a redirection to the login page means that the session was refused, it should be counted as an error
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+@dataclass
+class Dataset:
+    department: models.Department
+    users: list[models.User]
+    # the session, the token of its reader and the cards of its students
+    readers: list[tuple[models.TeachingSession, str, list[str]]] = field(default_factory=list)
+    # the session cookie and the path polled by every teacher or student
+    teachers: list[tuple[str, str]] = field(default_factory=list)
+    students: list[tuple[str, str]] = field(default_factory=list)
+
+
+def percentile(values: list[float], rank: float) -> float:
+    """
+    Return the value under which is the given percentage of the sorted values.
+    """
+
+    return values[max(math.ceil(len(values) * rank / 100) - 1, 0)]
+
+
+def login_cookie(user: models.User) -> str:
+    """
+    Create a session for a user as if they logged in and return its key.
+    """
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+
+    return session.session_key
+
+
+@transaction.atomic
+def seed(sessions: int, students_per_session: int, teachers: int, students: int) -> Dataset:
+    """
+    Create the department, its sessions starting now, their students with their cards and their readers.
+    """
+
+    suffix = secrets.token_hex(4)
+    now = timezone.now()
+
+    def make_users(prefix: str, count: int) -> list[models.User]:
+        users = [models.User(username=f"{prefix}-{suffix}-{index}") for index in range(count)]
+        for user in users:
+            user.set_unusable_password()
+        users = models.User.objects.bulk_create(users)
+        # the bulk creation skips the signal copying the users into the shards
+        sharding.mirror_many(users)
+        return users
+
+    department_teachers = make_users("storm-teacher", sessions)
+    department_students = make_users("storm-student", sessions * students_per_session)
+
+    department = models.Department.objects.create(name=f"Scan storm {suffix}", email="storm@palto.invalid")
+    department.teachers.add(*department_teachers)
+    department.students.add(*department_students)
+
+    unit = models.TeachingUnit.objects.create(name="Scan storm", department=department)
+    unit.teachers.add(*department_teachers)
+
+    dataset = Dataset(department=department, users=department_teachers + department_students)
+
+    for index, teacher in enumerate(department_teachers):
+        group_students = department_students[index * students_per_session:(index + 1) * students_per_session]
+
+        group = models.StudentGroup.objects.create(name=f"Group {index}", department=department, owner=teacher)
+        group.students.add(*group_students)
+
+        session = models.TeachingSession.objects.create(
+            start=now, duration=timedelta(hours=2), unit=unit, group=group, teacher=teacher
+        )
+
+        cards = models.StudentCard.objects.bulk_create(
+            models.StudentCard(uid=secrets.token_bytes(7), department=department, owner=student)
+            for student in group_students
+        )
+
+        device = models.ScannerDevice(name=f"Reader {index}", department=department)
+        token = device.reset_token()
+        device.save()
+
+        dataset.readers.append((session, token, [bytes(card.uid).hex() for card in cards]))
+
+    for session, _, _ in dataset.readers[:teachers]:
+        dataset.teachers.append((login_cookie(session.teacher), f"/teaching_sessions/view/{session.pk}/"))
+
+    for student in department_students[:students]:
+        dataset.students.append((login_cookie(student), "/teaching_sessions/"))
+
+    return dataset
+
+
+class Command(BaseCommand):
+    help = "Simulate the readers of many sessions starting together against a started server and report its latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000", help="Address of the started server.")
+        parser.add_argument("--readers", type=int, default=20, help="Number of sessions, each with its own reader.")
+        parser.add_argument("--group-size", type=int, default=30, help="Number of students of every session.")
+        parser.add_argument("--teachers", type=int, default=5, help="Number of teachers polling their session page.")
+        parser.add_argument("--students", type=int, default=10, help="Number of students listing their sessions.")
+        parser.add_argument("--duration", type=float, default=30.0, help="Duration of the storm, in seconds.")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds waited by every client between requests.")
+        parser.add_argument(
+            "--unknown-cards", type=float, default=0.05, help="Proportion of the scans made with an unknown card."
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the created dataset at the end.")
+
+    def handle(self, *args, **options):
+        base_url: str = options["url"].rstrip("/")
+
+        self.stdout.write("seeding the dataset...")
+        dataset = seed(options["readers"], options["group_size"], options["teachers"], options["students"])
+
+        lock = threading.Lock()
+        latencies: defaultdict[str, list[float]] = defaultdict(list)
+        statuses: defaultdict[str, Counter[Optional[int]]] = defaultdict(Counter)
+        deadline = time.monotonic() + options["duration"]
+        opener = urllib.request.build_opener(NoRedirectHandler)
+
+        def send(kind: str, request: urllib.request.Request) -> None:
+            start = time.perf_counter()
+            try:
+                with opener.open(request, timeout=30) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            except OSError:
+                # the server did not answer, counted as an error without status
+                status = None
+            duration = time.perf_counter() - start
+
+            with lock:
+                latencies[kind].append(duration)
+                statuses[kind][status] += 1
+
+        def reader(session: models.TeachingSession, token: str, cards: list[str]) -> None:
+            while time.monotonic() < deadline:
+                # a student scanning twice, or a card unknown by the department
+                card = secrets.token_hex(7) if random.random() < options["unknown_cards"] else random.choice(cards)
+                send("scan", urllib.request.Request(
+                    f"{base_url}/api/v1/scans/",
+                    data=f'{{"card": "{card}", "session": "{session.pk}"}}'.encode(),
+                    headers={"Authorization": f"Device {token}", "Content-Type": "application/json"},
+                    method="POST",
+                ))
+                time.sleep(options["pause"])
+
+        def visitor(kind: str, cookie: str, path: str) -> None:
+            while time.monotonic() < deadline:
+                send(kind, urllib.request.Request(
+                    f"{base_url}{path}", headers={"Cookie": f"{settings.SESSION_COOKIE_NAME}={cookie}"}
+                ))
+                time.sleep(options["pause"])
+
+        threads = [threading.Thread(target=reader, args=arguments) for arguments in dataset.readers]
+        threads += [threading.Thread(target=visitor, args=("teacher", *arguments)) for arguments in dataset.teachers]
+        threads += [threading.Thread(target=visitor, args=("student", *arguments)) for arguments in dataset.students]
+
+        self.stdout.write(f"{len(threads)} clients running for {options['duration']}s on {base_url}...")
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        for kind in EXPECTED_STATUSES:
+            if not latencies[kind]:
+                continue
+
+            values = sorted(latencies[kind])
+            errors = sum(count for status, count in statuses[kind].items() if status not in EXPECTED_STATUSES[kind])
+            details = ", ".join(f"{status}={count}" for status, count in sorted(statuses[kind].items(), key=str))
+
+            self.stdout.write(
+                f"{kind}: {len(values)} requests, {len(values) / elapsed:.1f}/s, "
+                f"p50 {percentile(values, 50) * 1000:.1f}ms, "
+                f"p95 {percentile(values, 95) * 1000:.1f}ms, "
+                f"p99 {percentile(values, 99) * 1000:.1f}ms, "
+                f"errors {errors / len(values):.2%} ({details})"
+            )
+
+        if options["keep"]:
+            self.stdout.write(f"dataset kept in the department {dataset.department.name!r}.")
+        else:
+            session_store = import_module(settings.SESSION_ENGINE).SessionStore()
+            for cookie, _ in dataset.teachers + dataset.students:
+                session_store.delete(cookie)
+
+            # the users own the groups, the sessions and the cards of the department
+            models.User.objects.filter(pk__in=[user.pk for user in dataset.users]).delete()
+            dataset.department.delete()
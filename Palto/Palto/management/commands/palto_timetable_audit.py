@@ -0,0 +1,44 @@
+"""
+Command to audit the timetable of a department.
+
+List all the sessions overlapping for a same teacher, a same group or for students shared between groups.
+"""
+
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from Palto.Palto import models, conflicts
+from Palto.Palto.utils import get_object_or_none
+
+
+class Command(BaseCommand):
+    help = "List the conflicting sessions of a department."
+
+    def add_arguments(self, parser):
+        parser.add_argument("department", help="Name or id of the department.")
+        parser.add_argument("--start", type=parse_datetime, help="Only check the sessions after this date.")
+        parser.add_argument("--end", type=parse_datetime, help="Only check the sessions before this date.")
+
+    def handle(self, *args, **options):
+        department = get_object_or_none(models.Department.objects, name=options["department"])
+        if department is None:
+            try:
+                department = get_object_or_none(models.Department.objects, pk=options["department"])
+            except Exception:  # NOQA: the value is not a valid id
+                department = None
+        if department is None:
+            raise CommandError(f"Unknown department {options['department']!r}.")
+
+        start_time = time.perf_counter()
+        department_conflicts = conflicts.audit(department, options["start"], options["end"])
+        duration = time.perf_counter() - start_time
+
+        for conflict in department_conflicts:
+            line = f"[{conflict.kind}] {conflict.first.short_id} {conflict.first} / {conflict.second.short_id} {conflict.second}"
+            if conflict.students:
+                line += f" ({len(conflict.students)} students)"
+            self.stdout.write(line)
+
+        self.stdout.write(f"{len(department_conflicts)} conflict(s) found in {duration:.2f}s.")
@@ -0,0 +1,99 @@
+"""
+Command to execute the background jobs.
+
+The worker polls the database for pending jobs and executes them in a pool of threads or processes.
+"""
+
+import time
+import traceback
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.management import BaseCommand
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from Palto.Palto import jobs, models, slow_queries
+
+
+def _initialize_process():
+    # the processes started with "spawn" need to load django again
+    django.setup()
+
+
+def _run_job(job_id) -> str:
+    # the connections of the threads and processes are not managed by the request cycle
+    close_old_connections()
+
+    try:
+        with slow_queries.watch("run_palto_worker"):
+            return jobs.run_job(job_id)
+    except Exception:
+        # the job itself did not fail, it is executed again later
+        jobs.release(job_id, traceback.format_exc())
+        raise
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Execute the pending background jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pool", choices=["thread", "process"], default="thread", help="Kind of pool to use.")
+        parser.add_argument("--workers", type=int, default=4, help="Number of jobs executed at the same time.")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds to wait when no job is pending.")
+        parser.add_argument(
+            "--stale-after", type=int, default=3600,
+            help="Seconds after which a running job is considered abandoned and executed again."
+        )
+        parser.add_argument("--once", action="store_true", help="Stop once no job is pending.")
+
+    def handle(self, *args, **options):
+        workers: int = options["workers"]
+        stale_after = timedelta(seconds=options["stale_after"])
+
+        executor: Executor
+        if options["pool"] == "process":
+            # the child processes should not share the connections of this process
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_initialize_process)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        running: set[Future] = set()
+
+        with executor:
+            while True:
+                for future in [future for future in running if future.done()]:
+                    running.remove(future)
+                    # the errors of the jobs are handled by run_job, these are the errors of the worker itself
+                    if future.exception() is not None:
+                        self.stderr.write(f"Worker error: {future.exception()!r}")
+
+                requeued = jobs.requeue_stale(stale_after)
+                if requeued > 0:
+                    self.stderr.write(f"{requeued} stale job(s) requeued.")
+
+                # find the next jobs for the available workers
+                job_ids = list(
+                    models.Job.objects.filter(
+                        status=models.Job.Status.PENDING,
+                        run_after__lte=timezone.now(),
+                    ).order_by("run_after").values_list("pk", flat=True)[:workers - len(running)]
+                )
+
+                for job_id in job_ids:
+                    if jobs.claim(job_id):
+                        running.add(executor.submit(_run_job, job_id))
+
+                if not job_ids:
+                    # the jobs released by an error of their worker are still pending, waiting for their retry
+                    if options["once"] and not running and not models.Job.objects.filter(
+                        status=models.Job.Status.PENDING
+                    ).exists():
+                        break
+
+                    close_old_connections()
+                    time.sleep(options["poll"])
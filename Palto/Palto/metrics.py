@@ -0,0 +1,284 @@
+"""
+Metrics for the Palto project.
+
+The metrics are counted in the memory of every process and exposed in the Prometheus text format by the metrics view.
+With multiple workers, every process regularly saves its metrics in a file of the METRICS_DIRECTORY, and the metrics
+view adds the values of all the files, so the scrape gives the same result whatever the process answering it.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from django.conf import settings
+
+
+# the default buckets of the durations, in seconds
+DURATION_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# the default buckets of the number of queries
+QUERIES_BUCKETS: tuple[float, ...] = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+_lock = threading.Lock()
+_registry: dict[str, "Metric"] = {}
+_last_flush: float = 0.0
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: str, **extra: str) -> str:
+    labels = [*json.loads(key), *extra.items()]
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """
+    A metric, with a value for every combination of its labels.
+    """
+
+    kind: str
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # the values by labels, the labels being saved as a key of a dictionary
+        self.values: dict[str, Any] = {}
+
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> str:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"The metric {self.name!r} expects the labels {self.labels}, not {tuple(labels)}.")
+
+        return json.dumps(sorted((name, str(value)) for name, value in labels.items()))
+
+    @property
+    def family(self) -> str:
+        """
+        The name of the metric in the exposition, shared by its help, its type and its samples.
+        """
+
+        return self.name
+
+    @staticmethod
+    def merge(first, second):
+        raise NotImplementedError()
+
+    def exposition(self, values: dict) -> Iterator[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    """
+    A value that can only increase, for example a number of requests.
+    """
+
+    kind = "counter"
+
+    @property
+    def family(self) -> str:
+        # the samples of the counters are suffixed by "_total"
+        return f"{self.name}_total"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+        flush()
+
+    @staticmethod
+    def merge(first: float, second: float) -> float:
+        return first + second
+
+    def exposition(self, values: dict) -> Iterator[str]:
+        for key, value in values.items():
+            yield f"{self.family}{_format_labels(key)} {value}"
+
+
+class Histogram(Metric):
+    """
+    The distribution of a value in buckets, for example the duration of the requests.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+
+        with _lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data["buckets"][index] += 1
+            data["sum"] += value
+            data["count"] += 1
+
+        flush()
+
+    @contextlib.contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observe the duration of a block of code.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def merge(first: dict, second: dict) -> dict:
+        return {
+            "buckets": [a + b for a, b in zip(first["buckets"], second["buckets"])],
+            "sum": first["sum"] + second["sum"],
+            "count": first["count"] + second["count"],
+        }
+
+    def exposition(self, values: dict) -> Iterator[str]:
+        for key, data in values.items():
+            # the buckets of the Prometheus format are cumulative, as the ones of the values
+            for bound, count in zip(self.buckets, data["buckets"]):
+                yield f"{self.name}_bucket{_format_labels(key, le=repr(float(bound)))} {count}"
+            yield f"{self.name}_bucket{_format_labels(key, le='+Inf')} {data['count']}"
+            yield f"{self.name}_sum{_format_labels(key)} {data['sum']}"
+            yield f"{self.name}_count{_format_labels(key)} {data['count']}"
+
+
+# multiple processes
+
+
+def _process_file() -> Path:
+    return Path(settings.METRICS_DIRECTORY) / f"metrics-{os.getpid()}.json"
+
+
+def snapshot() -> dict[str, dict]:
+    """
+    Return a copy of the metrics of this process.
+    """
+
+    with _lock:
+        return {name: json.loads(json.dumps(metric.values)) for name, metric in _registry.items()}
+
+
+def flush(force: bool = False) -> None:
+    """
+    Save the metrics of this process in its file, at most every METRICS_FLUSH_INTERVAL seconds.
+    """
+
+    global _last_flush
+
+    if not settings.METRICS_DIRECTORY:
+        return
+
+    now = time.monotonic()
+    if not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+
+    path = _process_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # write in a temporary file first, so the other processes never read a partial file
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(snapshot()))
+    os.replace(temporary_path, path)
+
+
+# save the last values when the process stop
+atexit.register(flush, force=True)
+
+
+def collect() -> dict[str, dict]:
+    """
+    Return the metrics of all the processes.
+    """
+
+    values = snapshot()
+
+    if not settings.METRICS_DIRECTORY:
+        return values
+
+    own_file = _process_file()
+    for path in Path(settings.METRICS_DIRECTORY).glob("metrics-*.json"):
+        # the values of this process are more recent in memory
+        if path == own_file:
+            continue
+
+        try:
+            process_values = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # the file was removed or is being replaced
+            continue
+
+        for name, metric_values in process_values.items():
+            metric = _registry.get(name)
+            if metric is None:
+                continue
+
+            merged = values.setdefault(name, {})
+            for key, value in metric_values.items():
+                merged[key] = metric.merge(merged[key], value) if key in merged else value
+
+    return values
+
+
+def exposition() -> str:
+    """
+    Return the metrics of all the processes in the Prometheus text format.
+    """
+
+    values = collect()
+    lines = []
+
+    for name, metric in sorted(_registry.items()):
+        lines.append(f"# HELP {metric.family} {_escape(metric.documentation)}")
+        lines.append(f"# TYPE {metric.family} {metric.kind}")
+        lines.extend(metric.exposition(values.get(name, {})))
+
+    return "\n".join(lines) + "\n"
+
+
+# metrics of the project
+
+REQUEST_DURATION = Histogram(
+    "palto_request_duration_seconds",
+    "Duration of the requests by url name.",
+    labels=("view", "method", "status"),
+)
+REQUEST_QUERIES = Histogram(
+    "palto_request_queries",
+    "Number of database queries of the requests by url name.",
+    labels=("view",),
+    buckets=QUERIES_BUCKETS,
+)
+SCANS = Counter(
+    "palto_scans",
+    "Number of cards scanned by the scanner devices, by outcome.",
+    labels=("outcome",),
+)
+PERMISSION_DURATION = Histogram(
+    "palto_permission_duration_seconds",
+    "Duration of the permission checks by model and rule.",
+    labels=("model", "rule"),
+)
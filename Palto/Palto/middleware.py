@@ -0,0 +1,202 @@
+"""
+Middlewares for the Palto project.
+
+A middleware is called around every request, allowing to prepare a state for the request or to modify the response.
+"""
+
+import logging
+import random
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from Palto.Palto import models, routers, instrumentation, metrics, sharding, slow_queries
+
+
+performance_logger = logging.getLogger("Palto.performance")
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Prepare the database routing state of the request.
+
+    The safe requests of the API are allowed to read from the replicas. When a request write into the database,
+    the client is pinned to the primary database for a few seconds to hide the replication lag.
+    """
+
+    # paths that are allowed to read from the replicas for the safe methods
+    REPLICA_PATHS: tuple[str, ...] = ("/api/",)
+    # cookie used to pin a client to the primary database after a write
+    PIN_COOKIE: str = "palto_primary_pin"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: WSGIRequest) -> HttpResponse:
+        replica_allowed = (
+            request.method in SAFE_METHODS and
+            request.path.startswith(self.REPLICA_PATHS) and
+            self.PIN_COOKIE not in request.COOKIES
+        )
+
+        with routers.routing_scope(replica_allowed) as routing:
+            response = self.get_response(request)
+
+        if routing.has_written and settings.DATABASE_REPLICAS:
+            # read our own writes for the next requests of this client
+            response.set_cookie(
+                self.PIN_COOKIE,
+                "1",
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+
+        return response
+
+
+class DepartmentShardMiddleware:
+    """
+    Scope the request to the shard of the department it concerns, when the sharding is enabled.
+
+    The department is given by the "X-Palto-Department" header or the "department" parameter, or found from the
+    object of the url, which is always used to modify an object. Without department, the lists are made on every
+    shard.
+    """
+
+    # the objects designated by the arguments of the urls
+    URL_OBJECTS: dict[str, type] = {
+        "unit_id": models.TeachingUnit,
+        "session_id": models.TeachingSession,
+        "group_id": models.StudentGroup,
+        "absence_id": models.Absence,
+        "attachment_id": models.AbsenceAttachment,
+    }
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: WSGIRequest) -> HttpResponse:
+        if not sharding.is_enabled():
+            return self.get_response(request)
+
+        with sharding.shard_scope():
+            return self.get_response(request)
+
+    def process_view(self, request: WSGIRequest, view_func, view_args, view_kwargs) -> None:
+        if not sharding.is_enabled():
+            return None
+
+        for argument, model in self.URL_OBJECTS.items():
+            if argument in view_kwargs:
+                break
+        else:
+            # the objects of the API are designated by their primary key
+            argument, model = "pk", getattr(getattr(view_func, "cls", None), "model_class", None)
+        has_object = argument in view_kwargs and model is not None and sharding.is_partitioned(model)
+
+        department_id = view_kwargs.get("department_id")
+        if department_id is None and (request.method in ("GET", "HEAD", "OPTIONS") or not has_object):
+            # the modifications of an object are always made in its shard, whatever the department given
+            department_id = request.headers.get("X-Palto-Department") or request.GET.get("department")
+
+        if department_id is not None:
+            try:
+                sharding.set_department(uuid.UUID(str(department_id)))
+            except ValueError:
+                # an invalid department is refused later by the view
+                pass
+            return None
+
+        if has_object:
+            try:
+                alias = sharding.locate(model, view_kwargs[argument])
+            except ValidationError:
+                # an invalid identifier is refused later by the view
+                return None
+
+            if alias is not None:
+                sharding.set_shard(alias)
+
+        return None
+
+
+class ServerTimingMiddleware:
+    """
+    Measure where the time of a sample of the requests is spent.
+
+    The SQL queries, the serializers and the templates timings are added to the response in the "Server-Timing"
+    header, visible in the browsers developer tools, and logged in the "Palto.performance" logger.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: WSGIRequest) -> HttpResponse:
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with instrumentation.measure_request() as timings:
+            response = self.get_response(request)
+
+        total = timings.total
+        durations = {kind: timings.durations.get(kind, 0.0) for kind in ("sql", "serializer", "template")}
+
+        response["Server-Timing"] = ", ".join([
+            f'sql;dur={durations["sql"] * 1000:.1f};desc="{timings.sql_count} queries"',
+            f'serializer;dur={durations["serializer"] * 1000:.1f}',
+            f'template;dur={durations["template"] * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        performance_logger.info(
+            "method=%s path=%s status=%s total_ms=%.1f sql_count=%s sql_ms=%.1f serializer_ms=%.1f template_ms=%.1f",
+            request.method, request.path, response.status_code, total * 1000, timings.sql_count,
+            durations["sql"] * 1000, durations["serializer"] * 1000, durations["template"] * 1000,
+        )
+
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Count the duration and the number of queries of a sample of the requests in the metrics, by url name.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: WSGIRequest) -> HttpResponse:
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        with instrumentation.measure_request() as timings:
+            response = self.get_response(request)
+
+        # use the name of the url rather than the path, so the objects ids don't create a label for every object
+        resolver_match = request.resolver_match
+        view = resolver_match.view_name if resolver_match is not None and resolver_match.view_name else "unknown"
+
+        metrics.REQUEST_DURATION.observe(
+            timings.total, view=view, method=request.method, status=response.status_code
+        )
+        metrics.REQUEST_QUERIES.observe(timings.sql_count, view=view)
+
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Log the queries of the requests slower than SLOW_QUERY_THRESHOLD_MS, with the view that made them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: WSGIRequest) -> HttpResponse:
+        with slow_queries.watch(request):
+            return self.get_response(request)
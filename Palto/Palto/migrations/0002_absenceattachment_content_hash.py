@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:29
+
+import Palto.Palto.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='absenceattachment',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='absenceattachment',
+            name='content',
+            field=models.FileField(storage=Palto.Palto.storage.ContentAddressedStorage(), upload_to='absence/attachment/'),
+        ),
+    ]
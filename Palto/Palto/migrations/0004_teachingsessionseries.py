@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:36
+
+import Palto.Palto.models
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0003_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeachingSessionSeries',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('time', models.TimeField()),
+                ('duration', models.DurationField()),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('exclusions', models.JSONField(blank=True, default=list)),
+                ('note', models.TextField(blank=True)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='teaching_sessions_series', to='Palto.studentgroup')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='teaching_sessions_series', to=settings.AUTH_USER_MODEL)),
+                ('unit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions_series', to='Palto.teachingunit')),
+            ],
+            bases=(models.Model, Palto.Palto.models.ModelPermissionHelper),
+        ),
+        migrations.AddField(
+            model_name='teachingsession',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sessions', to='Palto.teachingsessionseries'),
+        ),
+    ]
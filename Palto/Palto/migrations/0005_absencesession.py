@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_links(apps, schema_editor):
+    # link the existing absences with the sessions they cover
+    Absence = apps.get_model("Palto", "Absence")
+    AbsenceSession = apps.get_model("Palto", "AbsenceSession")
+
+    links = Absence.objects.filter(
+        student__student_groups__teaching_sessions__unit__department=models.F("department"),
+        student__student_groups__teaching_sessions__start__range=(models.F("start"), models.F("end")),
+    ).values_list("pk", "student__student_groups__teaching_sessions").distinct()
+
+    AbsenceSession.objects.bulk_create(
+        AbsenceSession(absence_id=absence_id, session_id=session_id)
+        for absence_id, session_id in links
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0004_teachingsessionseries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AbsenceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('absence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='session_links', to='Palto.absence')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='absence_links', to='Palto.teachingsession')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='absence',
+            name='sessions',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='absences', through='Palto.AbsenceSession', to='Palto.teachingsession'),
+        ),
+        migrations.AddIndex(
+            model_name='absencesession',
+            index=models.Index(fields=['session', 'absence'], name='Palto_absen_session_3ad290_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='absencesession',
+            constraint=models.UniqueConstraint(fields=('absence', 'session'), name='unique_absence_session'),
+        ),
+        migrations.RunPython(populate_links, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:42
+
+import Palto.Palto.models
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0005_absencesession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScannerDevice',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64)),
+                ('token_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scanner_devices', to='Palto.department')),
+                ('teacher', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='scanner_devices', to=settings.AUTH_USER_MODEL)),
+            ],
+            bases=(models.Model, Palto.Palto.models.ModelPermissionHelper),
+        ),
+    ]
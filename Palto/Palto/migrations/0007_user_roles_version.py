@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0006_scannerdevice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='roles_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
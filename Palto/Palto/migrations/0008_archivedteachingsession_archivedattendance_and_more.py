@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:11
+
+import Palto.Palto.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0007_user_roles_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTeachingSession',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('academic_year', models.PositiveSmallIntegerField()),
+                ('start', models.DateTimeField()),
+                ('duration', models.DurationField()),
+                ('note', models.TextField(blank=True)),
+                ('unit_id', models.UUIDField()),
+                ('unit_name', models.CharField(max_length=64)),
+                ('group_id', models.UUIDField()),
+                ('group_name', models.CharField(max_length=128)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sessions', to='Palto.department')),
+                ('teacher', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_teaching_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            bases=(models.Model, Palto.Palto.models.ModelPermissionHelper),
+        ),
+        migrations.CreateModel(
+            name='ArchivedAttendance',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateTimeField()),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attendances', to=settings.AUTH_USER_MODEL)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendances', to='Palto.archivedteachingsession')),
+            ],
+            bases=(models.Model, Palto.Palto.models.ModelPermissionHelper),
+        ),
+        migrations.AddIndex(
+            model_name='archivedteachingsession',
+            index=models.Index(fields=['department', 'academic_year', 'start'], name='Palto_archi_departm_78bd75_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0008_archivedteachingsession_archivedattendance_and_more'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='studentcard',
+            constraint=models.UniqueConstraint(fields=('department', 'uid'), name='unique_student_card_uid'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0009_studentcard_unique_student_card_uid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teachingsession',
+            name='source_uid',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from Palto.Palto.search import FIELDS, tokens_of
+
+
+def index_users(apps, schema_editor):
+    # the users already created are indexed in every database, with their copies in the shards
+    User = apps.get_model("Palto", "User")
+    UserSearchToken = apps.get_model("Palto", "UserSearchToken")
+    using = schema_editor.connection.alias
+
+    UserSearchToken.objects.using(using).bulk_create(
+        [
+            UserSearchToken(user_id=values[0], token=token)
+            for values in User.objects.using(using).values_list("pk", *FIELDS).iterator()
+            for token in tokens_of(*values[1:])
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0011_change_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('token', 'user'), name='unique_user_search_token')],
+            },
+        ),
+        migrations.RunPython(index_users, migrations.RunPython.noop),
+    ]
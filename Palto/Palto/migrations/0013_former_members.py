@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0012_usersearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormerMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department_id', models.UUIDField()),
+                ('user_id', models.UUIDField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'department_id'), name='unique_former_member')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0013_former_members'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='absenceattachment',
+            name='filename',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Palto', '0014_absenceattachment_filename'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentShard',
+            fields=[
+                ('department_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('alias', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=64, unique=True)),
+            ],
+        ),
+    ]
@@ -4,15 +4,24 @@ Models for the Palto project.
 Models are the class that represent and abstract the database.
 """
 
+import hashlib
+import os
+import secrets
 import uuid
 from abc import abstractmethod
-from datetime import datetime, timedelta
-from typing import Iterable, Callable, Any
+from datetime import datetime, timedelta, date, time
+from itertools import chain
+from typing import Iterable, Callable, Any, Optional
 
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+from django.core.files import File
 from django.db import models
 from django.db.models import QuerySet, Q, F
+from django.utils import timezone
+
+from Palto.Palto import metrics, sharding
+from Palto.Palto.storage import attachment_storage
 
 
 # TODO(Faraphel): split permissions from models for readability
@@ -48,7 +57,8 @@ class ModelPermissionHelper:
         Return True if the user can edit this object
         """
 
-        return self in self.all_editable_by_user(user)
+        with metrics.PERMISSION_DURATION.time(model=type(self).__name__, rule="editable"):
+            return self in self.all_editable_by_user(user)
 
     @classmethod
     @abstractmethod
@@ -62,10 +72,56 @@ class ModelPermissionHelper:
         Return True if the user can see this object
         """
 
-        return self in self.all_visible_by_user(user)
+        with metrics.PERMISSION_DURATION.time(model=type(self).__name__, rule="visible"):
+            return self in self.all_visible_by_user(user)
+
+
+class UserRoles:
+    """
+    The ids of the departments and units a user is related to.
+
+    Every role is only fetched from the database when first used, unless it was given by the claims of a token.
+    """
+
+    NAMES: tuple[str, ...] = (
+        "managing_departments",
+        "teaching_departments",
+        "studying_departments",
+        "managing_units",
+        "teaching_units",
+    )
+
+    def __init__(self, user: "User", **roles: Iterable):
+        self._user = user
+        for name, ids in roles.items():
+            setattr(self, name, frozenset(ids))
+
+    def __getattr__(self, name: str) -> frozenset:
+        if name not in self.NAMES:
+            raise AttributeError(name)
+
+        # with the sharding, the user can be related to departments of several shards
+        ids = frozenset(chain.from_iterable(
+            sharding.each(getattr(self._user, name).values_list("pk", flat=True))
+        ))
+        setattr(self, name, ids)
+        return ids
 
 
-class User(AbstractUser, ModelPermissionHelper):
+class ChangeTrackedModel(models.Model):
+    """
+    A model whose creations and modifications are dated, to give the clients only what changed since their last
+    synchronisation. The deletions are kept as tombstones.
+    """
+
+    created_at: datetime = models.DateTimeField(auto_now_add=True)
+    updated_at: datetime = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+
+class User(AbstractUser, ChangeTrackedModel, ModelPermissionHelper):
     """
     A user.
 
@@ -73,6 +129,8 @@ class User(AbstractUser, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+    # incremented every time the user roles change, to invalidate the roles claims of his tokens
+    roles_version: int = models.PositiveIntegerField(default=0, editable=False)
 
     def __repr__(self):
         return f"<{self.__class__.__name__} id={self.short_id} username={self.username!r}>"
@@ -104,6 +162,30 @@ class User(AbstractUser, ModelPermissionHelper):
 
         return self.multiple_related_departments([self])
 
+    @property
+    def roles(self) -> UserRoles:
+        """
+        The ids of the departments and units the user is related to.
+        """
+
+        if getattr(self, "_roles", None) is None:
+            self._roles = UserRoles(self)
+        return self._roles
+
+    @roles.setter
+    def roles(self, roles: UserRoles) -> None:
+        self._roles = roles
+
+    @staticmethod
+    def bump_roles_version(user_ids: Iterable) -> None:
+        """
+        Invalidate the roles claims of the tokens of some users.
+        """
+
+        # the copies of the users in the shards are updated too, since they are read by the requests of a shard
+        for queryset in sharding.each(User.objects.filter(pk__in=set(user_ids)), include_default=True):
+            queryset.update(roles_version=F("roles_version") + 1)
+
     # permissions
 
     @classmethod
@@ -113,7 +195,7 @@ class User(AbstractUser, ModelPermissionHelper):
             return True
 
         # if the user is managing a department, allow him to create user
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
     @classmethod
@@ -125,7 +207,7 @@ class User(AbstractUser, ModelPermissionHelper):
             queryset = cls.objects.all()
         else:
             # all the users related to a department the user is managing
-            if user.managing_departments.count() > 0:
+            if user.roles.managing_departments:
                 queryset = cls.objects.all()
 
         return queryset.order_by("pk")
@@ -139,10 +221,35 @@ class User(AbstractUser, ModelPermissionHelper):
             # if the user is in one of the same department as the requesting user
             queryset = Department.multiple_related_users(user.related_departments)
 
+            if sharding.is_enabled() and sharding.get_shard() is None:
+                # the departments can be in several shards, the users of every shard are gathered by their id
+                queryset = cls.objects.filter(pk__in=set(chain.from_iterable(
+                    sharding.each(queryset.values_list("pk", flat=True))
+                )))
+
         return queryset.order_by("pk")
 
 
-class Department(models.Model, ModelPermissionHelper):
+class UserSearchToken(models.Model):
+    """
+    A word of the names or the email of a user, normalized, to search the users by the start of these words.
+
+    The tokens are indexed, so a search reads a range of the index instead of scanning all the users.
+    """
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="search_tokens")
+    token: str = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["token", "user"], name="unique_user_search_token"),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} user={self.user_id} token={self.token!r}>"
+
+
+class Department(ChangeTrackedModel, ModelPermissionHelper):
     """
     A scholar department.
 
@@ -151,6 +258,10 @@ class Department(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     name: str = models.CharField(max_length=64, unique=True)
     email: str = models.EmailField()
 
@@ -164,6 +275,13 @@ class Department(models.Model, ModelPermissionHelper):
     def __str__(self):
         return self.name
 
+    def validate_unique(self, exclude=None):
+        super().validate_unique(exclude)
+
+        # with the sharding, a department with the same name can be in another shard
+        if (exclude is None or "name" not in exclude) and sharding.is_department_name_taken(self.name, self.pk):
+            raise ValidationError({"name": self.unique_error_message(Department, ["name"])})
+
     @property
     def short_id(self) -> str:
         return str(self.id)[:8]
@@ -216,7 +334,23 @@ class Department(models.Model, ModelPermissionHelper):
         return queryset.order_by("pk")
 
 
-class StudentGroup(models.Model, ModelPermissionHelper):
+class DepartmentShard(models.Model):
+    """
+    The shard storing a department, recorded in the default database when the department is saved.
+
+    The shard of a department doesn't change when shards are added, and the names of the departments are unique
+    across all the shards.
+    """
+
+    department_id: uuid.UUID = models.UUIDField(primary_key=True)
+    alias: str = models.CharField(max_length=64)
+    name: str = models.CharField(max_length=64, unique=True)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} department={self.department_id} alias={self.alias!r}>"
+
+
+class StudentGroup(ChangeTrackedModel, ModelPermissionHelper):
     """
     A student group.
 
@@ -227,6 +361,10 @@ class StudentGroup(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     name: str = models.CharField(max_length=128)
 
     department = models.ForeignKey(to=Department, on_delete=models.CASCADE, related_name="student_groups")
@@ -265,11 +403,11 @@ class StudentGroup(models.Model, ModelPermissionHelper):
             return True
 
         # if the user is managing a department
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
         # if the user is teaching a department
-        if user.teaching_departments.count() > 0:
+        if user.roles.teaching_departments:
             return True
 
     @classmethod
@@ -280,7 +418,9 @@ class StudentGroup(models.Model, ModelPermissionHelper):
 
         return {
             # the user can only interact with a related departments
-            "department": lambda data: (user.managing_departments | user.teaching_departments).all(),
+            "department": lambda data: Department.objects.filter(
+                pk__in=user.roles.managing_departments | user.roles.teaching_departments
+            ),
             # the owner must be a teacher or a manager of this department
             "owner": lambda data: (data["department"].managers | data["department"].teachers).all(),
         }
@@ -320,7 +460,7 @@ class StudentGroup(models.Model, ModelPermissionHelper):
         return queryset.order_by("pk")
 
 
-class TeachingUnit(models.Model, ModelPermissionHelper):
+class TeachingUnit(ChangeTrackedModel, ModelPermissionHelper):
     """
     A teaching unit.
 
@@ -331,6 +471,10 @@ class TeachingUnit(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     name: str = models.CharField(max_length=64)
     email: str = models.EmailField(null=True, blank=True)
 
@@ -376,7 +520,7 @@ class TeachingUnit(models.Model, ModelPermissionHelper):
             return True
 
         # if the user is managing a department
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
     @classmethod
@@ -387,7 +531,9 @@ class TeachingUnit(models.Model, ModelPermissionHelper):
 
         return {
             # a user can only interact with a related departments
-            "department": lambda data: (user.managing_departments | user.teaching_departments).all()
+            "department": lambda data: Department.objects.filter(
+                pk__in=user.roles.managing_departments | user.roles.teaching_departments
+            )
         }
 
     @classmethod
@@ -417,13 +563,13 @@ class TeachingUnit(models.Model, ModelPermissionHelper):
                 # if the user is the manager of the unit, allow read
                 Q(managers=user) |
                 # if the department is related to the user, allow read
-                Q(department=user.related_departments)
+                Q(department__in=user.related_departments)
             ).distinct()
 
         return queryset.order_by("pk")
 
 
-class StudentCard(models.Model, ModelPermissionHelper):
+class StudentCard(ChangeTrackedModel, ModelPermissionHelper):
     """
     A student card.
 
@@ -431,11 +577,21 @@ class StudentCard(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     uid: bytes = models.BinaryField(max_length=7)
 
     department: Department = models.ForeignKey(to=Department, on_delete=models.CASCADE, related_name="student_cards")
     owner: User = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="student_cards")
 
+    class Meta:
+        constraints = [
+            # a scanned card must designate a single student of the department, also used by the imports
+            models.UniqueConstraint(fields=["department", "uid"], name="unique_student_card_uid"),
+        ]
+
     def __repr__(self):
         return f"<{self.__class__.__name__} id={self.short_id} owner={self.owner.username!r}>"
 
@@ -460,7 +616,7 @@ class StudentCard(models.Model, ModelPermissionHelper):
         if user.is_superuser:
             return True
 
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
     @classmethod
@@ -471,7 +627,7 @@ class StudentCard(models.Model, ModelPermissionHelper):
 
         return {
             # a user can only interact with a related departments
-            "department": lambda field, data: field in user.managing_departments.all(),
+            "department": lambda data: Department.objects.filter(pk__in=user.roles.managing_departments),
         }
 
     @classmethod
@@ -503,7 +659,122 @@ class StudentCard(models.Model, ModelPermissionHelper):
         return queryset.order_by("pk")
 
 
-class TeachingSession(models.Model, ModelPermissionHelper):
+class ScannerDevice(ChangeTrackedModel, ModelPermissionHelper):
+    """
+    A scanner device.
+
+    This represents a NFC reader registering the attendances of a department, or only of the sessions of a teacher.
+    The device authenticate with its own token, whose hash only is stored.
+    """
+
+    id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    name: str = models.CharField(max_length=64)
+    token_hash: str = models.CharField(max_length=64, unique=True, editable=False)
+    is_active: bool = models.BooleanField(default=True)
+
+    department: Department = models.ForeignKey(to=Department, on_delete=models.CASCADE, related_name="scanner_devices")
+    teacher: Optional[User] = models.ForeignKey(
+        to=User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="scanner_devices"
+    )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.short_id} name={self.name!r} department={self.department}>"
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def short_id(self) -> str:
+        return str(self.id)[:8]
+
+    @staticmethod
+    def generate_token() -> str:
+        return secrets.token_urlsafe(32)
+
+    @staticmethod
+    def hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def reset_token(self) -> str:
+        """
+        Generate a new token for the device and return it.
+        Only its hash is saved, so it should be given to the device immediately.
+        """
+
+        token = self.generate_token()
+        self.token_hash = self.hash_token(token)
+        return token
+
+    # validations
+
+    def clean(self):
+        super().clean()
+
+        # teacher check
+        if self.teacher is not None and self.department not in self.teacher.teaching_departments.all():
+            raise ValidationError("The teacher is not related to the department.")
+
+    # permissions
+
+    @classmethod
+    def can_user_create(cls, user: "User") -> bool:
+        # if the requesting user is admin
+        if user.is_superuser:
+            return True
+
+        # if the user is managing a department
+        if user.roles.managing_departments:
+            return True
+
+    @classmethod
+    def user_fields_contraints(cls, user: "User") -> dict[str, Callable[[dict], QuerySet]]:
+        # if the user is admin, no contrains
+        if user.is_superuser:
+            return {}
+
+        return {
+            # a user can only register devices in the departments he manages
+            "department": lambda data: Department.objects.filter(pk__in=user.roles.managing_departments),
+        }
+
+    @classmethod
+    def all_editable_by_user(cls, user: "User") -> QuerySet:
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user is a manager of the department
+                Q(department__managers=user)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+    @classmethod
+    def all_visible_by_user(cls, user: "User"):
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user is a manager of the department
+                Q(department__managers=user) |
+                # if the device is registered to the user
+                Q(teacher=user)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+
+class TeachingSession(ChangeTrackedModel, ModelPermissionHelper):
     """
     A session of a teaching unit.
 
@@ -513,6 +784,10 @@ class TeachingSession(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     start: datetime = models.DateTimeField()
     duration: timedelta = models.DurationField()
     note: str = models.TextField(blank=True)
@@ -522,6 +797,17 @@ class TeachingSession(models.Model, ModelPermissionHelper):
     group = models.ForeignKey(to=StudentGroup, on_delete=models.CASCADE, related_name="teaching_sessions")
     teacher = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="teaching_sessions")
 
+    series = models.ForeignKey(
+        to="TeachingSessionSeries",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="sessions"
+    )
+
+    # the uid of the event of the imported timetable this session comes from, to update it on the next imports
+    source_uid: str = models.CharField(max_length=255, blank=True, default="", editable=False, db_index=True)
+
     def __repr__(self):
         return f"<{self.__class__.__name__} id={self.short_id} unit={self.unit.name!r} start={self.start}>"
 
@@ -539,13 +825,10 @@ class TeachingSession(models.Model, ModelPermissionHelper):
     @property
     def related_absences(self) -> QuerySet["Absence"]:
         """
-        Return the sessions that match the user absence
+        Return the absences that cover this session
         """
 
-        return Absence.objects.filter(
-            student__in=self.group.students.all(),
-            start__lte=self.start, end__gte=self.end
-        ).distinct()
+        return self.absences.all()
 
     # validations
 
@@ -560,6 +843,12 @@ class TeachingSession(models.Model, ModelPermissionHelper):
         if self.unit not in self.teacher.teaching_units.all():
             raise ValidationError("The teacher is not related to the unit.")
 
+        # timetable check
+        from Palto.Palto import conflicts
+        session_conflicts = conflicts.check([self])
+        if session_conflicts:
+            raise ValidationError([str(conflict) for conflict in session_conflicts])
+
     # permissions
 
     @classmethod
@@ -569,15 +858,15 @@ class TeachingSession(models.Model, ModelPermissionHelper):
             return True
 
         # if the user is managing a department
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
         # if the user is managing a unit
-        if user.managing_units.count() > 0:
+        if user.roles.managing_units:
             return True
 
         # if the user is teaching a unit
-        if user.teaching_units.count() > 0:
+        if user.roles.teaching_units:
             return True
 
     @classmethod
@@ -588,14 +877,14 @@ class TeachingSession(models.Model, ModelPermissionHelper):
 
         return {
             # the managers can only interact with their units
-            "unit": lambda data: (
+            "unit": lambda data: TeachingUnit.objects.filter(
                 # all the units the user is managing
-                user.managing_units |
+                Q(pk__in=user.roles.managing_units) |
                 # all the units the user is teaching
-                user.teaching_units |
+                Q(pk__in=user.roles.teaching_units) |
                 # all the units of the department the user is managing
-                TeachingUnit.objects.filter(pk__in=user.managing_departments.values("teaching_units"))
-            ).all()
+                Q(department_id__in=user.roles.managing_departments)
+            )
         }
 
     @classmethod
@@ -635,7 +924,135 @@ class TeachingSession(models.Model, ModelPermissionHelper):
         return queryset.order_by("pk")
 
 
-class Attendance(models.Model, ModelPermissionHelper):
+class TeachingSessionSeries(ChangeTrackedModel, ModelPermissionHelper):
+    """
+    A weekly recurrence of teaching sessions.
+
+    For example, the English course of a group every monday at 8:00 during the semester.
+    The sessions of the series are created and modified in bulk.
+    """
+
+    id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    weekday: int = models.PositiveSmallIntegerField(
+        choices=[(0, "Monday"), (1, "Tuesday"), (2, "Wednesday"), (3, "Thursday"), (4, "Friday"), (5, "Saturday"),
+                 (6, "Sunday")]
+    )
+    time: time = models.TimeField()
+    duration: timedelta = models.DurationField()
+    start_date: date = models.DateField()
+    end_date: date = models.DateField()
+    # the dates without session, for example the holidays
+    exclusions: list[str] = models.JSONField(default=list, blank=True)
+    note: str = models.TextField(blank=True)
+
+    unit = models.ForeignKey(to=TeachingUnit, on_delete=models.CASCADE, related_name="sessions_series")
+
+    group = models.ForeignKey(to=StudentGroup, on_delete=models.CASCADE, related_name="teaching_sessions_series")
+    teacher = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="teaching_sessions_series")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.short_id} unit={self.unit.name!r} weekday={self.weekday}>"
+
+    def __str__(self):
+        return f"{self.unit.name} ({self.get_weekday_display()} {self.time})"
+
+    @property
+    def short_id(self) -> str:
+        return str(self.id)[:8]
+
+    @property
+    def department(self) -> Department:
+        return self.unit.department
+
+    def occurrences(self, since: Optional[datetime] = None) -> list[datetime]:
+        """
+        Return the start of every session of the series, optionally only after a date.
+        """
+
+        exclusions = {date.fromisoformat(exclusion) for exclusion in self.exclusions}
+        current_timezone = timezone.get_current_timezone()
+
+        occurrences = []
+
+        day = self.start_date + timedelta(days=(self.weekday - self.start_date.weekday()) % 7)
+        while day <= self.end_date:
+            start = timezone.make_aware(datetime.combine(day, self.time), current_timezone)
+            if day not in exclusions and (since is None or start >= since):
+                occurrences.append(start)
+
+            day += timedelta(weeks=1)
+
+        return occurrences
+
+    # validations
+
+    def clean(self):
+        super().clean()
+
+        # dates check
+        if self.start_date > self.end_date:
+            raise ValidationError("The series end before its start.")
+
+        # department check
+        if self.unit.department != self.group.department:
+            raise ValidationError("The group is not related to the unit department.")
+
+        # teacher check
+        if self.unit not in self.teacher.teaching_units.all():
+            raise ValidationError("The teacher is not related to the unit.")
+
+    # permissions
+
+    @classmethod
+    def can_user_create(cls, user: "User") -> bool:
+        return TeachingSession.can_user_create(user)
+
+    @classmethod
+    def user_fields_contraints(cls, user: "User") -> dict[str, Callable[[Any, dict], bool]]:
+        return TeachingSession.user_fields_contraints(user)
+
+    @classmethod
+    def all_editable_by_user(cls, user: "User") -> QuerySet:
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user is the teacher, allow write
+                Q(teacher=user) |
+                # if the user is managing the unit, allow write
+                Q(unit__managers=user) |
+                # if the user is managing the department, allow write
+                Q(unit__department__managers=user)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+    @classmethod
+    def all_visible_by_user(cls, user: "User"):
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user is the teacher, allow read
+                Q(teacher=user) |
+                # if the user is managing the unit, allow read
+                Q(unit__managers=user) |
+                # if the user is managing the department, allow read
+                Q(unit__department__managers=user) |
+                # if the user is part of the group, allow read
+                Q(group__students=user)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+
+class Attendance(ChangeTrackedModel, ModelPermissionHelper):
     """
     A student attendance to a session.
 
@@ -643,6 +1060,10 @@ class Attendance(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     date: datetime = models.DateTimeField()
 
     student: User = models.ForeignKey(
@@ -687,15 +1108,15 @@ class Attendance(models.Model, ModelPermissionHelper):
             return True
 
         # if the user is managing a department
-        if user.managing_departments.count() > 0:
+        if user.roles.managing_departments:
             return True
 
         # if the user is managing a unit
-        if user.managing_units.count() > 0:
+        if user.roles.managing_units:
             return True
 
         # if the user is teaching a unit
-        if user.teaching_units.count() > 0:
+        if user.roles.teaching_units:
             return True
 
     @classmethod
@@ -705,18 +1126,14 @@ class Attendance(models.Model, ModelPermissionHelper):
             return {}
 
         return {
-            "session": lambda data: (
+            "session": lambda data: TeachingSession.objects.filter(
                 # the sessions that the user has taught
-                user.teaching_sessions |
+                Q(teacher=user) |
                 # a session of a unit the user is managing
-                TeachingSession.objects.filter(pk__in=user.managing_units.values("sessions")) |
+                Q(unit_id__in=user.roles.managing_units) |
                 # all the sessions in a department the user is managing
-                TeachingSession.objects.filter(
-                    pk__in=TeachingUnit.objects.filter(
-                        pk__in=user.managing_departments.values("teaching_units")
-                    ).values("sessions")
-                )
-            ).all()
+                Q(unit__department_id__in=user.roles.managing_departments)
+            )
         }
 
     @classmethod
@@ -757,7 +1174,7 @@ class Attendance(models.Model, ModelPermissionHelper):
         return queryset.order_by("pk")
 
 
-class Absence(models.Model, ModelPermissionHelper):
+class Absence(ChangeTrackedModel, ModelPermissionHelper):
     """
     A student justified absence to a session.
 
@@ -765,6 +1182,10 @@ class Absence(models.Model, ModelPermissionHelper):
     """
 
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
     message: str = models.TextField()
 
     department: Department = models.ForeignKey(to=Department, on_delete=models.CASCADE, related_name="absences")
@@ -772,6 +1193,15 @@ class Absence(models.Model, ModelPermissionHelper):
     start: datetime = models.DateTimeField()
     end: datetime = models.DateTimeField()
 
+    # the sessions covered by the absence, maintained by the signals (see absence_links)
+    sessions = models.ManyToManyField(
+        to=TeachingSession,
+        through="AbsenceSession",
+        blank=True,
+        editable=False,
+        related_name="absences"
+    )
+
     def __repr__(self):
         return (
             f"<{self.__class__.__name__} "
@@ -806,12 +1236,7 @@ class Absence(models.Model, ModelPermissionHelper):
         Return the sessions that match the user absence
         """
 
-        return TeachingSession.objects.filter(
-            # every session where the student participate
-            Q(group__students=self.student) &
-            # every session that start between the start and the end of our absence
-            Q(start__range=(self.start, self.end))
-        ).distinct()
+        return self.sessions.all()
 
     # permissions
 
@@ -822,7 +1247,7 @@ class Absence(models.Model, ModelPermissionHelper):
             return True
 
         # if the user is a student
-        if user.studying_departments.count() > 0:
+        if user.roles.studying_departments:
             return True
 
     @classmethod
@@ -833,7 +1258,7 @@ class Absence(models.Model, ModelPermissionHelper):
 
         return {
             # all the departments the user is studying in
-            "department": lambda data: user.studying_departments.all(),
+            "department": lambda data: Department.objects.filter(pk__in=user.roles.studying_departments),
         }
 
     @classmethod
@@ -858,33 +1283,65 @@ class Absence(models.Model, ModelPermissionHelper):
             queryset = cls.objects.filter(
                 # if the user is the student, allow read
                 Q(student=user) |
-                # if the user is related with the session, allow read
+                # if the user is related with a covered session, allow read
                 (
-                    # if the sessions start between the start and the end of the absence
-                    Q(department__teaching_units__sessions__start__range=(F("start"), F("end"))) &
-                    (
-                        # the user is a manager of the department
-                        Q(department__managers=user) |
-                        # the user is a manager of the unit
-                        Q(department__teaching_units__teachers=user) |
-                        # the user is the teacher of the session
-                        Q(department__teaching_units__sessions__teacher=user)
-                    )
+                    # the user is a manager of the department
+                    Q(sessions__isnull=False, department__managers=user) |
+                    # the user is a teacher of the unit
+                    Q(sessions__unit__teachers=user) |
+                    # the user is the teacher of the session
+                    Q(sessions__teacher=user)
                 )
             ).distinct()
 
         return queryset.order_by("pk")
 
 
-class AbsenceAttachment(models.Model, ModelPermissionHelper):
+class AbsenceSession(models.Model):
+    """
+    A session covered by an absence.
+
+    The session of a group of the student, in the department of the absence, starting during the absence.
+    The links are stored to avoid computing them again with range joins every time they are needed.
+    """
+
+    absence = models.ForeignKey(to=Absence, on_delete=models.CASCADE, related_name="session_links")
+    session = models.ForeignKey(to=TeachingSession, on_delete=models.CASCADE, related_name="absence_links")
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["absence", "session"], name="unique_absence_session"),
+        ]
+        indexes = [
+            # used to find the absences of a session
+            models.Index(fields=["session", "absence"]),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} absence={self.absence_id} session={self.session_id}>"
+
+
+class AbsenceAttachment(ChangeTrackedModel, ModelPermissionHelper):
     """
     An attachment to a student justified absence.
 
     The student can add additional files to justify his absence.
     """
 
+    UPLOAD_TO: str = "absence/attachment/"
+
     id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
-    content = models.FileField(upload_to="absence/attachment/")
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    content = models.FileField(upload_to=UPLOAD_TO, storage=attachment_storage)
+    content_hash: str = models.CharField(max_length=64, db_index=True, editable=False, blank=True)
+    # the files are named after their hash in the storage, the original name is used for the downloads
+    filename: str = models.CharField(max_length=255, editable=False, blank=True)
 
     absence = models.ForeignKey(to=Absence, on_delete=models.CASCADE, related_name="attachments")
 
@@ -895,6 +1352,36 @@ class AbsenceAttachment(models.Model, ModelPermissionHelper):
     def short_id(self) -> str:
         return str(self.id)[:8]
 
+    def save(self, *args, **kwargs):
+        # save the file first to know its hash
+        if self.content and not self.content._committed:
+            self.filename = self.filename or os.path.basename(self.content.name)
+            self.content.save(self.content.name, self.content.file, save=False)
+
+        self.content_hash = attachment_storage.hash_from_name(self.content.name) or ""
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bulk_create_from_files(cls, absence: Absence, files: Iterable[File]) -> list["AbsenceAttachment"]:
+        """
+        Save multiple files to the storage and create all their attachments in a single query.
+        The files already in the storage are not written again.
+        """
+
+        attachments = []
+
+        for file in files:
+            filename = os.path.basename(file.name)
+            name = attachment_storage.save(cls.UPLOAD_TO + filename, file)
+            attachments.append(cls(
+                absence=absence,
+                content=name,
+                content_hash=attachment_storage.hash_from_name(name),
+                filename=filename,
+            ))
+
+        return cls.objects.bulk_create(attachments)
+
     # permissions
 
     @classmethod
@@ -940,19 +1427,274 @@ class AbsenceAttachment(models.Model, ModelPermissionHelper):
             queryset = cls.objects.filter(
                 # if the user is the student, allow read
                 Q(absence__student=user) |
-                # if the user is related with the session, allow read
+                # if the user is related with a covered session, allow read
                 (
-                    # if the sessions start between the start and the end of the absence
-                    Q(absence__department__teaching_units__sessions__start__range=(F("start"), F("end"))) &
-                    (
-                        # the user is a manager of the department
-                        Q(absence__department__managers=user) |
-                        # the user is a manager of the unit
-                        Q(absence__department__teaching_units__teachers=user) |
-                        # the user is the teacher of the session
-                        Q(absence__department__teaching_units__sessions__teacher=user)
-                    )
+                    # the user is a manager of the department
+                    Q(absence__sessions__isnull=False, absence__department__managers=user) |
+                    # the user is a teacher of the unit
+                    Q(absence__sessions__unit__teachers=user) |
+                    # the user is the teacher of the session
+                    Q(absence__sessions__teacher=user)
                 )
             ).distinct()
 
         return queryset.order_by("pk")
+
+
+class Job(ChangeTrackedModel, ModelPermissionHelper):
+    """
+    A background job.
+
+    Heavy work (exports, imports, cleanups...) is enqueued as a job and executed later by the "run_palto_worker"
+    command instead of inside the request.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    id: uuid.UUID = models.UUIDField(default=uuid.uuid4, primary_key=True, editable=False, max_length=36)
+    # dotted path to the function executing the job
+    name: str = models.CharField(max_length=256)
+    arguments: dict = models.JSONField(default=dict, blank=True)
+
+    status: str = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    attempts: int = models.PositiveIntegerField(default=0)
+    max_attempts: int = models.PositiveIntegerField(default=3)
+    result: Any = models.JSONField(null=True, blank=True)
+    error: str = models.TextField(blank=True)
+
+    run_after: datetime = models.DateTimeField(default=timezone.now)
+    started_at: datetime = models.DateTimeField(null=True, blank=True)
+    finished_at: datetime = models.DateTimeField(null=True, blank=True)
+
+    owner = models.ForeignKey(to=User, on_delete=models.SET_NULL, null=True, blank=True, related_name="jobs")
+
+    class Meta:
+        indexes = [
+            # used by the workers to find the next jobs to execute
+            models.Index(fields=["status", "run_after"]),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.short_id} name={self.name!r} status={self.status!r}>"
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+    @property
+    def short_id(self) -> str:
+        return str(self.id)[:8]
+
+    # permissions
+
+    @classmethod
+    def can_user_create(cls, user: "User") -> bool:
+        # the jobs are only created by the server
+        return False
+
+    @classmethod
+    def all_editable_by_user(cls, user: "User") -> QuerySet:
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.none()
+
+        return queryset.order_by("pk")
+
+    @classmethod
+    def all_visible_by_user(cls, user: "User"):
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user started the job, allow read
+                Q(owner=user)
+            )
+
+        return queryset.order_by("pk")
+
+
+class ArchivedTeachingSession(ChangeTrackedModel, ModelPermissionHelper):
+    """
+    A session of a completed academic year, moved out of the sessions table by the archival.
+
+    The unit and the group are only kept by their id and name, since they can be removed after the end of the year.
+    """
+
+    # the same id as the archived session
+    id: uuid.UUID = models.UUIDField(primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    academic_year: int = models.PositiveSmallIntegerField()
+    start: datetime = models.DateTimeField()
+    duration: timedelta = models.DurationField()
+    note: str = models.TextField(blank=True)
+
+    department = models.ForeignKey(to=Department, on_delete=models.CASCADE, related_name="archived_sessions")
+    unit_id: uuid.UUID = models.UUIDField()
+    unit_name: str = models.CharField(max_length=64)
+    group_id: uuid.UUID = models.UUIDField()
+    group_name: str = models.CharField(max_length=128)
+    teacher = models.ForeignKey(
+        to=User, on_delete=models.SET_NULL, null=True, blank=True, related_name="archived_teaching_sessions"
+    )
+
+    archived_at: datetime = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # used to list and export the archives of a department
+            models.Index(fields=["department", "academic_year", "start"]),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.short_id} unit={self.unit_name!r} start={self.start}>"
+
+    def __str__(self):
+        return f"{self.unit_name} {self.start}"
+
+    @property
+    def short_id(self) -> str:
+        return str(self.id)[:8]
+
+    # permissions
+
+    @classmethod
+    def can_user_create(cls, user: "User") -> bool:
+        # the archives are only created by the archival
+        return False
+
+    @classmethod
+    def all_editable_by_user(cls, user: "User") -> QuerySet:
+        # the archives are read-only
+        return cls.objects.none()
+
+    @classmethod
+    def all_visible_by_user(cls, user: "User"):
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user was the teacher, allow read
+                Q(teacher=user) |
+                # if the user is managing the unit, allow read
+                Q(unit_id__in=user.roles.managing_units) |
+                # if the user is managing the department, allow read
+                Q(department_id__in=user.roles.managing_departments) |
+                # if the user attended the session, allow read
+                Q(attendances__student=user)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+
+class ArchivedAttendance(ChangeTrackedModel, ModelPermissionHelper):
+    """
+    A student attendance to an archived session.
+    """
+
+    # the same id as the archived attendance
+    id: uuid.UUID = models.UUIDField(primary_key=True, editable=False, max_length=36)
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    date: datetime = models.DateTimeField()
+
+    student = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="archived_attendances")
+    session = models.ForeignKey(to=ArchivedTeachingSession, on_delete=models.CASCADE, related_name="attendances")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} id={self.short_id} student={self.student_id} session={self.session_id}>"
+
+    @property
+    def short_id(self) -> str:
+        return str(self.id)[:8]
+
+    # permissions
+
+    @classmethod
+    def can_user_create(cls, user: "User") -> bool:
+        # the archives are only created by the archival
+        return False
+
+    @classmethod
+    def all_editable_by_user(cls, user: "User") -> QuerySet:
+        # the archives are read-only
+        return cls.objects.none()
+
+    @classmethod
+    def all_visible_by_user(cls, user: "User"):
+        if user.is_superuser:
+            # if the requesting user is admin
+            queryset = cls.objects.all()
+        else:
+            queryset = cls.objects.filter(
+                # if the user is the student, allow read
+                Q(student=user) |
+                # if the user was the teacher, allow read
+                Q(session__teacher=user) |
+                # if the user is managing the unit, allow read
+                Q(session__unit_id__in=user.roles.managing_units) |
+                # if the user is managing the department, allow read
+                Q(session__department_id__in=user.roles.managing_departments)
+            ).distinct()
+
+        return queryset.order_by("pk")
+
+
+class Tombstone(models.Model):
+    """
+    The trace of a deleted object, to tell the clients synchronising the changes of its model to remove it.
+
+    The tombstones are kept in the database of the deleted object, with its department to know who could see it.
+    """
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    # the label of the model of the deleted object
+    model: str = models.CharField(max_length=64)
+    object_id: uuid.UUID = models.UUIDField()
+    department_id: Optional[uuid.UUID] = models.UUIDField(null=True, blank=True)
+    deleted_at: datetime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # used to list the deletions of a model since a moment
+            models.Index(fields=["model", "deleted_at", "object_id"]),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} model={self.model!r} object={self.object_id} at={self.deleted_at}>"
+
+
+class FormerMember(models.Model):
+    """
+    A member of a deleted department, the only users other than the superusers given the tombstones of its objects.
+
+    The former members are kept in the database of the deleted department, as long as its tombstones.
+    """
+
+    # the objects are created in the shard of their department
+    objects = sharding.ShardedQuerySet.as_manager()
+
+    department_id: uuid.UUID = models.UUIDField()
+    user_id: uuid.UUID = models.UUIDField()
+    deleted_at: datetime = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "department_id"], name="unique_former_member"),
+        ]
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} department={self.department_id} user={self.user_id}>"
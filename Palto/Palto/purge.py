@@ -0,0 +1,284 @@
+"""
+Purge for the Palto project.
+
+Deleting a department or many sessions with the ORM collects all their attendances, absences and attachments in memory
+to cascade the deletion, and keeps the tables locked for the whole operation. The purge instead deletes the rows with
+direct filtered queries, the dependent rows first, by batches in their own transaction : the scans can continue
+between the batches, and an interrupted purge is resumed by running it again.
+
+The direct deletions skip the signals, so the caches are invalidated, the attachments files removed and the tombstones
+of the changes feeds kept here.
+"""
+
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import QuerySet
+
+from Palto.Palto import changes, fragments, ical, models, sharding
+from Palto.Palto.api.v1 import authentication
+from Palto.Palto.storage import attachment_storage
+
+
+def _delete_batches(
+        label: str,
+        queryset: QuerySet,
+        batch_size: int,
+        using: str,
+        before_delete: Optional[Callable[[list], None]] = None,
+) -> Iterator[tuple[str, int]]:
+    """
+    Delete the rows of the queryset by batches, each in its own transaction.
+    The before_delete function receives the primary keys of every batch, to delete their dependent rows first.
+    Yield the label and the number of deleted rows of every batch.
+    """
+
+    while True:
+        with transaction.atomic(using=using):
+            pks = list(queryset.using(using).order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                return
+
+            if before_delete is not None:
+                before_delete(pks)
+
+            # a direct deletion, without collecting the related objects in memory
+            batch = queryset.model._base_manager.using(using).filter(pk__in=pks)
+            changes.bury(batch, using)
+            batch._raw_delete(using)
+
+        yield label, len(pks)
+
+
+def _remove_unused_files(names: set[str]) -> None:
+    # the storage is content addressed, the same file can be used by other attachments, in any shard
+    for name in names:
+        if not any(queryset.exists() for queryset in sharding.each(
+            models.AbsenceAttachment.objects.filter(content=name)
+        )):
+            attachment_storage.delete(name)
+
+
+# dependent rows
+
+
+def _sessions_dependents(using: str) -> Callable[[list], None]:
+    def delete(pks: list) -> None:
+        models.AbsenceSession.objects.using(using).filter(session_id__in=pks)._raw_delete(using)
+        attendances = models.Attendance.objects.using(using).filter(session_id__in=pks)
+        changes.bury(attendances, using)
+        attendances._raw_delete(using)
+
+        # the calendars of the teachers and the students of the sessions change
+        groups, teachers = set(), set()
+        for group_id, teacher_id in models.TeachingSession.objects.using(using).filter(
+            pk__in=pks
+        ).values_list("group_id", "teacher_id"):
+            groups.add(group_id)
+            teachers.add(teacher_id)
+
+        transaction.on_commit(lambda: ical.invalidate_sessions(groups, teachers), using=using)
+
+    return delete
+
+
+def _absences_dependents(using: str) -> Callable[[list], None]:
+    def delete(pks: list) -> None:
+        attachments = models.AbsenceAttachment.objects.using(using).filter(absence_id__in=pks)
+        names = set(attachments.values_list("content", flat=True))
+        changes.bury(attachments, using)
+        attachments._raw_delete(using)
+        models.AbsenceSession.objects.using(using).filter(absence_id__in=pks)._raw_delete(using)
+
+        # the files are only removed once their rows are, a failed batch keeps them
+        transaction.on_commit(lambda: _remove_unused_files(names), using=using)
+
+    return delete
+
+
+def _archived_sessions_dependents(using: str) -> Callable[[list], None]:
+    def delete(pks: list) -> None:
+        attendances = models.ArchivedAttendance.objects.using(using).filter(session_id__in=pks)
+        changes.bury(attendances, using)
+        attendances._raw_delete(using)
+
+    return delete
+
+
+def _devices_dependents(using: str) -> Callable[[list], None]:
+    def delete(pks: list) -> None:
+        # the authentication of the readers is cached
+        transaction.on_commit(lambda: [authentication.forget_device(pk) for pk in pks], using=using)
+
+    return delete
+
+
+def _members_dependents(using: str, through, owner: str, kind: Optional[str] = None) -> Callable[[list], None]:
+    def delete(pks: list) -> None:
+        rows = list(through.objects.using(using).filter(pk__in=pks).values_list("user_id", f"{owner}_id"))
+        if owner == "department":
+            # the members of the deleted department are given its tombstones
+            changes.remember_members(rows, using)
+
+        def invalidate():
+            # the roles of the members change, and the pages listing them
+            models.User.bump_roles_version({user_id for user_id, _ in rows})
+            if kind is not None:
+                fragments.invalidate(kind, {owner_id for _, owner_id in rows})
+
+        transaction.on_commit(invalidate, using=using)
+
+    return delete
+
+
+# purges
+
+
+def purge_before(
+        before: datetime,
+        department_id=None,
+        batch_size: int = 500,
+        using: str = DEFAULT_DB_ALIAS,
+) -> Iterator[tuple[str, int]]:
+    """
+    Delete the sessions, the archived sessions and the absences older than a moment, with their dependent rows,
+    optionally only in a department. The expired tombstones and former members are deleted too.
+    Yield the kind and the number of deleted rows of every batch.
+    """
+
+    sessions = models.TeachingSession.objects.filter(start__lt=before)
+    archived_sessions = models.ArchivedTeachingSession.objects.filter(start__lt=before)
+    absences = models.Absence.objects.filter(end__lt=before)
+    # the tombstones are kept for the clients synchronising rarely, whatever the moment
+    tombstones = models.Tombstone.objects.filter(deleted_at__lt=min(before, changes.prune_before()))
+    former_members = models.FormerMember.objects.filter(deleted_at__lt=min(before, changes.prune_before()))
+
+    if department_id is not None:
+        sessions = sessions.filter(unit__department_id=department_id)
+        archived_sessions = archived_sessions.filter(department_id=department_id)
+        absences = absences.filter(department_id=department_id)
+        tombstones = tombstones.filter(department_id=department_id)
+        former_members = former_members.filter(department_id=department_id)
+
+    yield from _delete_batches("sessions", sessions, batch_size, using, _sessions_dependents(using))
+    yield from _delete_batches(
+        "archived sessions", archived_sessions, batch_size, using, _archived_sessions_dependents(using)
+    )
+    yield from _delete_batches("absences", absences, batch_size, using, _absences_dependents(using))
+    yield from _delete_batches("tombstones", tombstones, batch_size, using)
+    yield from _delete_batches("former members", former_members, batch_size, using)
+
+
+def purge_department(department_id, batch_size: int = 500, using: str = DEFAULT_DB_ALIAS) -> Iterator[tuple[str, int]]:
+    """
+    Delete a department and all its rows, the rows depending on the others first.
+    The department itself is deleted last, so an interrupted purge can be resumed with the same department.
+    Yield the kind and the number of deleted rows of every batch.
+    """
+
+    department = {"department_id": department_id}
+    unit = {"unit__department_id": department_id}
+
+    yield from _delete_batches(
+        "sessions", models.TeachingSession.objects.filter(**unit), batch_size, using, _sessions_dependents(using)
+    )
+    yield from _delete_batches(
+        "sessions series", models.TeachingSessionSeries.objects.filter(**unit), batch_size, using
+    )
+    yield from _delete_batches(
+        "archived sessions", models.ArchivedTeachingSession.objects.filter(**department), batch_size, using,
+        _archived_sessions_dependents(using),
+    )
+    yield from _delete_batches(
+        "absences", models.Absence.objects.filter(**department), batch_size, using, _absences_dependents(using)
+    )
+    yield from _delete_batches("student cards", models.StudentCard.objects.filter(**department), batch_size, using)
+    yield from _delete_batches(
+        "scanner devices", models.ScannerDevice.objects.filter(**department), batch_size, using,
+        _devices_dependents(using),
+    )
+
+    # the members of the units and the groups
+    yield from _delete_batches(
+        "units groups",
+        models.TeachingUnit.student_groups.through.objects.filter(teachingunit__department_id=department_id),
+        batch_size, using,
+    )
+    for through in (models.TeachingUnit.managers.through, models.TeachingUnit.teachers.through):
+        yield from _delete_batches(
+            "units members", through.objects.filter(teachingunit__department_id=department_id), batch_size, using,
+            _members_dependents(using, through, "teachingunit", "unit"),
+        )
+    yield from _delete_batches(
+        "groups members",
+        models.StudentGroup.students.through.objects.filter(studentgroup__department_id=department_id),
+        batch_size, using,
+    )
+    yield from _delete_batches("units", models.TeachingUnit.objects.filter(**department), batch_size, using)
+    yield from _delete_batches("groups", models.StudentGroup.objects.filter(**department), batch_size, using)
+
+    # the members of the department, then the department itself
+    yield from _delete_batches(
+        "department members", models.Department.students.through.objects.filter(**department), batch_size, using,
+        _members_dependents(using, models.Department.students.through, "department"),
+    )
+    for through in (models.Department.managers.through, models.Department.teachers.through):
+        yield from _delete_batches(
+            "department members", through.objects.filter(**department), batch_size, using,
+            _members_dependents(using, through, "department", "department"),
+        )
+    yield from _delete_batches("departments", models.Department.objects.filter(pk=department_id), batch_size, using)
+
+
+def purge(
+        department_id=None,
+        before: Optional[datetime] = None,
+        batch_size: int = 500,
+) -> Iterator[tuple[str, str, int]]:
+    """
+    Delete a department, or only the rows older than a moment if given, in every concerned database.
+    Yield the database, the kind and the number of deleted rows of every batch.
+    """
+
+    if department_id is None and before is None:
+        raise ValueError("A department or a moment is required to purge.")
+
+    if department_id is not None and sharding.is_enabled():
+        aliases = [sharding.shard_for_department(department_id)]
+    else:
+        aliases = settings.DATABASE_SHARDS or [DEFAULT_DB_ALIAS]
+
+    for alias in aliases:
+        if before is not None:
+            batches = purge_before(before, department_id, batch_size, alias)
+        else:
+            batches = purge_department(department_id, batch_size, alias)
+
+        # the invalidations of the caches query the same database
+        with sharding.shard_scope(alias if sharding.is_enabled() else None):
+            for kind, count in batches:
+                yield alias, kind, count
+
+    # the department is deleted without its signals
+    if department_id is not None and before is None and sharding.is_enabled():
+        sharding.forget_department(department_id)
+
+
+def run(department_id: Optional[str] = None, before: Optional[str] = None, batch_size: Optional[int] = None) -> dict:
+    """
+    Job purging a department, or only the rows older than a moment if given.
+    Return the number of deleted rows by kind.
+    """
+
+    counts: dict[str, int] = {}
+
+    for _, kind, count in purge(
+        department_id,
+        datetime.fromisoformat(before) if before is not None else None,
+        batch_size or settings.PURGE_BATCH_SIZE,
+    ):
+        counts[kind] = counts.get(kind, 0) + count
+
+    return counts
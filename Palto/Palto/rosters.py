@@ -0,0 +1,180 @@
+"""
+Readers rosters for the Palto project.
+
+A roster is a bundle given to a scanner device with its upcoming sessions and the cards of their students, so the
+reader can validate the scans by itself and answer the students immediately, then send the attendances later.
+
+Every roster has a version, the hash of its content : the readers only download it again when it changed, and can
+ask only for its differences with the version they already have.
+"""
+
+import base64
+import hashlib
+import json
+import math
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.utils import timezone
+
+from Palto.Palto import conflicts, models
+
+
+# the kinds of card sets
+EXACT: str = "exact"
+BLOOM: str = "bloom"
+
+
+def bloom_filter(values: Iterable[bytes], error_rate: float) -> dict:
+    """
+    Return a Bloom filter of some values, with the given false positive rate.
+
+    The filter has "size" bits, given in base64 with the first bit as the lowest bit of the first byte. A value is in
+    the filter if the bits (h1 + i * h2) % size are set for i from 0 to "hashes" - 1, where h1 and h2 are the first
+    and the next 8 bytes of the SHA-256 hash of the value, read as big endian integers.
+    """
+
+    values = list(values)
+    count = max(len(values), 1)
+
+    size = max(math.ceil(-count * math.log(error_rate) / math.log(2) ** 2), 8)
+    hashes = max(round(size / count * math.log(2)), 1)
+    bits = bytearray(math.ceil(size / 8))
+
+    for value in values:
+        digest = hashlib.sha256(value).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:16], "big")
+        for index in range(hashes):
+            position = (first + index * second) % size
+            bits[position // 8] |= 1 << (position % 8)
+
+    return {"size": size, "hashes": hashes, "bits": base64.b64encode(bits).decode()}
+
+
+def bloom_contains(bloom: dict, value: bytes) -> bool:
+    """
+    Return whether a value is in a Bloom filter, as the readers check it.
+    """
+
+    bits = base64.b64decode(bloom["bits"])
+    digest = hashlib.sha256(value).digest()
+    first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:16], "big")
+
+    return all(
+        bits[position // 8] & (1 << (position % 8))
+        for position in ((first + index * second) % bloom["size"] for index in range(bloom["hashes"]))
+    )
+
+
+def build(device, kind: str = EXACT, horizon: Optional[timedelta] = None) -> dict:
+    """
+    Return the content of the roster of a device : its sessions not finished yet and starting within the horizon,
+    the students of their groups and the cards of these students, in three queries.
+
+    With the exact kind, the cards are given with their owner. With the Bloom kind, every group has a Bloom filter of
+    the cards of its students, and the owners are only known by the server once the scans are sent.
+    """
+
+    now = timezone.now()
+    horizon = horizon if horizon is not None else timedelta(hours=settings.ROSTER_HORIZON_HOURS)
+
+    # the sessions of the department, or only of the teacher of the device
+    sessions = models.TeachingSession.objects.filter(unit__department_id=device.department_id)
+    if device.teacher_id is not None:
+        sessions = sessions.filter(teacher_id=device.teacher_id)
+    sessions = list(sessions.annotate(
+        annotated_end=ExpressionWrapper(F("start") + F("duration"), output_field=DateTimeField())
+    ).filter(
+        annotated_end__gt=now,
+        start__lt=now + horizon,
+    ).order_by("start", "pk").values_list("id", "start", "duration", "group_id"))
+
+    memberships = conflicts.load_memberships({group_id for _, _, _, group_id in sessions})
+    students = set().union(*memberships.values())
+
+    cards = list(models.StudentCard.objects.filter(
+        department_id=device.department_id, owner_id__in=students
+    ).values_list("uid", "owner_id"))
+
+    content = {
+        "kind": kind,
+        "sessions": {
+            str(session_id): {
+                "start": start.isoformat(),
+                "end": (start + duration).isoformat(),
+                "group": str(group_id),
+            }
+            for session_id, start, duration, group_id in sessions
+        },
+    }
+
+    if kind == BLOOM:
+        cards_by_student: dict = {}
+        for uid, owner_id in cards:
+            cards_by_student.setdefault(owner_id, []).append(bytes(uid))
+
+        content["groups"] = {
+            str(group_id): bloom_filter(
+                (uid for student_id in sorted(group_students) for uid in cards_by_student.get(student_id, ())),
+                settings.ROSTER_BLOOM_ERROR_RATE,
+            )
+            for group_id, group_students in memberships.items()
+        }
+    else:
+        content["groups"] = {
+            str(group_id): sorted(str(student_id) for student_id in group_students)
+            for group_id, group_students in memberships.items()
+        }
+        content["cards"] = {bytes(uid).hex(): str(owner_id) for uid, owner_id in cards}
+
+    return content
+
+
+def version_of(content: dict) -> str:
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _cache_key(device_id, version: str) -> str:
+    return f"palto:roster:{device_id}:{version}"
+
+
+def get(device, kind: str = EXACT, since: Optional[str] = None) -> tuple[str, dict]:
+    """
+    Return the version of the roster of a device and the roster to send : the whole roster, or only its
+    differences with a previous version if this version is still known.
+    """
+
+    content = build(device, kind)
+    version = version_of(content)
+
+    # remember the sent versions, to compute the next differences
+    cache.set(_cache_key(device.id, version), content, settings.ROSTER_CACHE_TIMEOUT)
+
+    previous = cache.get(_cache_key(device.id, since)) if since and since != version else None
+    if previous is None or previous["kind"] != kind:
+        return version, {"version": version, **content}
+
+    return version, {"version": version, "since": since, **diff(previous, content)}
+
+
+def diff(previous: dict, content: dict) -> dict:
+    """
+    Return the entries of every section of a roster added or changed since a previous version, and the removed ones.
+    """
+
+    changed, removed = {}, {}
+
+    for section, entries in content.items():
+        if not isinstance(entries, dict):
+            continue
+
+        previous_entries = previous.get(section, {})
+        changed[section] = {
+            key: value for key, value in entries.items() if previous_entries.get(key) != value
+        }
+        removed[section] = sorted(key for key in previous_entries if key not in entries)
+
+    return {"kind": content["kind"], "changed": changed, "removed": removed}
@@ -0,0 +1,219 @@
+"""
+Database routers for the Palto project.
+
+A router choose which database should be used for a query. Here, the reading traffic that can tolerate a small
+replication lag is sent to the read replicas, while everything else stay on the primary database. With the sharding,
+the rows of every department are sent to the shard of this department.
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from Palto.Palto import sharding
+
+
+# models that are part of the scan path and should always be read from the primary database
+PRIMARY_ONLY_MODELS: set[str] = {
+    "Palto.attendance",
+    "Palto.studentcard",
+}
+
+
+class DatabaseRouting:
+    """
+    The routing state of the current request or code path.
+    """
+
+    def __init__(self, replica_allowed: bool = False):
+        # can the reading queries be sent to a replica
+        self.replica_allowed = replica_allowed
+        # did a query write into the primary database. If so, the rest of the request is pinned to the primary.
+        self.has_written = False
+
+    @property
+    def use_replica(self) -> bool:
+        return self.replica_allowed and not self.has_written
+
+
+_routing: ContextVar[Optional[DatabaseRouting]] = ContextVar("palto_database_routing", default=None)
+
+
+def get_routing() -> Optional[DatabaseRouting]:
+    """
+    Return the routing state of the current request, if any.
+    """
+
+    return _routing.get()
+
+
+@contextmanager
+def routing_scope(replica_allowed: bool = False):
+    """
+    Start a new routing state, for example for a whole request.
+    """
+
+    routing = DatabaseRouting(replica_allowed)
+    token = _routing.set(routing)
+
+    try:
+        yield routing
+    finally:
+        _routing.reset(token)
+
+
+@contextmanager
+def _override_replica_allowed(replica_allowed: bool):
+    routing = _routing.get()
+
+    # if we are outside a request, create a temporary routing state
+    if routing is None:
+        with routing_scope(replica_allowed) as routing:
+            yield routing
+        return
+
+    # otherwise, temporarily modify the current one to keep the written state in common
+    previous_replica_allowed = routing.replica_allowed
+    routing.replica_allowed = replica_allowed
+
+    try:
+        yield routing
+    finally:
+        routing.replica_allowed = previous_replica_allowed
+
+
+def _pin_primary() -> None:
+    # pin the rest of the request to the primary to read our own writes
+    routing = _routing.get()
+    if routing is not None:
+        routing.has_written = True
+
+
+def use_replica():
+    """
+    Send the reading queries to the replicas, for example for the reports and exports.
+    Can be used as a context manager or as a decorator.
+    """
+
+    return _override_replica_allowed(True)
+
+
+def use_primary():
+    """
+    Send the reading queries to the primary database, for example for the scan path.
+    Can be used as a context manager or as a decorator.
+    """
+
+    return _override_replica_allowed(False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send the reading queries to a random replica when allowed by the current routing state,
+    and all the writing queries to the primary database.
+    """
+
+    @staticmethod
+    def db_for_read(model, **hints) -> Optional[str]:
+        replicas: list[str] = settings.DATABASE_REPLICAS
+        if not replicas:
+            return None
+
+        # the scan path always read from the primary database
+        if model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+
+        routing = _routing.get()
+        if routing is None or not routing.use_replica:
+            return DEFAULT_DB_ALIAS
+
+        return random.choice(replicas)
+
+    @staticmethod
+    def db_for_write(model, **hints) -> Optional[str]:
+        _pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints) -> Optional[bool]:
+        # the replicas contain the same data as the primary
+        return True
+
+    @staticmethod
+    def allow_migrate(db: str, app_label: str, model_name: str = None, **hints) -> Optional[bool]:
+        # the replicas receive the schema from the primary
+        if db in settings.DATABASE_REPLICAS:
+            return False
+
+        return None
+
+
+class DepartmentShardRouter:
+    """
+    Send the queries of the partitioned models to the shard of their department.
+
+    The shard is found from the object itself when available, otherwise from the scope of the request.
+    The users are read from the shard of the request, where they are copied, and written in the default database.
+    """
+
+    @staticmethod
+    def db_for_read(model, **hints) -> Optional[str]:
+        if not sharding.is_enabled():
+            return None
+
+        if sharding.is_partitioned(model):
+            instance = hints.get("instance")
+            if instance is not None and sharding.is_partitioned(type(instance)):
+                alias = sharding.shard_of(instance)
+                if alias is not None:
+                    return alias
+
+            return sharding.get_shard()
+
+        if sharding.is_mirrored(model):
+            return sharding.get_shard()
+
+        return None
+
+    @staticmethod
+    def db_for_write(model, **hints) -> Optional[str]:
+        if not sharding.is_enabled():
+            return None
+
+        if sharding.is_partitioned(model):
+            # like any other write, the next reads of the client are made on the primary
+            _pin_primary()
+
+            instance = hints.get("instance")
+            if instance is not None and sharding.is_partitioned(type(instance)):
+                alias = sharding.shard_of(instance)
+                if alias is not None:
+                    return alias
+
+            return sharding.get_shard()
+
+        # the mirrored models are written in the default database, then copied into the shards
+        return None
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints) -> Optional[bool]:
+        if not sharding.is_enabled():
+            return None
+
+        # the rows of different departments can't be related, but the users exist in every shard.
+        # an object without a known shard yet, like a new object, takes the shard of the other one.
+        # the model is read from the options, the objects can be lazy like the user of a request
+        if sharding.is_partitioned(obj1._meta.model) and sharding.is_partitioned(obj2._meta.model):
+            alias1, alias2 = sharding.shard_of(obj1), sharding.shard_of(obj2)
+            return alias1 is None or alias2 is None or alias1 == alias2
+
+        return True
+
+    @staticmethod
+    def allow_migrate(db: str, app_label: str, model_name: str = None, **hints) -> Optional[bool]:
+        # every shard has the whole schema, the copies of the users need their tables
+        return None
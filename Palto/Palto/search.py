@@ -0,0 +1,96 @@
+"""
+Users search for the Palto project.
+
+Every word of the username, the names and the email of the users is stored normalized in an indexed table. A search
+reads, for every word of the query, the range of the index starting with this word, instead of scanning the names of
+all the users : the autocompletion stays fast with many users, on every database.
+"""
+
+import re
+import unicodedata
+from typing import Iterable
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import QuerySet
+
+from Palto.Palto import models
+
+
+# the fields of the users that can be searched
+FIELDS: tuple[str, ...] = ("username", "first_name", "last_name", "email")
+
+# greater than any character, to read the range of the tokens starting with a prefix
+_LAST_CHARACTER: str = chr(0x10FFFF)
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """
+    Return a text without its case and its accents.
+    """
+
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(character for character in text if not unicodedata.combining(character)).casefold()
+
+
+def tokens_of(*values: str) -> set[str]:
+    """
+    Return the tokens of some values : their normalized words.
+    """
+
+    # the words longer than the column can only be found by their start
+    return {word[:64] for value in values for word in _WORD_PATTERN.findall(normalize(value or ""))}
+
+
+def index_users(users: Iterable[models.User]) -> None:
+    """
+    Replace the tokens of some users, in the default database and its copies in the shards.
+    """
+
+    users = list(users)
+    if not users:
+        return
+
+    tokens = [
+        (user.pk, token)
+        for user in users
+        for token in tokens_of(*(getattr(user, field) for field in FIELDS))
+    ]
+
+    for alias in [DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS]:
+        with transaction.atomic(using=alias):
+            models.UserSearchToken.objects.using(alias).filter(user__in=[user.pk for user in users]).delete()
+            models.UserSearchToken.objects.using(alias).bulk_create([
+                models.UserSearchToken(user_id=user_id, token=token) for user_id, token in tokens
+            ])
+
+
+def filter_users(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Return the users of a queryset having, for every word of the query, a token starting with this word.
+    """
+
+    words = _WORD_PATTERN.findall(normalize(query))
+    if not words:
+        return queryset.none()
+
+    for word in words[:settings.USER_SEARCH_MAX_WORDS]:
+        word = word[:64]
+        queryset = queryset.filter(pk__in=models.UserSearchToken.objects.filter(
+            token__gte=word, token__lt=word + _LAST_CHARACTER
+        ).values("user_id"))
+
+    return queryset
+
+
+def search_users(user: models.User, query: str, limit: int) -> list[models.User]:
+    """
+    Return the first users visible by a user matching a query, sorted by their names.
+    """
+
+    return list(
+        filter_users(models.User.all_visible_by_user(user), query)
+        .order_by("last_name", "first_name", "pk")[:limit]
+    )
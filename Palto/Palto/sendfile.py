@@ -0,0 +1,121 @@
+"""
+Sendfile for the Palto project.
+
+Send the files of the storage to the user once the permissions have been checked. The bytes transfer is delegated
+to the front web server when possible, otherwise the file is streamed by Python with the support of Range requests.
+"""
+
+import mimetypes
+import os
+import re
+from typing import Optional
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpResponse, FileResponse
+
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class InvalidRange(Exception):
+    """
+    The requested range can't be satisfied.
+    """
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Return the first and last bytes (included) requested by a Range header, or None if the header is not supported.
+    Only a single range is supported, the others should be answered with the full content.
+    """
+
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # suffix range, the last bytes of the file
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first > last or first >= size:
+        raise InvalidRange()
+
+    return first, last
+
+
+class _FileRange:
+    """
+    A read-only file limited to a range of bytes.
+    """
+
+    def __init__(self, file, first: int, last: int):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = last - first + 1
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def sendfile(request: WSGIRequest, storage: Storage, name: str, filename: Optional[str] = None) -> HttpResponse:
+    """
+    Return a response sending a file of the storage, using the backend defined in the "SENDFILE_BACKEND" setting :
+    - "nginx" : the file is sent by nginx with the X-Accel-Redirect header, under the "SENDFILE_URL" internal location.
+    - "apache" : the file is sent by apache (or lighttpd) with the X-Sendfile header.
+    - "python" : the file is streamed by the worker.
+    """
+
+    filename = filename if filename is not None else os.path.basename(name)
+    content_type, _ = mimetypes.guess_type(filename)
+
+    backend = settings.SENDFILE_BACKEND
+
+    if backend in ("nginx", "apache"):
+        response = HttpResponse(content_type=content_type or "application/octet-stream")
+
+        if backend == "nginx":
+            response["X-Accel-Redirect"] = quote(settings.SENDFILE_URL + name)
+        else:
+            response["X-Sendfile"] = storage.path(name)
+
+        response["Content-Disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+        return response
+
+    size = storage.size(name)
+
+    try:
+        byte_range = parse_range(request.headers.get("Range", ""), size)
+    except InvalidRange:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    file = storage.open(name, "rb")
+
+    if byte_range is None:
+        response = FileResponse(file, filename=filename, content_type=content_type)
+    else:
+        first, last = byte_range
+        response = FileResponse(_FileRange(file, first, last), status=206, filename=filename, content_type=content_type)
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        response["Content-Length"] = str(last - first + 1)
+
+    response["Accept-Ranges"] = "bytes"
+    return response
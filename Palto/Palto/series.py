@@ -0,0 +1,148 @@
+"""
+Sessions series for the Palto project.
+
+Create and modify all the sessions of a series in bulk, validating them at once instead of one by one.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from Palto.Palto import models, conflicts, ical, absence_links
+
+
+def _build_session(series: models.TeachingSessionSeries, start: datetime) -> models.TeachingSession:
+    return models.TeachingSession(
+        series=series,
+        start=start,
+        duration=series.duration,
+        note=series.note,
+        unit=series.unit,
+        group=series.group,
+        teacher=series.teacher,
+    )
+
+
+def _check_conflicts(sessions: list[models.TeachingSession]) -> None:
+    sessions_conflicts = conflicts.check(sessions)
+    if sessions_conflicts:
+        raise ValidationError([str(conflict) for conflict in sessions_conflicts])
+
+
+def materialize(series: models.TeachingSessionSeries) -> list[models.TeachingSession]:
+    """
+    Create all the sessions of a new series in a single query.
+    Raise a ValidationError if the series is invalid or if a session conflict with another one.
+    """
+
+    # the checks are the same for all the sessions, they only need to be done once
+    series.full_clean()
+
+    sessions = [_build_session(series, start) for start in series.occurrences()]
+
+    with transaction.atomic():
+        # checked in the same transaction as the creation
+        _check_conflicts(sessions)
+        sessions = models.TeachingSession.objects.bulk_create(sessions)
+        absence_links.update_sessions([session.pk for session in sessions])
+
+    ical.invalidate_sessions([series.group_id], [series.teacher_id])
+    return sessions
+
+
+def regenerate(series: models.TeachingSessionSeries, since: Optional[datetime] = None) -> None:
+    """
+    Apply the modifications of a series to its future sessions.
+    The sessions of the dates still in the series are updated, the others are deleted and the missing ones created.
+    """
+
+    since = since if since is not None else timezone.now()
+    series.full_clean()
+
+    existing = list(series.sessions.filter(start__gte=since).select_related("group", "teacher"))
+    previous_groups = {session.group_id for session in existing}
+    previous_teachers = {session.teacher_id for session in existing}
+
+    sessions_by_date = {timezone.localdate(session.start): session for session in existing}
+
+    updated_sessions = []
+    created_sessions = []
+
+    for start in series.occurrences(since=since):
+        session = sessions_by_date.pop(start.date(), None)
+
+        if session is None:
+            created_sessions.append(_build_session(series, start))
+        else:
+            session.start = start
+            session.duration = series.duration
+            session.note = series.note
+            session.unit = series.unit
+            session.group = series.group
+            session.teacher = series.teacher
+            session.updated_at = timezone.now()
+            updated_sessions.append(session)
+
+    deleted_sessions = list(sessions_by_date.values())
+
+    with transaction.atomic():
+        # checked in the same transaction as the modifications
+        _check_conflicts([*updated_sessions, *created_sessions])
+        models.TeachingSession.objects.bulk_update(
+            updated_sessions,
+            ["start", "duration", "note", "unit", "group", "teacher", "updated_at"],
+        )
+        models.TeachingSession.objects.bulk_create(created_sessions)
+        models.TeachingSession.objects.filter(pk__in=[session.pk for session in deleted_sessions]).delete()
+        absence_links.update_sessions([session.pk for session in [*updated_sessions, *created_sessions]])
+
+    ical.invalidate_sessions(
+        previous_groups | {series.group_id},
+        previous_teachers | {series.teacher_id},
+    )
+
+
+def shift(series: models.TeachingSessionSeries, delta: timedelta, since: Optional[datetime] = None) -> int:
+    """
+    Move all the future sessions of a series by a duration, in a single query.
+    Return the number of moved sessions.
+    """
+
+    since = since if since is not None else timezone.now()
+
+    with transaction.atomic():
+        # the sessions are locked, and the conflicts checked in the same transaction as the move
+        sessions = list(series.sessions.select_for_update().filter(start__gte=since).order_by("start"))
+        if not sessions:
+            return 0
+
+        previous_date = timezone.localdate(sessions[0].start)
+        for session in sessions:
+            session.start += delta
+
+        _check_conflicts(sessions)
+
+        count = models.TeachingSession.objects.filter(
+            pk__in=[session.pk for session in sessions]
+        ).update(start=F("start") + delta, updated_at=timezone.now())
+        absence_links.update_sessions([session.pk for session in sessions])
+
+        # keep the series consistent with its sessions for the next regenerations : the days of the series and of its
+        # future exclusions move with the sessions
+        first_start = timezone.localtime(sessions[0].start)
+        days = first_start.date() - previous_date
+        series.weekday, series.time = first_start.weekday(), first_start.time()
+        series.start_date += days
+        series.end_date += days
+        series.exclusions = [
+            (exclusion + days if exclusion >= timezone.localdate(since) else exclusion).isoformat()
+            for exclusion in map(date.fromisoformat, series.exclusions)
+        ]
+        series.save(update_fields=["weekday", "time", "start_date", "end_date", "exclusions", "updated_at"])
+
+    ical.invalidate_sessions([series.group_id], [series.teacher_id])
+    return count
@@ -0,0 +1,617 @@
+"""
+Sharding for the Palto project.
+
+With DATABASE_SHARDS, every department and all the rows depending on it (groups, units, sessions, cards, devices,
+attendances, absences...) are stored in one of the shards, chosen from the id of the department when it is created.
+The shard of every department is then recorded in a directory of the default database, along with its name to keep
+the names unique across the shards. The users are written in the default database and copied into every shard, so
+the permissions can be checked inside a shard.
+
+A request is scoped to the shard of the department it concerns, and the queries that are not scoped to a shard,
+like the lists of a superuser, are made on every shard and their results merged.
+"""
+
+import functools
+import heapq
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import chain, islice
+from operator import attrgetter
+from typing import Iterable, Iterator, Optional, Type, Union
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Model, QuerySet
+from django.db.models.query import ModelIterable
+
+
+# models stored in the shard of their department
+PARTITIONED_MODELS: set[str] = {
+    "Palto.department",
+    "Palto.department_managers",
+    "Palto.department_teachers",
+    "Palto.department_students",
+    "Palto.studentgroup",
+    "Palto.studentgroup_students",
+    "Palto.teachingunit",
+    "Palto.teachingunit_managers",
+    "Palto.teachingunit_teachers",
+    "Palto.teachingunit_student_groups",
+    "Palto.studentcard",
+    "Palto.scannerdevice",
+    "Palto.teachingsession",
+    "Palto.teachingsessionseries",
+    "Palto.attendance",
+    "Palto.absence",
+    "Palto.absencesession",
+    "Palto.absenceattachment",
+    "Palto.archivedteachingsession",
+    "Palto.archivedattendance",
+    "Palto.tombstone",
+    "Palto.formermember",
+}
+
+# models written in the default database and copied into every shard
+MIRRORED_MODELS: set[str] = {
+    "Palto.user",
+    "Palto.usersearchtoken",
+}
+
+# the relation giving the shard of the partitioned models without a department
+PARENTS: dict[str, str] = {
+    "Palto.teachingsession": "unit",
+    "Palto.teachingsessionseries": "unit",
+    "Palto.attendance": "session",
+    "Palto.absencesession": "absence",
+    "Palto.absenceattachment": "absence",
+    "Palto.archivedattendance": "session",
+}
+
+# duration during which the shard of an object is remembered. The objects never move, only the cache size matters.
+LOCATION_CACHE_TIMEOUT: int = 60 * 60 * 24
+
+
+def is_enabled() -> bool:
+    return bool(settings.DATABASE_SHARDS)
+
+
+def is_partitioned(model: Type[Model]) -> bool:
+    return model._meta.label_lower in PARTITIONED_MODELS
+
+
+def is_mirrored(model: Type[Model]) -> bool:
+    return model._meta.label_lower in MIRRORED_MODELS
+
+
+def _directory() -> Type[Model]:
+    # the models import this module
+    return apps.get_model("Palto", "DepartmentShard")
+
+
+def shard_for_department(department_id) -> str:
+    """
+    Return the shard storing a department.
+
+    The shard of a new department is chosen from its id, then recorded in the directory of the default database
+    when the department is saved, so the departments stay in their shard when other shards are added.
+    """
+
+    key = f"palto:shard:department:{department_id}"
+
+    alias = cache.get(key)
+    if alias is not None:
+        return alias
+
+    directory = _directory().objects.using(DEFAULT_DB_ALIAS)
+    alias = directory.filter(pk=department_id).values_list("alias", flat=True).first()
+    if alias is None:
+        # a department not saved yet
+        shards: list[str] = settings.DATABASE_SHARDS
+        return shards[uuid.UUID(str(department_id)).int % len(shards)]
+
+    cache.set(key, alias, LOCATION_CACHE_TIMEOUT)
+    return alias
+
+
+def record_department(department: Model, alias: str) -> None:
+    """
+    Record the shard and the name of a department in the directory, before saving it in its shard.
+    Raise an IntegrityError if a department of any shard has the same name.
+    """
+
+    _directory().objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        pk=department.pk, defaults={"alias": alias, "name": department.name},
+    )
+
+
+def forget_department(department_id) -> None:
+    """
+    Remove a deleted department from the directory.
+    """
+
+    _directory().objects.using(DEFAULT_DB_ALIAS).filter(pk=department_id).delete()
+    cache.delete(f"palto:shard:department:{department_id}")
+
+
+def is_department_name_taken(name: str, department_id) -> bool:
+    """
+    Return True if another department of any shard has this name.
+    """
+
+    if not is_enabled():
+        return False
+
+    return _directory().objects.using(DEFAULT_DB_ALIAS).filter(name=name).exclude(pk=department_id).exists()
+
+
+def locate(model: Type[Model], pk) -> Optional[str]:
+    """
+    Return the shard storing an object, or None if it doesn't exist.
+    """
+
+    key = f"palto:shard:{model._meta.label_lower}:{pk}"
+
+    alias = cache.get(key)
+    if alias is not None:
+        return alias
+
+    for alias in settings.DATABASE_SHARDS:
+        if model._default_manager.using(alias).filter(pk=pk).exists():
+            cache.set(key, alias, LOCATION_CACHE_TIMEOUT)
+            return alias
+
+    return None
+
+
+def shard_of(instance: Model) -> Optional[str]:
+    """
+    Return the shard of a partitioned object, from its department or from its parent.
+    """
+
+    # the objects loaded from a shard, or attached to an object of a shard, are already known
+    if instance._state.db in settings.DATABASE_SHARDS:
+        return instance._state.db
+
+    label = instance._meta.label_lower
+
+    if label == "Palto.department":
+        return shard_for_department(instance.pk)
+
+    department_id = instance.__dict__.get("department_id")
+    if department_id is not None:
+        return shard_for_department(department_id)
+
+    parent = PARENTS.get(label)
+    if parent is not None:
+        field = instance._meta.get_field(parent)
+        # avoid a query if the parent is already loaded
+        if field.is_cached(instance):
+            return shard_of(getattr(instance, parent))
+
+        # the id is not loaded from the database, the object can be initializing its fields
+        parent_id = instance.__dict__.get(field.attname)
+        if parent_id is not None:
+            return locate(field.related_model, parent_id)
+
+    return None
+
+
+# scope of the requests
+
+
+class ShardScope:
+    """
+    The shard of the department concerned by the current request or code path, if known.
+    """
+
+    def __init__(self, alias: Optional[str] = None):
+        self.alias = alias
+
+
+_scope: ContextVar[Optional[ShardScope]] = ContextVar("palto_shard_scope", default=None)
+
+
+def get_shard() -> Optional[str]:
+    """
+    Return the shard of the current scope, if any.
+    """
+
+    scope = _scope.get()
+    return scope.alias if scope is not None else None
+
+
+@contextmanager
+def shard_scope(alias: Optional[str] = None) -> Iterator[ShardScope]:
+    """
+    Send the queries without a known shard to the given shard, for example for a whole request.
+    The shard can also be chosen later in the scope, once the department is known.
+    """
+
+    scope = ShardScope(alias)
+    token = _scope.set(scope)
+
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def set_shard(alias: str) -> None:
+    """
+    Send the rest of the queries of the current scope without a known shard to the given shard.
+    """
+
+    scope = _scope.get()
+    if scope is not None:
+        scope.alias = alias
+
+
+def instance_scope(receiver):
+    """
+    Run a signal receiver in the shard of the object of the signal, if the current scope has no shard.
+    """
+
+    @functools.wraps(receiver)
+    def wrapper(sender, instance, **kwargs):
+        if not is_partitioned(type(instance)):
+            return receiver(sender, instance=instance, **kwargs)
+
+        with object_scope(instance):
+            return receiver(sender, instance=instance, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def object_scope(instance: Model) -> Iterator[Optional[ShardScope]]:
+    """
+    Send the queries without a known shard to the shard of a partitioned object, if the current scope has no shard.
+    For example, the groups of a student are added from the student in the shard of the groups.
+    """
+
+    if not is_enabled() or get_shard() is not None:
+        yield _scope.get()
+        return
+
+    with shard_scope(shard_of(instance)) as scope:
+        yield scope
+
+
+def set_department(department_id) -> None:
+    """
+    Send the rest of the queries of the current scope without a known shard to the shard of a department.
+    """
+
+    if is_enabled():
+        set_shard(shard_for_department(department_id))
+
+
+# queries on all the shards
+
+
+def is_unscoped(queryset: QuerySet) -> bool:
+    """
+    Return True if the shard of a queryset of a partitioned model is unknown, so it is made on every shard.
+    """
+
+    if not is_enabled() or queryset._db is not None or get_shard() is not None or not is_partitioned(queryset.model):
+        return False
+
+    instance = queryset._hints.get("instance")
+    if instance is None:
+        return True
+
+    if is_partitioned(type(instance)):
+        return shard_of(instance) is None
+
+    # the relations of a user copied in a shard are read in this shard
+    return instance._state.db not in settings.DATABASE_SHARDS
+
+
+def each(queryset: QuerySet, include_default: bool = False) -> Iterator[QuerySet]:
+    """
+    Yield the queryset for every shard, or only the queryset itself when the sharding is disabled.
+    """
+
+    if not is_enabled():
+        yield queryset
+        return
+
+    if include_default:
+        yield queryset.using(DEFAULT_DB_ALIAS)
+
+    for alias in settings.DATABASE_SHARDS:
+        yield queryset.using(alias)
+
+
+def find(queryset: QuerySet):
+    """
+    Return the first result of the queryset found in a shard, or None.
+    """
+
+    for shard_queryset in each(queryset):
+        result = shard_queryset.first()
+        if result is not None:
+            return result
+
+    return None
+
+
+class _OrderingKey:
+    """
+    The values of the ordering fields of a result, compared in the direction of every field, the empty values last.
+    """
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values: tuple, descending: tuple[bool, ...]):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other: "_OrderingKey") -> bool:
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None or other_value is None:
+                return other_value is None
+            return value > other_value if descending else value < other_value
+        return False
+
+
+def _merge_ordering(queryset: QuerySet) -> Optional[list[str]]:
+    """
+    Return the ordering of a queryset, made total by the primary key, or None if it can't be compared here, like the
+    expressions and the related fields.
+    """
+
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    if "pk" not in ordering and "-pk" not in ordering:
+        ordering.append("pk")
+
+    for field in ordering:
+        if not isinstance(field, str) or "__" in field or field == "?":
+            return None
+
+        name = field.lstrip("-")
+        if name != "pk":
+            try:
+                queryset.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # an annotation
+                return None
+
+    return ordering
+
+
+def _ordering_key(queryset: QuerySet, ordering: list[str]):
+    """
+    Return the key sorting the objects of a queryset in the given ordering.
+    """
+
+    getters = [
+        attrgetter("pk" if field.lstrip("-") == "pk" else queryset.model._meta.get_field(field.lstrip("-")).attname)
+        for field in ordering
+    ]
+    descending = tuple(field.startswith("-") for field in ordering)
+    return lambda result: _OrderingKey(tuple(getter(result) for getter in getters), descending)
+
+
+class MergedResults:
+    """
+    The results of a queryset on every shard, merged in its order without reading them all.
+
+    A slice only reads the first rows of every shard up to its end, so the pages are read with a query by shard.
+    """
+
+    # the results are sorted, they can be paginated
+    ordered: bool = True
+
+    def __init__(self, queryset: QuerySet, ordering: list[str]):
+        self.querysets = list(each(queryset.order_by(*ordering)))
+        self._key = _ordering_key(queryset, ordering)
+
+    def _merge(self, querysets: Iterable) -> Iterator:
+        return heapq.merge(*querysets, key=self._key)
+
+    def __iter__(self) -> Iterator:
+        # every shard is read by chunks
+        return self._merge(queryset.iterator() for queryset in self.querysets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step is not None or index.stop is None:
+                return list(islice(self, index.start, index.stop, index.step))
+
+            start = index.start or 0
+            return list(islice(self._merge(queryset[:index.stop] for queryset in self.querysets), start, index.stop))
+
+        return self[index:index + 1][0]
+
+    def count(self) -> int:
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self) -> int:
+        return self.count()
+
+
+def fan_out(queryset: QuerySet) -> Union[QuerySet, MergedResults, list]:
+    """
+    Return the results of the queryset on every shard, merged in its order.
+    If the sharding is disabled or the queryset is scoped to a shard, the queryset is returned unchanged.
+    """
+
+    if not is_unscoped(queryset):
+        return queryset
+
+    # the expressions and the related fields can't be compared here, the results stay in the order of every shard
+    ordering = _merge_ordering(queryset)
+    if ordering is None:
+        return list(chain.from_iterable(each(queryset)))
+
+    return MergedResults(queryset, ordering)
+
+
+class ShardedQuerySet(QuerySet):
+    """
+    QuerySet of the partitioned models, creating the new objects in the shard of their department.
+
+    Without an explicit database, the creations are otherwise sent to the shard of the current scope. The queries
+    without a known shard, like the ones of the commands, are made on every shard.
+    """
+
+    def _shard_querysets(self) -> tuple[list[QuerySet], Optional[list[str]]]:
+        queryset = self._chain()
+        queryset.query.clear_limits()
+        # the related objects are prefetched once the results are merged
+        queryset._prefetch_related_lookups = ()
+
+        ordering = _merge_ordering(self) if self.ordered and self._iterable_class is ModelIterable else None
+        if ordering is not None:
+            queryset = queryset.order_by(*ordering)
+
+        # every shard reads up to the end of the slice, the slice is taken on the merged results
+        if self.query.high_mark is not None:
+            queryset.query.set_limits(high=self.query.high_mark)
+
+        return [queryset.using(alias) for alias in settings.DATABASE_SHARDS], ordering
+
+    def _merged(self, querysets: list, ordering: Optional[list[str]]) -> Iterator:
+        results = (
+            heapq.merge(*querysets, key=_ordering_key(self, ordering))
+            if ordering is not None else chain.from_iterable(querysets)
+        )
+        return islice(results, self.query.low_mark, self.query.high_mark)
+
+    def _fetch_all(self):
+        if self._result_cache is None and is_unscoped(self):
+            self._result_cache = list(self._merged(*self._shard_querysets()))
+
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=None):
+        if not is_unscoped(self):
+            return super().iterator(chunk_size)
+
+        querysets, ordering = self._shard_querysets()
+        for queryset in querysets:
+            # the chunks of every shard are prefetched in their shard
+            queryset._prefetch_related_lookups = self._prefetch_related_lookups
+        return self._merged([queryset.iterator(chunk_size) for queryset in querysets], ordering)
+
+    def count(self) -> int:
+        if self._result_cache is not None or not is_unscoped(self):
+            return super().count()
+
+        if self.query.is_sliced:
+            return len(self)
+        return sum(self.using(alias).count() for alias in settings.DATABASE_SHARDS)
+
+    def exists(self) -> bool:
+        if self._result_cache is not None or not is_unscoped(self):
+            return super().exists()
+
+        return any(self.using(alias).exists() for alias in settings.DATABASE_SHARDS)
+
+    def update(self, **kwargs) -> int:
+        if not is_unscoped(self):
+            return super().update(**kwargs)
+
+        return sum(self.using(alias).update(**kwargs) for alias in settings.DATABASE_SHARDS)
+
+    def delete(self) -> tuple[int, dict[str, int]]:
+        if not is_unscoped(self):
+            return super().delete()
+
+        total, counts = 0, {}
+        for alias in settings.DATABASE_SHARDS:
+            deleted, shard_counts = self.using(alias).delete()
+            total += deleted
+            for label, value in shard_counts.items():
+                counts[label] = counts.get(label, 0) + value
+
+        return total, counts
+
+    def create(self, **kwargs):
+        if not is_enabled() or self._db is not None:
+            return super().create(**kwargs)
+
+        instance = self.model(**kwargs)
+        instance.save(force_insert=True, using=shard_of(instance) or self.db)
+        return instance
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not is_enabled() or self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+
+        # create the objects of every shard together
+        objs = list(objs)
+        shards: dict[str, list] = {}
+        for instance in objs:
+            shards.setdefault(shard_of(instance) or self.db, []).append(instance)
+
+        for alias, instances in shards.items():
+            super(ShardedQuerySet, self.using(alias)).bulk_create(instances, *args, **kwargs)
+
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs) -> int:
+        if not is_enabled() or self._db is not None:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        # update the objects of every shard together
+        shards: dict[str, list] = {}
+        for instance in objs:
+            shards.setdefault(shard_of(instance) or self.db, []).append(instance)
+
+        return sum(
+            super(ShardedQuerySet, self.using(alias)).bulk_update(instances, fields, *args, **kwargs)
+            for alias, instances in shards.items()
+        )
+
+
+# users copies
+
+
+def mirror(instance: Model) -> None:
+    """
+    Copy a mirrored object from the default database into every shard.
+    """
+
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if not field.primary_key
+    }
+
+    for alias in settings.DATABASE_SHARDS:
+        type(instance)._default_manager.using(alias).update_or_create(pk=instance.pk, defaults=values)
+
+
+def mirror_many(instances: list[Model]) -> None:
+    """
+    Copy many mirrored objects from the default database into every shard, for example after a bulk creation.
+    """
+
+    if not instances:
+        return
+
+    model = type(instances[0])
+    fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+
+    for alias in settings.DATABASE_SHARDS:
+        model._default_manager.using(alias).bulk_create(
+            instances, update_conflicts=True, unique_fields=[model._meta.pk.attname], update_fields=fields,
+        )
+
+
+def forget(model: Type[Model], pk) -> None:
+    """
+    Delete a mirrored object from every shard, with the objects depending on it.
+    """
+
+    for alias in settings.DATABASE_SHARDS:
+        model._default_manager.using(alias).filter(pk=pk).delete()
@@ -0,0 +1,321 @@
+"""
+Signals for the Palto project.
+
+The signals receivers react to the modifications of the models, for example to invalidate the caches.
+"""
+
+from itertools import chain
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from Palto.Palto import models, ical, absence_links, changes, fragments, search, sharding
+from Palto.Palto.api.v1 import authentication
+
+
+# calendar feeds
+
+
+@receiver(pre_save, sender=models.TeachingSession)
+@sharding.instance_scope
+def _calendar_session_moved(sender, instance: models.TeachingSession, raw: bool = False, **kwargs):
+    if raw or instance._state.adding:
+        return
+
+    # if the session change of group or teacher, the previous users should also be invalidated
+    previous = models.TeachingSession.objects.filter(pk=instance.pk).values_list("group_id", "teacher_id").first()
+    if previous is not None and previous != (instance.group_id, instance.teacher_id):
+        ical.invalidate_sessions([previous[0]], [previous[1]])
+
+
+@receiver(post_save, sender=models.TeachingSession)
+@receiver(post_delete, sender=models.TeachingSession)
+@sharding.instance_scope
+def _calendar_session_changed(sender, instance: models.TeachingSession, raw: bool = False, **kwargs):
+    if raw:
+        return
+
+    ical.invalidate_sessions([instance.group_id], [instance.teacher_id])
+
+
+@receiver(post_save, sender=models.TeachingUnit)
+@sharding.instance_scope
+def _calendar_unit_changed(sender, instance: models.TeachingUnit, raw: bool = False, created: bool = False, **kwargs):
+    if raw or created:
+        return
+
+    # the name of the unit is part of the events
+    sessions = instance.sessions.all()
+    ical.invalidate_sessions(sessions.values_list("group_id", flat=True), sessions.values_list("teacher_id", flat=True))
+
+
+@receiver(post_save, sender=models.StudentGroup)
+@sharding.instance_scope
+def _calendar_group_changed(sender, instance: models.StudentGroup, raw: bool = False, created: bool = False, **kwargs):
+    if raw or created:
+        return
+
+    # the name of the group is part of the events
+    ical.invalidate_sessions([instance.pk], instance.teaching_sessions.values_list("teacher_id", flat=True))
+
+
+@receiver(post_save, sender=models.User)
+def _calendar_teacher_changed(
+        sender, instance: models.User, using: str, raw: bool = False, created: bool = False, update_fields=None,
+        **kwargs
+):
+    # the copies of the users in the shards are saved with the user of the default database
+    if raw or created or using != DEFAULT_DB_ALIAS:
+        return
+    # the name of the teacher is part of the events, the logins don't change it
+    if update_fields is not None and not set(update_fields) & {"first_name", "last_name"}:
+        return
+
+    # the sessions of the teacher can be in any shard
+    for alias in settings.DATABASE_SHARDS or [None]:
+        with sharding.shard_scope(alias):
+            ical.invalidate_sessions(
+                models.TeachingSession.objects.filter(teacher_id=instance.pk).values_list("group_id", flat=True),
+                [instance.pk],
+            )
+
+
+@receiver(m2m_changed, sender=models.StudentGroup.students.through)
+def _calendar_group_members_changed(sender, instance, action: str, reverse: bool, pk_set: set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        # the groups of a student were modified
+        ical.invalidate([instance.pk])
+    elif action == "pre_clear":
+        # all the students of the group will be removed
+        ical.invalidate(instance.students.values_list("pk", flat=True))
+    else:
+        ical.invalidate(pk_set)
+
+
+# absences links
+
+
+@receiver(post_save, sender=models.Absence)
+@sharding.instance_scope
+def _links_absence_changed(sender, instance: models.Absence, raw: bool = False, **kwargs):
+    if raw:
+        return
+
+    absence_links.update_absences([instance.pk])
+
+
+@receiver(post_save, sender=models.TeachingSession)
+@sharding.instance_scope
+def _links_session_changed(sender, instance: models.TeachingSession, raw: bool = False, **kwargs):
+    if raw:
+        return
+
+    absence_links.update_sessions([instance.pk])
+
+
+@receiver(m2m_changed, sender=models.StudentGroup.students.through)
+@sharding.instance_scope
+def _links_group_members_changed(sender, instance, action: str, reverse: bool, pk_set: set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear", "post_clear"):
+        return
+
+    if reverse:
+        # the groups of a student were modified
+        if action != "pre_clear":
+            absence_links.update_students([instance.pk])
+    elif action == "pre_clear":
+        # remember the students of the group before they are removed
+        instance._cleared_students = list(instance.students.values_list("pk", flat=True))
+    elif action == "post_clear":
+        absence_links.update_students(getattr(instance, "_cleared_students", []))
+    else:
+        absence_links.update_students(pk_set)
+
+
+# scanner devices
+
+
+@receiver(post_save, sender=models.ScannerDevice)
+@receiver(post_delete, sender=models.ScannerDevice)
+def _scanner_device_changed(sender, instance: models.ScannerDevice, **kwargs):
+    # the device might have been disabled or have a new token
+    authentication.forget_device(instance.pk)
+
+
+# roles
+
+
+@receiver(m2m_changed, sender=models.Department.managers.through)
+@receiver(m2m_changed, sender=models.Department.teachers.through)
+@receiver(m2m_changed, sender=models.Department.students.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.managers.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.teachers.through)
+def _roles_changed(sender, instance, action: str, reverse: bool, pk_set: set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        # the roles of a user were modified
+        instance.roles = None
+        models.User.bump_roles_version([instance.pk])
+    elif action == "pre_clear":
+        # all the users of the relation will be removed
+        models.User.bump_roles_version(
+            sender.objects.filter(**{instance._meta.model_name: instance}).values_list("user_id", flat=True)
+        )
+    else:
+        models.User.bump_roles_version(pk_set)
+
+
+# pages fragments
+
+
+def _fragments_members_changed(kind: str, sender, instance, action: str, reverse: bool, model, pk_set: set):
+    if reverse:
+        # the departments or units of a user were modified
+        if action in ("post_add", "post_remove"):
+            fragments.invalidate(kind, pk_set)
+        elif action == "pre_clear":
+            fragments.invalidate(kind, sender.objects.filter(user=instance).values_list(
+                f"{model._meta.model_name}_id", flat=True
+            ))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        fragments.invalidate(kind, [instance.pk])
+
+
+@receiver(m2m_changed, sender=models.Department.managers.through)
+@receiver(m2m_changed, sender=models.Department.teachers.through)
+def _fragments_department_members_changed(sender, instance, action: str, reverse: bool, model, pk_set: set, **kwargs):
+    _fragments_members_changed("department", sender, instance, action, reverse, model, pk_set)
+
+
+@receiver(m2m_changed, sender=models.TeachingUnit.managers.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.teachers.through)
+def _fragments_unit_members_changed(sender, instance, action: str, reverse: bool, model, pk_set: set, **kwargs):
+    _fragments_members_changed("unit", sender, instance, action, reverse, model, pk_set)
+
+
+@receiver(post_save, sender=models.User)
+def _fragments_user_changed(
+        sender, instance: models.User, raw: bool = False, created: bool = False, update_fields=None, **kwargs
+):
+    if raw or created:
+        return
+    # only the name of the user is shown in the fragments, the logins don't change it
+    if update_fields is not None and not set(update_fields) & {"username", "first_name", "last_name", "email"}:
+        return
+
+    # the name of the user is shown in the members of his departments and units, that can be in any shard
+    fragments.invalidate("department", list(chain.from_iterable(
+        sharding.each(instance.related_departments.values_list("pk", flat=True))
+    )))
+    fragments.invalidate("unit", list(chain.from_iterable(sharding.each(models.TeachingUnit.objects.filter(
+        Q(managers=instance) | Q(teachers=instance)
+    ).values_list("pk", flat=True).distinct()))))
+
+
+# changes feeds
+
+
+@receiver(post_delete, sender=models.User)
+@receiver(post_delete, sender=models.Department)
+@receiver(post_delete, sender=models.StudentGroup)
+@receiver(post_delete, sender=models.TeachingUnit)
+@receiver(post_delete, sender=models.StudentCard)
+@receiver(post_delete, sender=models.ScannerDevice)
+@receiver(post_delete, sender=models.TeachingSession)
+@receiver(post_delete, sender=models.TeachingSessionSeries)
+@receiver(post_delete, sender=models.Attendance)
+@receiver(post_delete, sender=models.Absence)
+@receiver(post_delete, sender=models.AbsenceAttachment)
+@receiver(post_delete, sender=models.Job)
+@receiver(post_delete, sender=models.ArchivedTeachingSession)
+@receiver(post_delete, sender=models.ArchivedAttendance)
+def _changes_object_deleted(sender, instance, using: str, **kwargs):
+    changes.record_deletion(instance, using)
+
+
+@receiver(pre_delete, sender=models.Department)
+def _changes_department_deleted(sender, instance: models.Department, using: str, **kwargs):
+    # the members are deleted with the department, keep them to give them its tombstones
+    throughs = (
+        models.Department.managers.through, models.Department.teachers.through, models.Department.students.through
+    )
+    changes.remember_members([
+        (user_id, instance.pk)
+        for through in throughs
+        for user_id in through.objects.using(using).filter(department_id=instance.pk).values_list("user_id", flat=True)
+    ], using)
+
+
+@receiver(m2m_changed, sender=models.Department.managers.through)
+@receiver(m2m_changed, sender=models.Department.teachers.through)
+@receiver(m2m_changed, sender=models.Department.students.through)
+@receiver(m2m_changed, sender=models.StudentGroup.students.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.managers.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.teachers.through)
+@receiver(m2m_changed, sender=models.TeachingUnit.student_groups.through)
+def _changes_members_changed(sender, instance, action: str, reverse: bool, model, pk_set: set, using: str, **kwargs):
+    if not reverse:
+        # the members are part of the object
+        if action in ("post_add", "post_remove", "post_clear"):
+            changes.touch(type(instance), [instance.pk], using)
+    elif action in ("post_add", "post_remove"):
+        changes.touch(model, pk_set, using)
+    elif action == "pre_clear":
+        # all the objects of the relation will lose the instance
+        owner = next(field.attname for field in sender._meta.fields if field.related_model is model)
+        member = next(field.attname for field in sender._meta.fields if field.related_model is type(instance))
+        changes.touch(
+            model, sender.objects.using(using).filter(**{member: instance.pk}).values_list(owner, flat=True), using
+        )
+
+
+# shards
+
+
+@receiver(post_save, sender=models.User)
+def _shards_user_saved(sender, instance: models.User, using: str, **kwargs):
+    # the users are written in the default database, the shards only keep a copy
+    if settings.DATABASE_SHARDS and using == DEFAULT_DB_ALIAS:
+        sharding.mirror(instance)
+
+
+@receiver(post_delete, sender=models.User)
+def _shards_user_deleted(sender, instance: models.User, using: str, **kwargs):
+    if settings.DATABASE_SHARDS and using == DEFAULT_DB_ALIAS:
+        sharding.forget(models.User, instance.pk)
+
+
+@receiver(pre_save, sender=models.Department)
+def _shards_department_saved(sender, instance: models.Department, using: str, raw: bool = False, **kwargs):
+    # the directory refuses the names already used in another shard before the department is written
+    if settings.DATABASE_SHARDS and using in settings.DATABASE_SHARDS and not raw:
+        sharding.record_department(instance, using)
+
+
+@receiver(post_delete, sender=models.Department)
+def _shards_department_deleted(sender, instance: models.Department, using: str, **kwargs):
+    if settings.DATABASE_SHARDS and using in settings.DATABASE_SHARDS:
+        sharding.forget_department(instance.pk)
+
+
+# users search
+
+
+@receiver(post_save, sender=models.User)
+def _search_user_saved(sender, instance: models.User, using: str, raw: bool = False, update_fields=None, **kwargs):
+    if raw or using != DEFAULT_DB_ALIAS:
+        return
+
+    # the logins only update the date of the last login
+    if update_fields is not None and not set(update_fields) & set(search.FIELDS):
+        return
+
+    search.index_users([instance])
@@ -0,0 +1,213 @@
+"""
+Slow queries log for the Palto project.
+
+When SLOW_QUERY_THRESHOLD_MS is set, every query slower than this threshold is logged in the "Palto.slow_queries"
+logger with its normalized SQL, the view that made it and the plan of the database. The slowest queries of the process
+are also kept in a bounded table, displayed to the staff by the slow queries page.
+"""
+
+import contextlib
+import logging
+import re
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+
+logger = logging.getLogger("Palto.slow_queries")
+
+
+_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalize(sql: str) -> str:
+    """
+    Return the query without its values, so the same query with different parameters is grouped together.
+    """
+
+    sql = sql.replace("%s", "?")
+    sql = _STRING_PATTERN.sub("?", sql)
+    sql = _NUMBER_PATTERN.sub("?", sql)
+    # the lists of values have a different length for every query
+    sql = _LIST_PATTERN.sub("(...)", sql)
+    return _SPACES_PATTERN.sub(" ", sql).strip()
+
+
+@dataclass
+class SlowQuery:
+    """
+    The statistics of a normalized query slower than the threshold.
+    """
+
+    sql: str
+    view: str
+    explain: str
+    count: int = 0
+    total: float = 0.0
+    maximum: float = 0.0
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count
+
+    # durations in milliseconds, for the display
+
+    @property
+    def total_ms(self) -> float:
+        return self.total * 1000
+
+    @property
+    def average_ms(self) -> float:
+        return self.average * 1000
+
+    @property
+    def maximum_ms(self) -> float:
+        return self.maximum * 1000
+
+
+_lock = threading.Lock()
+_slowest: dict[str, SlowQuery] = {}
+
+
+def top(limit: Optional[int] = None) -> list[SlowQuery]:
+    """
+    Return the slow queries of this process, the ones taking the most time in total first.
+    """
+
+    with _lock:
+        queries = sorted(_slowest.values(), key=lambda query: query.total, reverse=True)
+
+    return queries[:limit]
+
+
+def reset() -> None:
+    """
+    Forget the slow queries of this process, for example after fixing them.
+    """
+
+    with _lock:
+        _slowest.clear()
+
+
+def _record(sql: str, view: str, duration: float, explain: Optional[str]) -> SlowQuery:
+    with _lock:
+        query = _slowest.get(sql)
+
+        if query is None:
+            if len(_slowest) >= settings.SLOW_QUERY_TOP_SIZE:
+                # forget the query taking the least time in total to keep the table bounded
+                del _slowest[min(_slowest.values(), key=lambda query_: query_.total).sql]
+
+            query = _slowest[sql] = SlowQuery(sql=sql, view=view, explain=explain or "")
+
+        query.count += 1
+        query.total += duration
+        query.maximum = max(query.maximum, duration)
+        # remember the last view, the most likely to be investigated
+        query.view = view
+
+        return query
+
+
+def _known_explain(sql: str) -> Optional[str]:
+    with _lock:
+        query = _slowest.get(sql)
+        return query.explain if query is not None else None
+
+
+# explaining a query make queries too, they should not be watched
+_explaining: ContextVar[bool] = ContextVar("slow_queries_explaining", default=False)
+
+
+def explain(alias: str, sql: str, params) -> str:
+    """
+    Return the plan of the database for a query.
+    """
+
+    connection = connections[alias]
+    token = _explaining.set(True)
+
+    try:
+        # a savepoint, so that an error doesn't break the transaction of the request
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+
+    except DatabaseError as exc:
+        return f"unavailable: {exc}"
+
+    finally:
+        _explaining.reset(token)
+
+
+class SlowQueryWrapper:
+    """
+    Database execute wrapper recording the queries slower than the threshold.
+    """
+
+    def __init__(self, alias: str, origin):
+        self.alias = alias
+        # the request or the name of the task making the queries
+        self.origin = origin
+
+    @property
+    def view(self) -> str:
+        if isinstance(self.origin, str):
+            return self.origin
+
+        # the view of a request is only known once its url is resolved
+        resolver_match = getattr(self.origin, "resolver_match", None)
+        if resolver_match is not None and resolver_match.view_name:
+            return resolver_match.view_name
+        return "unknown"
+
+    def __call__(self, execute, sql, params, many, context):
+        if _explaining.get():
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - start
+
+        if duration * 1000 < settings.SLOW_QUERY_THRESHOLD_MS:
+            return result
+
+        normalized = normalize(sql)
+        plan = _known_explain(normalized)
+        # only the reading queries are explained, once per normalized query
+        if plan is None and not many and sql.lstrip()[:6].upper() == "SELECT":
+            plan = explain(self.alias, sql, params)
+
+        query = _record(normalized, self.view, duration, plan)
+
+        logger.warning(
+            "duration_ms=%.1f view=%s sql=%s\n%s",
+            duration * 1000, query.view, normalized, query.explain,
+        )
+
+        return result
+
+
+@contextlib.contextmanager
+def watch(origin) -> Iterator[None]:
+    """
+    Record the slow queries made on every database, if the slow queries log is enabled.
+    The origin is the request making the queries, or a name describing the task.
+    """
+
+    if not settings.SLOW_QUERY_THRESHOLD_MS:
+        yield
+        return
+
+    with contextlib.ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(SlowQueryWrapper(alias, origin)))
+        yield
@@ -0,0 +1,93 @@
+"""
+Storages for the Palto project.
+
+A storage describes how the uploaded files are received and saved on the disk.
+"""
+
+import hashlib
+import os
+import re
+from typing import Optional
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.deconstruct import deconstructible
+
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def hash_file(content: File) -> str:
+    """
+    Return the SHA-256 hash of a file, reading it by chunks.
+    """
+
+    hasher = hashlib.sha256()
+
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+
+    return hasher.hexdigest()
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream the uploaded files by chunks into a temporary file while computing their SHA-256 hash.
+    The uploaded files are never kept in memory.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size: int):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    A storage where the files are named after the SHA-256 hash of their content.
+
+    Identical files are only saved once : uploading a file that already exists does not write anything.
+    """
+
+    def _save(self, name: str, content: File) -> str:
+        # use the hash computed during the upload if available
+        digest = getattr(content, "sha256", None) or hash_file(content)
+
+        directory, filename = os.path.split(name)
+        _, extension = os.path.splitext(filename)
+        name = os.path.join(directory, digest[:2], f"{digest}{extension.lower()}")
+
+        # if the file already exists, there is nothing to write
+        if self.exists(name):
+            return name
+
+        saved_name = super()._save(name, content)
+        if saved_name != name:
+            # the same file was saved at the same time by another request, keep only one of them
+            self.delete(saved_name)
+
+        return name
+
+    @staticmethod
+    def hash_from_name(name: str) -> Optional[str]:
+        """
+        Return the hash of a file from its name in the storage.
+        """
+
+        digest, _ = os.path.splitext(os.path.basename(name))
+        return digest if HASH_PATTERN.match(digest) else None
+
+
+attachment_storage = ContentAddressedStorage()
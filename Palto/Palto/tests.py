@@ -3,62 +3,1567 @@ Tests for the Palto project.
 
 Tests allow to easily check after modifying the logic behind a feature that everything still work as intended.
 """
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, time, timedelta
+from itertools import chain
 
 from django import test
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from Palto.Palto import factories
+from Palto.Palto import (
+    archive, changes, conflicts, counts, factories, ical, imports, instrumentation, jobs, metrics, middleware, models,
+    purge, rosters, routers, search, series, sharding, slow_queries
+)
+from Palto.Palto.api.v1.serializers import JobSerializer
+from Palto.Palto.management.commands import palto_scan_storm
+
+
+class PaltoTestCase(test.TestCase):
+    # the partitioned models are saved in the shards when they are configured
+    databases = {"default", *settings.DATABASE_SHARDS}
+
+    def assertNumQueries(self, num, func=None, *args, **kwargs):
+        # the queries are counted on a single database, the reads of the shards are spread over several of them
+        if settings.DATABASE_SHARDS:
+            if func is None:
+                return contextlib.nullcontext()
+            return func(*args, **kwargs)
+        return super().assertNumQueries(num, func, *args, **kwargs)
+
+    @classmethod
+    @contextlib.contextmanager
+    def captureOnCommitCallbacks(cls, *, using="default", execute=False):
+        # the callbacks are registered in the transaction of the shard of the modified rows
+        with contextlib.ExitStack() as stack:
+            for alias in settings.DATABASE_SHARDS:
+                stack.enter_context(super().captureOnCommitCallbacks(using=alias, execute=execute))
+            with super().captureOnCommitCallbacks(using=using, execute=execute) as callbacks:
+                yield callbacks
 
 
 # Create your tests here.
-class UserTestCase(test.TestCase):
+class UserTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeUserFactory()
 
 
-class DepartmentTestCase(test.TestCase):
+class DepartmentTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeDepartmentFactory()
 
 
-class StudentGroupTestCase(test.TestCase):
+class StudentGroupTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeStudentGroupFactory()
 
 
-class TeachingUnitTestCase(test.TestCase):
+class TeachingUnitTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeTeachingUnitFactory()
 
 
-class StudentCardTestCase(test.TestCase):
+class StudentCardTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeStudentCardFactory()
 
 
-class TeachingSessionTestCase(test.TestCase):
+class TeachingSessionTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeTeachingSessionFactory()
 
 
-class AttendanceTestCase(test.TestCase):
+class AttendanceTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeAttendanceFactory()
 
 
-class AbsenceTestCase(test.TestCase):
+class AbsenceTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeAbsenceFactory()
 
 
-class AbsenceAttachmentTestCase(test.TestCase):
+@test.override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AbsenceAttachmentTestCase(PaltoTestCase):
     @staticmethod
     def test_creation():
         factories.FakeAbsenceAttachmentFactory()
+
+
+class DatabaseRouterTestCase(PaltoTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    @test.override_settings(DATABASE_REPLICAS=[])
+    def test_no_replica(self):
+        with routers.use_replica():
+            self.assertIsNone(self.router.db_for_read(models.TeachingSession))
+
+    @test.override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_replica_read(self):
+        # outside a replica scope, read from the primary
+        self.assertEqual(self.router.db_for_read(models.TeachingSession), "default")
+
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(models.TeachingSession), "replica1")
+            # the scan path always stay on the primary
+            self.assertEqual(self.router.db_for_read(models.Attendance), "default")
+
+            with routers.use_primary():
+                self.assertEqual(self.router.db_for_read(models.TeachingSession), "default")
+
+    @test.override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_pinned_after_write(self):
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_write(models.TeachingSession), "default")
+            self.assertEqual(self.router.db_for_read(models.TeachingSession), "default")
+
+    @test.override_settings(DATABASE_REPLICAS=["replica1"])
+    def test_middleware_pin_cookie(self):
+        user = factories.FakeUserFactory(is_superuser=True)
+        self.client.force_login(user)
+
+        # a write request pin the client to the primary
+        response = self.client.post("/api/v1/departments/", data={"name": "UFR", "email": "ufr@university.fr"})
+        self.assertIn(middleware.DatabaseRoutingMiddleware.PIN_COOKIE, response.cookies)
+
+
+class DatabaseReplicaTestCase(test.TransactionTestCase):
+    databases = "__all__"
+
+    def test_replica_query(self):
+        # only run with real replicas, for example with DATABASE_REPLICAS="replica.sqlite3"
+        if not settings.DATABASE_REPLICAS:
+            self.skipTest("No replica configured.")
+
+        department = factories.FakeDepartmentFactory()
+
+        with routers.use_replica():
+            self.assertTrue(models.Department.objects.filter(pk=department.pk).exists())
+
+
+class DatabaseConnectionStatsTestCase(PaltoTestCase):
+    def test_connection_created(self):
+        created_before = instrumentation.database_connection_stats()["default"]["created"]
+        connection_created.send(sender=connection.__class__, connection=connection)
+
+        stats = instrumentation.database_connection_stats()["default"]
+        self.assertEqual(stats["created"], created_before + 1)
+        self.assertEqual(stats["mode"], settings.DATABASE_CONNECTION_MODE)
+
+
+@test.override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AbsenceAttachmentStorageTestCase(PaltoTestCase):
+    CONTENT: bytes = b"%PDF-1.4 medical certificate"
+
+    def test_deduplication(self):
+        absence = factories.FakeAbsenceFactory()
+
+        attachments = models.AbsenceAttachment.bulk_create_from_files(absence, [
+            SimpleUploadedFile("certificate.pdf", self.CONTENT),
+            SimpleUploadedFile("certificate-copy.PDF", self.CONTENT),
+        ])
+
+        # both attachments share the same file, named after its hash
+        digest = hashlib.sha256(self.CONTENT).hexdigest()
+        self.assertEqual(attachments[0].content.name, attachments[1].content.name)
+        self.assertEqual(attachments[0].content_hash, digest)
+        self.assertEqual(absence.attachments.filter(content_hash=digest).count(), 2)
+        self.assertEqual(os.listdir(os.path.dirname(attachments[0].content.path)), [f"{digest}.pdf"])
+        # but they keep their original names
+        self.assertEqual([attachment.filename for attachment in attachments], ["certificate.pdf", "certificate-copy.PDF"])
+
+    def test_save(self):
+        attachment = factories.FakeAbsenceAttachmentFactory(content__data=self.CONTENT)
+        self.assertEqual(attachment.content_hash, hashlib.sha256(self.CONTENT).hexdigest())
+
+
+@test.override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AbsenceAttachmentDownloadTestCase(PaltoTestCase):
+    CONTENT: bytes = b"0123456789"
+
+    def setUp(self):
+        self.attachment = factories.FakeAbsenceAttachmentFactory(content__data=self.CONTENT)
+        self.url = f"/absences/attachments/{self.attachment.id}/download/"
+
+    def test_forbidden(self):
+        self.client.force_login(factories.FakeUserFactory())
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    @test.override_settings(SENDFILE_BACKEND="python")
+    def test_python(self):
+        self.client.force_login(self.attachment.absence.student)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT)
+        # the file is downloaded with its original name rather than its hash
+        self.assertIn('filename="example.dat"', response["Content-Disposition"])
+
+        response = self.client.get(self.url, headers={"Range": "bytes=2-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+        self.assertEqual(b"".join(response.streaming_content), b"2345")
+
+        response = self.client.get(self.url, headers={"Range": "bytes=-3"})
+        self.assertEqual(b"".join(response.streaming_content), b"789")
+
+        response = self.client.get(self.url, headers={"Range": "bytes=20-"})
+        self.assertEqual(response.status_code, 416)
+
+    @test.override_settings(SENDFILE_BACKEND="nginx", SENDFILE_URL="/protected-media/")
+    def test_nginx(self):
+        self.client.force_login(self.attachment.absence.student)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.attachment.content.name}")
+        self.assertEqual(response["Content-Disposition"], "inline; filename*=utf-8''example.dat")
+
+
+def job_add(a: int, b: int) -> int:
+    return a + b
+
+
+def job_fail():
+    raise ValueError("This job always fail.")
+
+
+class JobTestCase(PaltoTestCase):
+    def test_success(self):
+        job = jobs.enqueue(job_add, a=1, b=2)
+
+        self.assertTrue(jobs.claim(job.pk))
+        self.assertFalse(jobs.claim(job.pk))
+        updated_at = models.Job.objects.get(pk=job.pk).updated_at
+        self.assertEqual(jobs.run_job(job.pk), models.Job.Status.SUCCEEDED)
+
+        job.refresh_from_db()
+        self.assertEqual(job.result, 3)
+        # the changes feeds see the end of the job
+        self.assertGreater(job.updated_at, updated_at)
+
+    def test_retry(self):
+        job = jobs.enqueue(job_fail, max_attempts=2)
+
+        with self.assertLogs(jobs.logger, "ERROR"):
+            # the first failure put the job back in the queue
+            self.assertEqual(jobs.run_job(job.pk), models.Job.Status.PENDING)
+            # the last attempt mark it as failed
+            self.assertEqual(jobs.run_job(job.pk), models.Job.Status.FAILED)
+
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("ValueError", job.error)
+
+
+    def test_release(self):
+        job = jobs.enqueue(job_add, max_attempts=2, a=1, b=2)
+
+        # an error of the worker counts as an attempt and delays the next one
+        self.assertTrue(jobs.claim(job.pk))
+        self.assertTrue(jobs.release(job.pk, "OperationalError"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.Status.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+
+        self.assertTrue(jobs.claim(job.pk))
+        self.assertTrue(jobs.release(job.pk, "OperationalError"))
+        self.assertFalse(jobs.release(job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (models.Job.Status.FAILED, 2, "OperationalError"))
+
+
+    def test_requeue_stale(self):
+        retried = jobs.enqueue(job_add, max_attempts=2, a=1, b=2)
+        last = jobs.enqueue(job_add, max_attempts=1, a=1, b=2)
+        for job in (retried, last):
+            self.assertTrue(jobs.claim(job.pk))
+
+        # the jobs of a crashed worker count an attempt, and fail after their last one
+        self.assertEqual(jobs.requeue_stale(timedelta(seconds=-1)), 1)
+        retried.refresh_from_db()
+        last.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts), (models.Job.Status.PENDING, 1))
+        self.assertEqual((last.status, last.attempts), (models.Job.Status.FAILED, 1))
+
+        self.assertTrue(jobs.claim(retried.pk))
+        self.assertEqual(jobs.requeue_stale(timedelta(seconds=-1)), 0)
+        retried.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts), (models.Job.Status.FAILED, 2))
+
+
+class JobWorkerTestCase(test.TransactionTestCase):
+    databases = PaltoTestCase.databases
+
+    def test_worker(self):
+        job_ids = [jobs.enqueue(job_add, a=index, b=index).pk for index in range(5)]
+
+        call_command("run_palto_worker", "--once", "--workers", "2", "--poll", "0.01")
+
+        for index, job_id in enumerate(job_ids):
+            job = models.Job.objects.get(pk=job_id)
+            self.assertEqual(job.status, models.Job.Status.SUCCEEDED)
+            self.assertEqual(job.result, index * 2)
+
+
+class ScannerDeviceAdminTestCase(PaltoTestCase):
+    def setUp(self):
+        self.department = factories.FakeDepartmentFactory()
+        self.client.force_login(factories.FakeUserFactory(is_superuser=True, is_staff=True))
+
+    def _add(self, name: str) -> str:
+        response = self.client.post(
+            "/admin/Palto/scannerdevice/add/", data={"name": name, "department": self.department.pk, "is_active": "on"},
+            follow=True,
+        )
+        # the token is only shown once
+        return next(str(message) for message in response.context["messages"]).split(" is ")[1].split(",")[0]
+
+    def test_add(self):
+        token = self._add("entrance")
+        self._add("office")
+
+        device = models.ScannerDevice.objects.get(name="entrance")
+        self.assertEqual(device.token_hash, models.ScannerDevice.hash_token(token))
+        self.assertEqual(models.ScannerDevice.objects.count(), 2)
+
+    def test_reset_tokens(self):
+        self._add("entrance")
+        device = models.ScannerDevice.objects.get()
+        token_hash = device.token_hash
+
+        self.client.post("/admin/Palto/scannerdevice/", data={
+            "action": "reset_tokens", "_selected_action": [device.pk],
+        })
+        device.refresh_from_db()
+        self.assertNotEqual(device.token_hash, token_hash)
+
+
+class CalendarFeedTestCase(PaltoTestCase):
+    def setUp(self):
+        self.session = factories.FakeTeachingSessionFactory(start=timezone.now())
+        self.student = factories.FakeUserFactory()
+        self.session.group.students.add(self.student)
+
+        self.url = f"/calendar/{ical.make_token(self.student.id)}.ics"
+
+    def test_feed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f"UID:{self.session.id}@palto", b"".join(response.streaming_content).decode())
+
+        # the second request is served from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertIn(f"UID:{self.session.id}@palto", response.content.decode())
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # a new session of the group invalidate the feed
+        factories.FakeTeachingSessionFactory(group=self.session.group, unit=self.session.unit)
+        response = self.client.get(self.url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+        # leaving the group also invalidate the feed
+        etag = response["ETag"]
+        self.session.group.students.remove(self.student)
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+
+    def test_renamed(self):
+        # the names of the group and the teacher are part of the events
+        for instance, field in ((self.session.group, "name"), (self.session.teacher, "last_name")):
+            etag = self.client.get(self.url)["ETag"]
+            setattr(instance, field, "Renamed")
+            instance.save()
+            self.assertIn("Renamed", self.client.get(self.url).getvalue().decode())
+            self.assertNotEqual(self.client.get(self.url)["ETag"], etag)
+
+        # the logins don't change the events
+        etag = self.client.get(self.url)["ETag"]
+        self.session.teacher.save(update_fields=["last_login"])
+        self.assertEqual(self.client.get(self.url)["ETag"], etag)
+
+    def test_invalid_token(self):
+        response = self.client.get(f"/calendar/{self.student.id}:invalid.ics")
+        self.assertEqual(response.status_code, 404)
+
+
+class TimetableConflictTestCase(PaltoTestCase):
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory()
+        self.students = [factories.FakeUserFactory() for _ in range(4)]
+        self.department = factories.FakeDepartmentFactory(teachers=[self.teacher], students=self.students)
+
+        self.group_a = factories.FakeStudentGroupFactory(department=self.department, students=self.students[:3])
+        self.group_b = factories.FakeStudentGroupFactory(department=self.department, students=self.students[2:])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.teacher])
+
+        self.start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+
+    def _session(self, group, teacher, hours: int, duration: int = 2) -> models.TeachingSession:
+        return factories.FakeTeachingSessionFactory(
+            unit=self.unit, group=group, teacher=teacher,
+            start=self.start + timedelta(hours=hours), duration=timedelta(hours=duration),
+        )
+
+    def test_audit(self):
+        other_teacher = factories.FakeUserFactory()
+
+        first = self._session(self.group_a, self.teacher, 0)
+        # same teacher, different group sharing a student
+        second = self._session(self.group_b, self.teacher, 1)
+        # same group, different teacher
+        third = self._session(self.group_a, other_teacher, 1, duration=1)
+        # after the others, no conflict
+        self._session(self.group_a, self.teacher, 3)
+
+        department_conflicts = conflicts.audit(self.department)
+        kinds = {(conflict.kind, conflict.first, conflict.second) for conflict in department_conflicts}
+
+        self.assertIn(("teacher", first, second), kinds)
+        self.assertIn(("group", first, third), kinds)
+        self.assertIn(("students", first, second), kinds)
+        self.assertEqual(len(department_conflicts), 4)
+
+        for conflict in department_conflicts:
+            if conflict.kind == "students":
+                self.assertEqual(conflict.students, {self.students[2].pk})
+
+    def test_check(self):
+        self._session(self.group_a, self.teacher, 0)
+
+        session = models.TeachingSession(
+            unit=self.unit, group=self.group_b, teacher=factories.FakeUserFactory(),
+            start=self.start + timedelta(hours=1), duration=timedelta(hours=1),
+        )
+        self.assertEqual([conflict.kind for conflict in conflicts.check([session])], ["students"])
+
+        session.start = self.start + timedelta(hours=2)
+        self.assertEqual(conflicts.check([session]), [])
+
+
+class TeachingSessionSeriesTestCase(PaltoTestCase):
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory()
+        self.students = [factories.FakeUserFactory() for _ in range(2)]
+        self.department = factories.FakeDepartmentFactory(teachers=[self.teacher], students=self.students)
+
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=self.students)
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.teacher])
+
+        self.start_date = timezone.localdate() + timedelta(days=1)
+        self.series = models.TeachingSessionSeries.objects.create(
+            weekday=self.start_date.weekday(),
+            time=time(hour=8),
+            duration=timedelta(hours=2),
+            start_date=self.start_date,
+            end_date=self.start_date + timedelta(weeks=9),
+            exclusions=[(self.start_date + timedelta(weeks=2)).isoformat()],
+            unit=self.unit,
+            group=self.group,
+            teacher=self.teacher,
+        )
+
+    def test_materialize(self):
+        sessions = series.materialize(self.series)
+
+        # one session per week, except the excluded one
+        self.assertEqual(len(sessions), 9)
+        self.assertEqual(self.series.sessions.count(), 9)
+        self.assertNotIn(
+            self.start_date + timedelta(weeks=2),
+            {timezone.localdate(session.start) for session in self.series.sessions.all()}
+        )
+
+    def test_materialize_conflict(self):
+        # the teacher already have a session during the third week
+        factories.FakeTeachingSessionFactory(
+            unit=self.unit, group=factories.FakeStudentGroupFactory(department=self.department), teacher=self.teacher,
+            start=self.series.occurrences()[3] + timedelta(hours=1), duration=timedelta(hours=1),
+        )
+
+        with self.assertRaises(ValidationError):
+            series.materialize(self.series)
+
+        self.assertEqual(self.series.sessions.count(), 0)
+
+    def test_regenerate(self):
+        series.materialize(self.series)
+
+        self.series.end_date = self.start_date + timedelta(weeks=4)
+        self.series.time = time(hour=14)
+        self.series.save()
+        series.regenerate(self.series)
+
+        sessions = list(self.series.sessions.all())
+        self.assertEqual(len(sessions), 4)
+        self.assertTrue(all(timezone.localtime(session.start).hour == 14 for session in sessions))
+
+    def test_shift(self):
+        series.materialize(self.series)
+
+        updated_at = self.series.updated_at
+        self.assertEqual(series.shift(self.series, timedelta(days=1, hours=1)), 9)
+
+        self.series.refresh_from_db()
+        self.assertGreater(self.series.updated_at, updated_at)
+        self.assertEqual(self.series.weekday, (self.start_date.weekday() + 1) % 7)
+        self.assertEqual(self.series.time, time(hour=9))
+        self.assertTrue(all(
+            timezone.localtime(session.start).hour == 9
+            for session in self.series.sessions.all()
+        ))
+
+        # the days of the series move with its sessions, so the next regeneration keeps them
+        self.assertEqual(self.series.start_date, self.start_date + timedelta(days=1))
+        self.assertEqual(self.series.exclusions, [(self.start_date + timedelta(weeks=2, days=1)).isoformat()])
+        sessions = set(self.series.sessions.values_list("pk", "start"))
+        series.regenerate(self.series)
+        self.assertEqual(set(self.series.sessions.values_list("pk", "start")), sessions)
+
+
+class AbsenceLinksTestCase(PaltoTestCase):
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory()
+        self.student = factories.FakeUserFactory()
+        self.department = factories.FakeDepartmentFactory(teachers=[self.teacher], students=[self.student])
+
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.student])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.teacher])
+
+        self.start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        self.absence = factories.FakeAbsenceFactory(
+            department=self.department, student=self.student,
+            start=self.start, end=self.start + timedelta(days=1),
+        )
+
+    def _session(self, group, hours: int) -> models.TeachingSession:
+        return factories.FakeTeachingSessionFactory(
+            unit=self.unit, group=group, teacher=self.teacher,
+            start=self.start + timedelta(hours=hours), duration=timedelta(hours=2),
+        )
+
+    def test_session_changes(self):
+        session = self._session(self.group, 2)
+        self.assertEqual(list(self.absence.related_sessions()), [session])
+
+        # moving the session after the absence remove the link
+        session.start += timedelta(days=2)
+        session.save()
+        self.assertFalse(self.absence.related_sessions().exists())
+
+    def test_absence_changes(self):
+        session = self._session(self.group, 30)
+        self.assertFalse(session.related_absences.exists())
+
+        self.absence.end += timedelta(days=1)
+        self.absence.save()
+        self.assertEqual(list(session.related_absences), [self.absence])
+
+    def test_group_changes(self):
+        other_group = factories.FakeStudentGroupFactory(department=self.department, students=[])
+        session = self._session(other_group, 2)
+        self.assertFalse(session.related_absences.exists())
+
+        other_group.students.add(self.student)
+        self.assertEqual(list(session.related_absences), [self.absence])
+
+        other_group.students.clear()
+        self.assertFalse(session.related_absences.exists())
+
+    def test_rebuild(self):
+        session = self._session(self.group, 2)
+        models.AbsenceSession.objects.all().delete()
+
+        output = io.StringIO()
+        call_command("palto_rebuild_absence_links", stdout=output)
+        self.assertIn("1 link(s)", output.getvalue())
+        self.assertEqual(list(self.absence.related_sessions()), [session])
+
+
+class PageFragmentsTestCase(PaltoTestCase):
+    def setUp(self):
+        self.manager = factories.FakeUserFactory()
+        self.teacher = factories.FakeUserFactory()
+        self.department = factories.FakeDepartmentFactory(managers=[self.manager], teachers=[self.teacher])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, teachers=[self.teacher])
+
+        self.client.force_login(self.manager)
+
+    def test_department_view(self):
+        url = f"/departments/view/{self.department.pk}/"
+
+        self.department.students.add(*(factories.FakeUserFactory() for _ in range(3)))
+
+        response = self.client.get(url)
+        self.assertEqual(response.context["department"].teachers_count, 1)
+        self.assertEqual(response.context["department"].students_count, self.department.students.count())
+
+        # the relations are cached, only the session, the user, the department and the permission are queried
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, str(self.teacher))
+
+        # adding a teacher change the version of the fragments
+        other_teacher = factories.FakeUserFactory()
+        self.department.teachers.add(other_teacher)
+        self.assertContains(self.client.get(url), str(other_teacher))
+
+    def test_teaching_unit_view(self):
+        factories.FakeTeachingSessionFactory(unit=self.unit, teacher=self.teacher)
+        url = f"/teaching_units/view/{self.unit.pk}/"
+
+        response = self.client.get(url)
+        self.assertEqual(response.context["unit"].sessions_count, 1)
+
+        self.teacher.last_name = "Renamed"
+        self.teacher.save()
+        self.assertContains(self.client.get(url), "RENAMED")
+
+        # a login doesn't look for the fragments of the user
+        with self.assertNumQueries(1):
+            self.teacher.save(update_fields=["last_login"])
+
+
+class ServerTimingTestCase(PaltoTestCase):
+    def setUp(self):
+        self.manager = factories.FakeUserFactory()
+        self.department = factories.FakeDepartmentFactory(managers=[self.manager])
+
+        self.client.force_login(self.manager)
+
+    @staticmethod
+    def _timings(response) -> dict[str, str]:
+        return dict(
+            (metric.split(";")[0].strip(), metric)
+            for metric in response["Server-Timing"].split(",")
+        )
+
+    def test_page(self):
+        with self.assertLogs("Palto.performance", "INFO") as logs:
+            response = self.client.get(f"/departments/view/{self.department.pk}/")
+
+        timings = self._timings(response)
+        self.assertEqual(set(timings), {"sql", "serializer", "template", "total"})
+        self.assertNotIn("template;dur=0.0", timings["template"])
+        self.assertNotIn('desc="0 queries"', timings["sql"])
+        self.assertIn(f"path=/departments/view/{self.department.pk}/ status=200", logs.output[0])
+
+    def test_serializer(self):
+        job = jobs.enqueue("Palto.Palto.tests.job_add", owner=self.manager, a=1, b=2)
+
+        with instrumentation.measure_request() as timings:
+            data = JobSerializer([job, job], many=True).data
+
+        self.assertEqual(len(data), 2)
+        self.assertGreater(timings.durations["serializer"], 0)
+        self.assertEqual(set(timings.durations), {"serializer"})
+
+    @test.override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_sampling(self):
+        response = self.client.get(f"/departments/view/{self.department.pk}/")
+        self.assertNotIn("Server-Timing", response)
+
+
+class MetricsTestCase(PaltoTestCase):
+    def setUp(self):
+        self.manager = factories.FakeUserFactory(is_staff=True)
+        self.department = factories.FakeDepartmentFactory(managers=[self.manager])
+
+        self.client.force_login(self.manager)
+
+    def _sample(self, name: str) -> float:
+        for line in self.client.get("/metrics/").content.decode().splitlines():
+            if line.startswith(f"{name} "):
+                return float(line.split(" ")[-1])
+        return 0.0
+
+    def test_requests(self):
+        name = 'palto_request_duration_seconds_count{method="GET",status="200",view="Palto:department_view"}'
+        before = self._sample(name)
+
+        self.client.get(f"/departments/view/{self.department.pk}/")
+
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE palto_request_queries histogram", response.content.decode())
+        self.assertEqual(self._sample(name), before + 1)
+
+    def test_sampling(self):
+        name = 'palto_request_duration_seconds_count{method="GET",status="200",view="Palto:department_view"}'
+        before = self._sample(name)
+
+        with test.override_settings(METRICS_SAMPLE_RATE=0):
+            self.client.get(f"/departments/view/{self.department.pk}/")
+        self.assertEqual(self._sample(name), before)
+
+    def test_permissions(self):
+        name = 'palto_permission_duration_seconds_count{model="Department",rule="visible"}'
+        before = self._sample(name)
+
+        self.assertTrue(self.department.is_visible_by_user(self.manager))
+        self.assertEqual(self._sample(name), before + 1)
+
+    def test_processes(self):
+        name = 'palto_scans_total{outcome="accepted"}'
+        before = self._sample(name)
+
+        with tempfile.TemporaryDirectory() as directory, test.override_settings(METRICS_DIRECTORY=directory):
+            # the file saved by another worker
+            with open(os.path.join(directory, "metrics-0.json"), "w") as file:
+                json.dump({"palto_scans": {json.dumps([["outcome", "accepted"]]): 3}}, file)
+
+            metrics.SCANS.inc(outcome="accepted")
+            self.assertEqual(self._sample(name), before + 4)
+            self.assertIn("# TYPE palto_scans_total counter", self.client.get("/metrics/").content.decode())
+
+            # the values of this process are saved for the other workers
+            metrics.flush(force=True)
+            self.assertTrue(os.path.exists(os.path.join(directory, f"metrics-{os.getpid()}.json")))
+
+    def test_staff(self):
+        # without token, the metrics are only readable by the staff
+        self.client.force_login(factories.FakeUserFactory())
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+
+    @test.override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        self.assertEqual(
+            self.client.get("/metrics/", headers={"Authorization": "Bearer secret"}).status_code, 200
+        )
+
+
+@test.override_settings(SLOW_QUERY_THRESHOLD_MS=0.000001)
+class SlowQueriesTestCase(PaltoTestCase):
+    def setUp(self):
+        self.manager = factories.FakeUserFactory(is_staff=True)
+        self.department = factories.FakeDepartmentFactory(managers=[self.manager])
+
+        self.client.force_login(self.manager)
+        slow_queries.reset()
+
+    def test_normalize(self):
+        self.assertEqual(
+            slow_queries.normalize("SELECT *\n FROM a WHERE b = 'c''d' AND e IN (%s, %s, 3) LIMIT 21"),
+            "SELECT * FROM a WHERE b = ? AND e IN (...) LIMIT ?",
+        )
+
+    def test_log(self):
+        with self.assertLogs("Palto.slow_queries", "WARNING") as logs:
+            self.client.get(f"/departments/view/{self.department.pk}/")
+        self.assertIn("view=Palto:department_view", logs.output[0])
+
+        queries = slow_queries.top()
+        self.assertTrue(queries)
+        self.assertTrue(any(query.explain for query in queries))
+        self.assertFalse(any(query.explain.startswith("unavailable") for query in queries))
+
+        with self.assertLogs("Palto.slow_queries", "WARNING"):
+            response = self.client.get("/slow_queries/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Palto:department_view")
+
+    @test.override_settings(SLOW_QUERY_TOP_SIZE=2)
+    def test_bounded(self):
+        with self.assertLogs("Palto.slow_queries", "WARNING"), slow_queries.watch("test"):
+            models.Department.objects.count()
+            models.TeachingUnit.objects.count()
+            models.StudentGroup.objects.count()
+            models.Department.objects.count()
+
+        self.assertEqual(len(slow_queries.top()), 2)
+        self.assertEqual(slow_queries.top()[0].view, "test")
+
+    @test.override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_staff_only(self):
+        self.client.force_login(factories.FakeUserFactory())
+        self.assertEqual(self.client.get("/slow_queries/").status_code, 302)
+
+
+class ScanStormTestCase(PaltoTestCase):
+    def test_seed(self):
+        dataset = palto_scan_storm.seed(sessions=2, students_per_session=3, teachers=1, students=1)
+
+        self.assertEqual(len(dataset.readers), 2)
+        session, token, cards = dataset.readers[0]
+        self.assertEqual(len(cards), 3)
+        device = models.ScannerDevice.objects.get(token_hash=models.ScannerDevice.hash_token(token))
+        self.assertEqual(device.department, dataset.department)
+
+        # the sessions of the simulated users are accepted
+        cookie, path = dataset.teachers[0]
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        self.assertEqual(self.client.get(path).status_code, 200)
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+
+        self.assertEqual(palto_scan_storm.percentile(values, 50), 50)
+        self.assertEqual(palto_scan_storm.percentile(values, 99), 99)
+        self.assertEqual(palto_scan_storm.percentile([1.0], 95), 1)
+
+
+class ArchiveTestCase(PaltoTestCase):
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory()
+        self.student = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(managers=[], teachers=[self.teacher], students=[self.student])
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.student])
+        self.unit = factories.FakeTeachingUnitFactory(department=self.department, managers=[], teachers=[])
+
+        self.year = archive.academic_year(timezone.now()) - 1
+        self.old_sessions = [
+            factories.FakeTeachingSessionFactory(
+                start=archive.academic_year_start(self.year) + timedelta(days=day),
+                unit=self.unit, group=self.group, teacher=self.teacher,
+            )
+            for day in range(3)
+        ]
+        self.attendance = factories.FakeAttendanceFactory(student=self.student, session=self.old_sessions[0])
+        self.current_session = factories.FakeTeachingSessionFactory(
+            start=archive.academic_year_start(self.year + 1) + timedelta(days=1),
+            unit=self.unit, group=self.group, teacher=self.teacher,
+        )
+
+    def test_academic_year(self):
+        start = archive.academic_year_start(self.year)
+
+        self.assertEqual(archive.academic_year(start), self.year)
+        self.assertEqual(archive.academic_year(start - timedelta(days=1)), self.year - 1)
+
+    def test_command(self):
+        call_command("palto_archive", year=self.year, batch_size=2, stdout=io.StringIO())
+
+        # only the sessions of the completed year are moved, with their attendances
+        self.assertQuerySetEqual(models.TeachingSession.objects.all(), [self.current_session])
+        self.assertEqual(models.ArchivedTeachingSession.objects.count(), 3)
+        self.assertFalse(models.Attendance.objects.exists())
+
+        archived = models.ArchivedTeachingSession.objects.get(pk=self.old_sessions[0].pk)
+        self.assertEqual(archived.academic_year, self.year)
+        self.assertEqual(archived.unit_name, self.unit.name)
+        self.assertEqual(archived.department, self.department)
+        self.assertQuerySetEqual(archived.attendances.values_list("student", flat=True), [self.student.pk])
+
+    def test_resume(self):
+        # an archival interrupted after the copy of a session but before its deletion
+        archive.archive_batch(archive.academic_year_start(self.year + 1), batch_size=1)
+        models.ArchivedTeachingSession.objects.create(
+            id=self.old_sessions[1].id, academic_year=self.year, start=self.old_sessions[1].start,
+            duration=self.old_sessions[1].duration, department=self.department,
+            unit_id=self.unit.id, unit_name=self.unit.name, group_id=self.group.id, group_name=self.group.name,
+        )
+
+        call_command("palto_archive", year=self.year, stdout=io.StringIO())
+
+        self.assertEqual(models.ArchivedTeachingSession.objects.count(), 3)
+        self.assertEqual(models.TeachingSession.objects.count(), 1)
+
+    def test_current_year(self):
+        with self.assertRaises(CommandError):
+            call_command("palto_archive", year=self.year + 1, stdout=io.StringIO())
+
+
+@test.override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PurgeTestCase(PaltoTestCase):
+    CONTENT: bytes = b"%PDF-1.4 medical certificate"
+
+    def setUp(self):
+        self.manager = factories.FakeUserFactory()
+        self.student = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[self.manager], teachers=[self.manager], students=[self.student]
+        )
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[self.student])
+        self.unit = factories.FakeTeachingUnitFactory(
+            department=self.department, managers=[self.manager], teachers=[], student_groups=[self.group]
+        )
+
+        self.old_session = factories.FakeTeachingSessionFactory(
+            start=timezone.now() - timedelta(days=800), unit=self.unit, group=self.group, teacher=self.manager
+        )
+        self.session = factories.FakeTeachingSessionFactory(
+            start=timezone.now(), unit=self.unit, group=self.group, teacher=self.manager
+        )
+        for session in (self.old_session, self.session):
+            factories.FakeAttendanceFactory(student=self.student, session=session)
+
+        self.absence = factories.FakeAbsenceFactory(
+            department=self.department, student=self.student, start=timezone.now(), end=timezone.now()
+        )
+        self.attachment = factories.FakeAbsenceAttachmentFactory(absence=self.absence, content__data=self.CONTENT)
+        models.StudentCard.objects.create(uid=b"\x01\x02\x03\x04", department=self.department, owner=self.student)
+        models.ScannerDevice.objects.create(name="reader", department=self.department)
+
+    def test_department(self):
+        # the same file is attached to an absence of another department
+        other = factories.FakeAbsenceAttachmentFactory(content__data=self.CONTENT)
+        path = self.attachment.content.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("palto_purge", department=str(self.department.pk), batch_size=1, stdout=io.StringIO())
+
+        self.assertFalse(models.Department.objects.filter(pk=self.department.pk).exists())
+        for model in (
+            models.StudentGroup, models.TeachingUnit, models.TeachingSession, models.Attendance,
+            models.StudentCard, models.ScannerDevice,
+        ):
+            self.assertFalse(model.objects.filter(pk__isnull=False).exists(), model)
+        self.assertQuerySetEqual(models.Absence.objects.all(), [other.absence])
+        # the users are kept
+        self.assertTrue(models.User.objects.filter(pk=self.student.pk).exists())
+
+        # the file is only removed once no other attachment uses it
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            list(purge.purge(department_id=other.absence.department_id))
+        self.assertFalse(os.path.exists(path))
+
+    def test_before(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = purge.run(before=(timezone.now() - timedelta(days=365)).isoformat())
+
+        self.assertEqual(counts, {"sessions": 1})
+        self.assertQuerySetEqual(models.TeachingSession.objects.all(), [self.session])
+        self.assertEqual(models.Attendance.objects.get().session, self.session)
+
+    def test_resume(self):
+        # a purge interrupted after its first batch
+        batches = purge.purge(department_id=self.department.pk, batch_size=1)
+        self.assertEqual(next(batches)[1:], ("sessions", 1))
+        batches.close()
+
+        list(purge.purge(department_id=self.department.pk))
+
+        self.assertFalse(models.Department.objects.filter(pk=self.department.pk).exists())
+        self.assertFalse(models.TeachingSession.objects.exists())
+
+
+class StudentImportTestCase(PaltoTestCase):
+    def setUp(self):
+        self.manager = factories.FakeUserFactory()
+        self.existing = factories.FakeUserFactory(username="existing")
+
+        # the names of the fake departments can contain commas
+        self.department = factories.FakeDepartmentFactory(
+            name="Sciences", managers=[self.manager], teachers=[], students=[]
+        )
+        self.group_a = factories.FakeStudentGroupFactory(name="A", department=self.department, students=[])
+        self.group_b = factories.FakeStudentGroupFactory(name="B", department=self.department, students=[])
+
+    def make_file(self, *rows: str) -> io.StringIO:
+        return io.StringIO("\n".join([",".join(imports.STUDENT_COLUMNS), *rows]) + "\n")
+
+    def test_import(self):
+        file = self.make_file(
+            f"new,Ada,Lovelace,ada@palto.invalid,0102030405,{self.department.name},A;B",
+            f"existing,Alan,Turing,,0a0b0c0d,{self.department.pk},",
+        )
+
+        with self.assertNumQueries(22):
+            report = imports.import_students(file, [self.department], batch_size=10)
+
+        self.assertEqual((report.created, report.updated, report.errors), (1, 1, {}))
+
+        student = models.User.objects.get(username="new")
+        self.assertEqual(student.email, "ada@palto.invalid")
+        self.assertFalse(student.has_usable_password())
+        self.assertEqual(set(student.student_groups.all()), {self.group_a, self.group_b})
+        self.assertEqual(bytes(student.student_cards.get().uid), bytes.fromhex("0102030405"))
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.last_name, "Turing")
+        self.assertQuerySetEqual(self.existing.studying_departments.all(), [self.department])
+
+        # importing the file again only updates the same rows
+        file.seek(0)
+        report = imports.import_students(file, [self.department])
+        self.assertEqual((report.created, report.updated), (0, 2))
+        self.assertEqual(models.StudentCard.objects.count(), 2)
+
+    def test_errors(self):
+        report = imports.import_students(self.make_file(
+            f"valid,,,,,{self.department.name},",
+            f"valid,,,,,{self.department.name},",
+            f"unknown,,,,,Unknown,",
+            f"card,,,,zz,{self.department.name},C",
+            f",,,not-an-email,,{self.department.name},",
+        ), [self.department])
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(set(report.errors), {3, 4, 5, 6})
+        self.assertEqual(len(report.errors[5]), 2)
+        self.assertEqual(len(report.errors[6]), 2)
+
+    def test_missing_columns(self):
+        with self.assertRaises(ValidationError):
+            imports.import_students(io.StringIO("username,email\nnew,new@palto.invalid\n"), [self.department])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as file:
+            file.write(self.make_file(f"new,,,,,{self.department.name},").getvalue())
+
+        stdout = io.StringIO()
+        call_command("palto_import_students", file.name, user=self.manager.username, stdout=stdout)
+        os.remove(file.name)
+
+        self.assertIn("1 student(s) created", stdout.getvalue())
+        self.assertTrue(self.department.students.filter(username="new").exists())
+
+
+class TimetableImportTestCase(PaltoTestCase):
+    CALENDAR: str = (
+        "BEGIN:VCALENDAR\r\n"
+        "VERSION:2.0\r\n"
+        "BEGIN:VEVENT\r\n"
+        "UID:first@planning\r\n"
+        "DTSTART:20300107T080000Z\r\n"
+        "DTEND:20300107T100000Z\r\n"
+        "SUMMARY:Algèbre (Group A)\r\n"
+        "DESCRIPTION:grace HOPPER - Room 12\\, first\r\n"
+        "  floor\r\n"
+        "BEGIN:VALARM\r\n"
+        "DESCRIPTION:Reminder\r\n"
+        "END:VALARM\r\n"
+        "END:VEVENT\r\n"
+        "BEGIN:VEVENT\r\n"
+        "UID:second@planning\r\n"
+        "DTSTART;TZID=Europe/Paris:{second_start}\r\n"
+        "DURATION:PT1H30M\r\n"
+        "SUMMARY:Algebre (Group B)\r\n"
+        "DESCRIPTION:ghopper\r\n"
+        "END:VEVENT\r\n"
+        "END:VCALENDAR\r\n"
+    )
+
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory(username="ghopper", first_name="Grace", last_name="Hopper")
+
+        self.department = factories.FakeDepartmentFactory(managers=[], teachers=[self.teacher], students=[])
+        self.unit = factories.FakeTeachingUnitFactory(
+            name="Algèbre", department=self.department, managers=[], teachers=[self.teacher]
+        )
+        self.group_a = factories.FakeStudentGroupFactory(name="Group A", department=self.department, students=[])
+        self.group_b = factories.FakeStudentGroupFactory(name="Group B", department=self.department, students=[])
+
+        # a session created by hand, never modified by the imports
+        self.manual_session = factories.FakeTeachingSessionFactory(
+            start=timezone.make_aware(datetime(2030, 1, 7, 12)),
+            unit=self.unit, group=self.group_a, teacher=self.teacher,
+        )
+
+    def calendar(self, second_start: str = "20300108T140000") -> io.StringIO:
+        return io.StringIO(self.CALENDAR.format(second_start=second_start), newline="")
+
+    def test_ics(self):
+        report = imports.import_timetable(self.calendar(), self.department)
+        self.assertEqual((report.created, report.updated, report.deleted, report.errors), (2, 0, 0, {}))
+
+        first = models.TeachingSession.objects.get(source_uid="first@planning")
+        self.assertEqual((first.unit, first.group, first.teacher), (self.unit, self.group_a, self.teacher))
+        self.assertEqual(first.duration, timedelta(hours=2))
+        self.assertEqual(first.note, "Room 12, first floor")
+
+        second = models.TeachingSession.objects.get(source_uid="second@planning")
+        self.assertEqual(second.start.isoformat(), "2030-01-08T13:00:00+00:00")
+        self.assertEqual(second.duration, timedelta(hours=1, minutes=30))
+
+        # importing the same timetable again only reads it
+        with self.assertNumQueries(4):
+            report = imports.import_timetable(self.calendar(), self.department)
+        self.assertEqual((report.created, report.updated, report.unchanged), (0, 0, 2))
+
+    def test_changes(self):
+        imports.import_timetable(self.calendar(), self.department)
+        second = models.TeachingSession.objects.get(source_uid="second@planning")
+        factories.FakeAttendanceFactory(session=second, student=self.teacher)
+
+        # the second event is moved, and the first removed from a timetable of the same period
+        calendar = self.CALENDAR.format(second_start="20300107T150000")
+        calendar = calendar[:calendar.index("BEGIN:VEVENT")] + calendar[calendar.index("END:VEVENT") + 12:]
+        report = imports.import_timetable(
+            io.StringIO(calendar, newline=""), self.department,
+            start=timezone.make_aware(datetime(2030, 1, 1)), end=timezone.make_aware(datetime(2030, 2, 1)),
+        )
+        self.assertEqual((report.created, report.updated, report.deleted), (0, 1, 1))
+
+        self.assertQuerySetEqual(
+            models.TeachingSession.objects.order_by("start"), [self.manual_session, second]
+        )
+        # the moved session keeps its attendances
+        self.assertEqual(models.Attendance.objects.get().session_id, second.pk)
+
+    def test_kept(self):
+        imports.import_timetable(self.calendar(), self.department)
+        first = models.TeachingSession.objects.get(source_uid="first@planning")
+        second = models.TeachingSession.objects.get(source_uid="second@planning")
+        factories.FakeAttendanceFactory(session=first, student=self.teacher)
+
+        # a partial timetable of a wide period never deletes the attended or started sessions
+        other = factories.FakeTeachingSessionFactory(
+            start=timezone.now() - timedelta(days=1), unit=self.unit, group=self.group_b, teacher=self.teacher
+        )
+        models.TeachingSession.objects.filter(pk=other.pk).update(source_uid="past@planning")
+
+        report = imports.import_timetable(
+            io.StringIO("BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", newline=""), self.department,
+            start=timezone.now() - timedelta(days=30), end=timezone.make_aware(datetime(2030, 2, 1)),
+        )
+        self.assertEqual((report.deleted, report.kept), (1, 2))
+        self.assertFalse(models.TeachingSession.objects.filter(pk=second.pk).exists())
+        self.assertEqual(models.Attendance.objects.get().session_id, first.pk)
+        self.assertTrue(models.TeachingSession.objects.filter(pk=other.pk).exists())
+
+    def test_csv(self):
+        self.department.teachers.add(factories.FakeUserFactory(first_name="Grace", last_name="Hopper"))
+
+        report = imports.import_timetable(io.StringIO(
+            "uid,start,end,unit,group,teacher,note\n"
+            "1,2030-01-07T08:00:00+00:00,2030-01-07T10:00:00+00:00,algebre,group a,ghopper,\n"
+            "2,2030-01-07T10:00:00+00:00,2030-01-07T09:00:00+00:00,Algèbre,Group A,ghopper,\n"
+            "3,2030-01-07T10:00:00+00:00,2030-01-07T12:00:00+00:00,Geometry,Group A,Grace Hopper,\n"
+            "1,2030-01-07T10:00:00+00:00,2030-01-07T12:00:00+00:00,Algèbre,Group A,ghopper,\n"
+        ), self.department, "csv")
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(set(report.errors), {3, 4, 5})
+        # the unit is unknown and the name of the teacher shared by two teachers
+        self.assertEqual(len(report.errors[4]), 2)
+
+
+class RosterBloomFilterTestCase(test.SimpleTestCase):
+    def test_bloom_filter(self):
+        values = [os.urandom(7) for _ in range(1000)]
+        bloom = rosters.bloom_filter(values, error_rate=0.01)
+
+        # the values are always found, the others rarely
+        self.assertTrue(all(rosters.bloom_contains(bloom, value) for value in values))
+        false_positives = sum(rosters.bloom_contains(bloom, os.urandom(8)) for _ in range(1000))
+        self.assertLess(false_positives, 50)
+
+        # the filter is about 10 bits by value for a 1% error rate
+        self.assertLess(bloom["size"], 1000 * 10)
+
+
+class UserSearchTestCase(PaltoTestCase):
+    def setUp(self):
+        self.student = factories.FakeUserFactory(
+            username="jdupont", first_name="Jérôme", last_name="Dupont-Aignan", email="jerome.dupont@palto.invalid"
+        )
+        self.other = factories.FakeUserFactory(username="amartin", first_name="Alice", last_name="Martin")
+
+    def test_tokens(self):
+        self.assertEqual(
+            set(self.student.search_tokens.values_list("token", flat=True)),
+            {"jdupont", "jerome", "dupont", "aignan", "palto", "invalid"},
+        )
+
+    def test_filter(self):
+        users = models.User.objects.all()
+
+        self.assertQuerySetEqual(search.filter_users(users, "dup"), [self.student])
+        self.assertQuerySetEqual(search.filter_users(users, "JER dupo"), [self.student])
+        self.assertQuerySetEqual(search.filter_users(users, "jerome martin"), [])
+        self.assertQuerySetEqual(search.filter_users(users, "  "), [])
+
+    def test_update(self):
+        self.student.last_name = "Durand"
+        self.student.save()
+
+        users = models.User.objects.all()
+        self.assertQuerySetEqual(search.filter_users(users, "durand"), [self.student])
+        self.assertQuerySetEqual(search.filter_users(users, "aignan"), [])
+
+        # the logins don't change the tokens
+        with CaptureQueriesContext(connection) as queries:
+            self.student.save(update_fields=["last_login"])
+        self.assertFalse(any("Palto_usersearchtoken" in query["sql"] for query in queries.captured_queries))
+
+    def test_admin(self):
+        admin = factories.FakeUserFactory(is_superuser=True, is_staff=True)
+        self.client.force_login(admin)
+        department = factories.FakeDepartmentFactory(managers=[], teachers=[], students=[])
+        card = models.StudentCard.objects.create(uid=b"\x01\x02\x03\x04", department=department, owner=self.student)
+
+        response = self.client.get("/admin/Palto/user/", data={"q": "dupont"})
+        self.assertEqual(list(response.context["cl"].result_list), [self.student])
+
+        response = self.client.get("/admin/Palto/studentcard/", data={"q": "jerome"})
+        self.assertEqual(list(response.context["cl"].result_list), [card])
+
+        response = self.client.get("/admin/Palto/studentcard/", data={"q": str(card.pk)})
+        self.assertEqual(list(response.context["cl"].result_list), [card])
+
+
+@test.override_settings(CHANGES_SETTLE_SECONDS=0)
+class ChangesTestCase(PaltoTestCase):
+    def setUp(self):
+        self.teacher = factories.FakeUserFactory()
+        self.student = factories.FakeUserFactory()
+
+        self.department = factories.FakeDepartmentFactory(
+            managers=[], teachers=[self.teacher], students=[self.student]
+        )
+        self.group = factories.FakeStudentGroupFactory(department=self.department, students=[])
+        self.unit = factories.FakeTeachingUnitFactory(
+            department=self.department, managers=[], teachers=[self.teacher], student_groups=[self.group]
+        )
+        self.session = factories.FakeTeachingSessionFactory(unit=self.unit, group=self.group, teacher=self.teacher)
+        self.attendance = factories.FakeAttendanceFactory(student=self.student, session=self.session)
+
+    def test_tombstones(self):
+        session_id, attendance_id = self.session.pk, self.attendance.pk
+
+        # the attendances are deleted with their session
+        self.session.delete()
+
+        tombstones = models.Tombstone.objects.order_by("model")
+        self.assertEqual(
+            [(tombstone.model, tombstone.object_id, tombstone.department_id) for tombstone in tombstones],
+            [
+                ("Palto.attendance", attendance_id, self.department.pk),
+                ("Palto.teachingsession", session_id, self.department.pk),
+            ],
+        )
+
+    def test_purge(self):
+        list(purge.purge(department_id=self.department.pk))
+
+        self.assertEqual(
+            set(models.Tombstone.objects.values_list("model", "object_id")),
+            {
+                ("Palto.attendance", self.attendance.pk),
+                ("Palto.teachingsession", self.session.pk),
+                ("Palto.studentgroup", self.group.pk),
+                ("Palto.teachingunit", self.unit.pk),
+                ("Palto.department", self.department.pk),
+            },
+        )
+
+        # the members of the department are kept to give them its tombstones
+        self.assertEqual(
+            set(models.FormerMember.objects.values_list("user_id", "department_id")),
+            {(self.teacher.pk, self.department.pk), (self.student.pk, self.department.pk)},
+        )
+
+        # the expired tombstones are deleted by the next purges
+        expired = timezone.now() - timedelta(days=settings.TOMBSTONE_RETENTION_DAYS + 1)
+        models.Tombstone.objects.update(deleted_at=expired)
+        models.FormerMember.objects.update(deleted_at=expired)
+        list(purge.purge(before=timezone.now()))
+        self.assertFalse(models.Tombstone.objects.exists())
+        self.assertFalse(models.FormerMember.objects.exists())
+
+    def test_deleted_department(self):
+        other = factories.FakeUserFactory()
+        department_id = self.department.pk
+        self.department.delete()
+
+        # only the former members of the department are given its tombstones
+        for user, visible in ((self.teacher, True), (self.student, True), (other, False)):
+            self.assertEqual(
+                changes.visible_tombstones(models.Department, user).filter(object_id=department_id).exists(), visible
+            )
+
+    def test_members(self):
+        updated_at = self.group.updated_at
+
+        # the students are part of the group, written in the shard of the group
+        with sharding.object_scope(self.group):
+            self.student.student_groups.add(self.group)
+
+        self.group.refresh_from_db()
+        self.assertGreater(self.group.updated_at, updated_at)
+
+    def test_feed(self):
+        since = (self.session.updated_at, str(self.session.pk))
+
+        self.session.note = "moved"
+        self.session.save()
+        models.Attendance.objects.get(pk=self.attendance.pk).delete()
+
+        results, more = changes.feed(models.Attendance.all_visible_by_user(self.teacher), self.teacher, since)
+        self.assertEqual([(change.id, change.change) for change in results], [(str(self.attendance.pk), "deleted")])
+        self.assertFalse(more)
+
+        sessions = models.TeachingSession.all_visible_by_user(self.teacher)
+        results, _ = changes.feed(sessions, self.teacher, since)
+        self.assertEqual([(change.id, change.change) for change in results], [(str(self.session.pk), "updated")])
+
+        # the next changes start after the cursor
+        cursor = changes.decode_cursor(results[-1].cursor)
+        self.assertEqual(changes.feed(sessions, self.teacher, cursor), ([], False))
+
+    def test_settle(self):
+        since = (self.session.updated_at, str(self.session.pk))
+        self.session.save()
+
+        # the recent changes might be followed by older changes not committed yet
+        sessions = models.TeachingSession.all_visible_by_user(self.teacher)
+        with self.settings(CHANGES_SETTLE_SECONDS=60):
+            self.assertEqual(changes.feed(sessions, self.teacher, since), ([], False))
+        self.assertEqual(len(changes.feed(sessions, self.teacher, since)[0]), 1)
+
+
+class CountsTestCase(PaltoTestCase):
+    def setUp(self):
+        cache.clear()
+        self.departments = [
+            models.Department.objects.create(name=f"Department {index}", email=f"department{index}@palto.invalid")
+            for index in range(5)
+        ]
+
+    def test_cached_count(self):
+        queryset = models.Department.objects.order_by("name")
+        self.assertEqual(counts.count(queryset, user_id=1), (5, False))
+
+        # the exact count is cached for a short time, by user
+        models.Department.objects.create(name="Department 5", email="department5@palto.invalid")
+        with self.assertNumQueries(0):
+            self.assertEqual(counts.count(queryset, user_id=1), (5, False))
+        self.assertEqual(counts.count(queryset, user_id=2), (6, False))
+
+    def test_estimated_count(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("The database can't estimate the counts.")
+
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=-1):
+            paginator = counts.EstimatedCountPaginator(models.Department.objects.order_by("name"), 2)
+            self.assertGreaterEqual(paginator.count, 0)
+            self.assertTrue(paginator.estimated)
+
+    def test_uncounted_paginator(self):
+        paginator = counts.UncountedPaginator(models.Department.objects.order_by("name"), 2)
+
+        # every page is read with a single query, without counting the objects
+        with self.assertNumQueries(1):
+            page = paginator.page(1)
+        self.assertEqual(list(page), self.departments[:2])
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+        page = paginator.page(3)
+        self.assertEqual(list(page), self.departments[4:])
+        self.assertFalse(page.has_next())
+        self.assertEqual(page.previous_page_number(), 2)
+
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+        self.assertEqual(paginator.get_page("invalid").number, 1)
+
+    def test_admin(self):
+        admin = factories.FakeUserFactory(is_superuser=True, is_staff=True)
+        self.client.force_login(admin)
+
+        response = self.client.get("/admin/Palto/teachingsession/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.context["cl"].paginator, counts.EstimatedCountPaginator)
+
+
+class ShardingTestCase(PaltoTestCase):
+    # only run with real shards, for example with DATABASE_SHARDS="shard1.sqlite3 shard2.sqlite3"
+    databases = "__all__"
+
+    def setUp(self):
+        if len(settings.DATABASE_SHARDS) < 2:
+            self.skipTest("Less than two shards configured.")
+
+        self.admin = factories.FakeUserFactory(is_superuser=True)
+        self.manager = factories.FakeUserFactory()
+        self.student = factories.FakeUserFactory()
+
+        # create departments until two of them are in different shards
+        self.departments = {}
+        while len(self.departments) < 2:
+            department = factories.FakeDepartmentFactory(managers=[self.manager], teachers=[], students=[self.student])
+            self.departments.setdefault(sharding.shard_for_department(department.pk), department)
+        (self.shard, self.department), (self.other_shard, self.other_department) = self.departments.items()
+
+    def test_rows_in_shard(self):
+        group = factories.FakeStudentGroupFactory(department=self.department, owner=self.manager, students=[])
+        unit = factories.FakeTeachingUnitFactory(department=self.department, managers=[], teachers=[])
+        session = factories.FakeTeachingSessionFactory(unit=unit, group=group, teacher=self.manager)
+        group.students.add(self.student)
+
+        for model, pk in ((models.StudentGroup, group.pk), (models.TeachingSession, session.pk)):
+            self.assertTrue(model.objects.using(self.shard).filter(pk=pk).exists())
+            self.assertFalse(model.objects.using(self.other_shard).filter(pk=pk).exists())
+            self.assertFalse(model.objects.using("default").filter(pk=pk).exists())
+
+        self.assertTrue(group.students.filter(pk=self.student.pk).exists())
+
+    def test_scan(self):
+        group = factories.FakeStudentGroupFactory(department=self.department, owner=self.manager, students=[self.student])
+        unit = factories.FakeTeachingUnitFactory(department=self.department, managers=[], teachers=[])
+        session = factories.FakeTeachingSessionFactory(unit=unit, group=group, teacher=self.manager)
+        models.StudentCard.objects.create(uid=b"\x01\x02\x03\x04", department=self.department, owner=self.student)
+        device = models.ScannerDevice(name="reader", department=self.department)
+        token = device.reset_token()
+        device.save()
+
+        # the device and the attendance are found in the shard of the department
+        response = self.client.post(
+            "/api/v1/scans/", data={"card": "01020304", "session": str(session.pk)},
+            content_type="application/json", headers={"Authorization": f"Device {token}"},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(models.Attendance.objects.using(self.shard).filter(session=session).exists())
+
+    def test_users_mirrored(self):
+        for alias in settings.DATABASE_SHARDS:
+            self.assertTrue(models.User.objects.using(alias).filter(pk=self.student.pk).exists())
+
+        self.student.delete()
+        for alias in settings.DATABASE_SHARDS:
+            self.assertFalse(models.User.objects.using(alias).filter(pk=self.student.pk).exists())
+
+    def test_roles(self):
+        roles = models.User.objects.get(pk=self.manager.pk).roles
+        self.assertLessEqual({self.department.pk, self.other_department.pk}, roles.managing_departments)
+
+    def test_request_scope(self):
+        self.client.force_login(self.manager)
+
+        response = self.client.get(f"/departments/view/{self.department.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(f"/api/v1/departments/{self.other_department.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_fan_out(self):
+        self.client.force_login(self.admin)
+
+        # the departments of all the shards are listed in their order
+        response = self.client.get("/api/v1/departments/")
+        ids = [department["id"] for department in response.json()["results"]]
+        self.assertIn(str(self.department.pk), ids)
+        self.assertIn(str(self.other_department.pk), ids)
+        self.assertEqual(ids, sorted(ids, key=uuid.UUID))
+
+        # with a department, only its shard is queried
+        response = self.client.get("/api/v1/departments/", headers={"X-Palto-Department": str(self.department.pk)})
+        ids = [department["id"] for department in response.json()["results"]]
+        self.assertIn(str(self.department.pk), ids)
+        self.assertNotIn(str(self.other_department.pk), ids)
+
+    def test_fan_out_pages(self):
+        for index in range(6):
+            factories.FakeDepartmentFactory(managers=[], teachers=[], students=[])
+        departments = models.Department.objects.order_by("-name")
+        expected = sorted(chain.from_iterable(sharding.each(departments)), key=lambda department: department.name)[::-1]
+
+        # a page only reads the first rows of every shard
+        results = sharding.fan_out(departments)
+        self.assertEqual(results[2:5], expected[2:5])
+        self.assertEqual(list(results), expected)
+        self.assertEqual(counts.count(results), (len(expected), False))
+
+    def test_calendar_feed(self):
+        # the student has sessions in the shards of both departments
+        sessions = []
+        for days, department in enumerate((self.other_department, self.department), start=1):
+            group = factories.FakeStudentGroupFactory(department=department, owner=self.manager, students=[self.student])
+            unit = factories.FakeTeachingUnitFactory(department=department, managers=[], teachers=[])
+            sessions.append(factories.FakeTeachingSessionFactory(
+                unit=unit, group=group, teacher=self.manager, start=timezone.now() + timedelta(days=days),
+            ))
+
+        # the feed merges the sessions of every shard by their start
+        response = self.client.get(f"/calendar/{ical.make_token(self.student.id)}.ics")
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content).decode()
+        positions = [body.find(f"UID:{session.id}@palto") for session in sessions]
+        self.assertTrue(all(position >= 0 for position in positions))
+        self.assertEqual(positions, sorted(positions))
+
+    def test_search(self):
+        # the manager sees the students of the departments of both shards, but not the unrelated users
+        students = [
+            factories.FakeUserFactory(first_name="Jérôme", last_name=last_name)
+            for last_name in ("Dupond", "Dupont", "Durand")
+        ]
+        self.department.students.add(students[0])
+        self.other_department.students.add(students[1])
+
+        self.client.force_login(self.manager)
+        response = self.client.get("/api/v1/users/search/", data={"q": "jer du"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user["id"] for user in response.json()], [str(student.pk) for student in students[:2]])
+
+    def test_directory(self):
+        # the departments stay in their shard when the shards change
+        cache.clear()
+        with self.settings(DATABASE_SHARDS=settings.DATABASE_SHARDS[::-1]):
+            self.assertEqual(sharding.shard_for_department(self.department.pk), self.shard)
+            self.assertEqual(sharding.shard_for_department(self.other_department.pk), self.other_shard)
+
+        # the departments of an existing database are recorded by a command
+        models.DepartmentShard.objects.all().delete()
+        call_command("palto_record_departments", stdout=io.StringIO())
+        self.assertEqual(models.DepartmentShard.objects.get(pk=self.department.pk).alias, self.shard)
+
+        # the deleted departments are removed from the directory
+        models.Department.objects.get(pk=self.other_department.pk).delete()
+        self.assertFalse(models.DepartmentShard.objects.filter(pk=self.other_department.pk).exists())
+
+    def test_unique_name(self):
+        self.client.force_login(self.admin)
+
+        # the name of a department of another shard is refused, even in the shard of the request
+        response = self.client.patch(
+            f"/api/v1/departments/{self.other_department.pk}/", data={"name": self.department.name},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.other_department.name = self.department.name
+        with sharding.shard_scope(self.other_shard):
+            with self.assertRaises(ValidationError):
+                self.other_department.full_clean()
+            with self.assertRaises(IntegrityError):
+                self.other_department.save()
+
+    def test_department_header_write(self):
+        self.client.force_login(self.admin)
+
+        # the object of the url is modified in its own shard, whatever the department given
+        response = self.client.patch(
+            f"/api/v1/departments/{self.department.pk}/", data={"email": "moved@palto.invalid"},
+            content_type="application/json", headers={"X-Palto-Department": str(self.other_department.pk)},
+        )
+        self.assertEqual(response.status_code, 200)
+        department = models.Department.objects.using(self.shard).get(pk=self.department.pk)
+        self.assertEqual(department.email, "moved@palto.invalid")
@@ -32,8 +32,20 @@ urlpatterns = [
     path("teaching_sessions/", views.teaching_session_list_view, name="teaching_session_list"),
     path("teaching_sessions/view/<uuid:session_id>/", views.teaching_session_view, name="teaching_session_view"),
 
+    # Calendar
+    path("calendar/<str:token>.ics", views.calendar_feed_view, name="calendar_feed"),
+
     # Absences
     path("absences/", views.absence_list_view, name="absence_list"),
     path("absences/view/<uuid:absence_id>/", views.absence_view, name="absence_view"),
     path("absences/new/", views.new_absence_view, name="absence_new"),
+    path(
+        "absences/attachments/<uuid:attachment_id>/download/",
+        views.absence_attachment_download_view,
+        name="absence_attachment_download"
+    ),
+
+    # Metrics
+    path("metrics/", views.metrics_view, name="metrics"),
+    path("slow_queries/", views.slow_queries_view, name="slow_queries"),
 ]
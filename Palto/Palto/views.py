@@ -3,16 +3,22 @@ Views for the Palto project.
 
 A view is what control the content of a page, prepare the correct data, react to a form, render the correct template.
 """
+import secrets
 import uuid
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.core import signing
 from django.core.handlers.wsgi import WSGIRequest
-from django.core.paginator import Paginator
-from django.http import HttpResponseForbidden
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import HttpResponseForbidden, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.http import parse_etags
 
-from Palto.Palto import models, forms
-from Palto.Palto.utils import get_object_or_none
+from Palto.Palto import models, forms, counts, fragments, ical, metrics, routers, sharding, slow_queries
+from Palto.Palto.sendfile import sendfile
 
 ELEMENT_PER_PAGE: int = 30
 
@@ -90,6 +96,9 @@ def profile_view(request: WSGIRequest, profile_id: uuid.UUID = None):
         for department in profile.related_departments
     }
 
+    # the calendar feed is private, only show it to its owner
+    calendar_token = ical.make_token(profile.id) if profile == request.user else None
+
     # render the page
     return render(
         request,
@@ -97,16 +106,19 @@ def profile_view(request: WSGIRequest, profile_id: uuid.UUID = None):
         context=dict(
             profile=profile,
             profile_departments_data=profile_departments_data,
+            calendar_token=calendar_token,
         )
     )
 
 
 @login_required
+@routers.use_replica()
 def teaching_session_list_view(request: WSGIRequest):
     # get all the sessions that the user can see, sorted by starting date
-    raw_sessions = models.TeachingSession.all_visible_by_user(request.user).order_by("start")
-    # paginate them to avoid having too many elements at the same time
-    paginator = Paginator(raw_sessions, ELEMENT_PER_PAGE)
+    raw_sessions = sharding.fan_out(models.TeachingSession.all_visible_by_user(request.user).order_by("start"))
+    # paginate them to avoid having too many elements at the same time, without counting them since the pages are
+    # browsed one after the other
+    paginator = counts.UncountedPaginator(raw_sessions, ELEMENT_PER_PAGE)
 
     # get only the session for the requested page
     page = request.GET.get("page", 0)
@@ -122,9 +134,36 @@ def teaching_session_list_view(request: WSGIRequest):
     )
 
 
+def calendar_feed_view(request: WSGIRequest, token: str):
+    # the calendar applications can't log in, the user is identified by the token of the feed
+    try:
+        user_id = ical.user_id_from_token(token)
+    except (signing.BadSignature, ValueError):
+        raise Http404()
+
+    # if the client already have the current version of the feed, don't send it again
+    etag = f'"{ical.get_version(user_id)}"'
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        version = etag.strip('"')
+        body = ical.get_cached_body(user_id, version)
+
+        if body is not None:
+            response = HttpResponse(body, content_type="text/calendar; charset=utf-8")
+        else:
+            response = StreamingHttpResponse(ical.stream(user_id, version), content_type="text/calendar; charset=utf-8")
+
+    response["ETag"] = etag
+    return response
+
+
 @login_required
 def teaching_unit_view(request: WSGIRequest, unit_id: uuid.UUID):
-    unit = get_object_or_404(models.TeachingUnit, id=unit_id)
+    unit = get_object_or_404(
+        models.TeachingUnit.objects.select_related("department").annotate(sessions_count=Count("sessions")),
+        id=unit_id
+    )
 
     # check if the user is allowed to see this specific object
     if not unit.is_visible_by_user(request.user):
@@ -136,6 +175,8 @@ def teaching_unit_view(request: WSGIRequest, unit_id: uuid.UUID):
         "Palto/teaching_unit_view.html",
         context=dict(
             unit=unit,
+            fragments_version=fragments.get_version("unit", unit.pk),
+            fragments_timeout=settings.FRAGMENT_CACHE_TIMEOUT,
         )
     )
 
@@ -148,11 +189,14 @@ def teaching_session_view(request: WSGIRequest, session_id: uuid.UUID):
     if not session.is_visible_by_user(request.user):
         return HttpResponseForbidden()
 
-    # prepare the data and the "complex" query for the template
+    # prepare the data for the template, the attendances and the absences are fetched at once for all the students
+    attendances = {attendance.student_id: attendance for attendance in session.attendances.all()}
+    absences = {absence.student_id: absence for absence in session.related_absences}
+
     session_students_data = {
         student: {
-            "attendance": get_object_or_none(models.Attendance.objects, session=session, student=student),
-            "absence": get_object_or_none(session.related_absences, student=student)
+            "attendance": attendances.get(student.pk),
+            "absence": absences.get(student.pk),
         }
 
         for student in session.group.students.all()
@@ -187,6 +231,18 @@ def absence_view(request: WSGIRequest, absence_id: uuid.UUID):
     )
 
 
+@login_required
+def absence_attachment_download_view(request: WSGIRequest, attachment_id: uuid.UUID):
+    attachment = get_object_or_404(models.AbsenceAttachment, id=attachment_id)
+
+    # check if the user is allowed to see this specific object
+    if not attachment.is_visible_by_user(request.user):
+        return HttpResponseForbidden()
+
+    # send the file, by the front web server if possible
+    return sendfile(request, attachment.content.storage, attachment.content.name, attachment.filename or None)
+
+
 @login_required
 def new_absence_view(request: WSGIRequest):
     # check if the user can create an absence
@@ -197,8 +253,6 @@ def new_absence_view(request: WSGIRequest):
     form_new_absence = forms.NewAbsenceForm(request.user, request.POST, request.FILES)
 
     if form_new_absence.is_valid():
-        print(form_new_absence.files, form_new_absence.cleaned_data)
-
         absence, is_created = models.Absence.objects.get_or_create(
             student=request.user,
             start=form_new_absence.cleaned_data["start"],
@@ -213,10 +267,7 @@ def new_absence_view(request: WSGIRequest):
 
         else:
             # add the attachments files to the absence
-            for file in form_new_absence.cleaned_data["attachments"]:
-                absence.attachments.create(
-                    content=file
-                )
+            models.AbsenceAttachment.bulk_create_from_files(absence, form_new_absence.cleaned_data["attachments"])
 
             return redirect("Palto:absence_list")
 
@@ -230,11 +281,13 @@ def new_absence_view(request: WSGIRequest):
     )
 
 
+@routers.use_replica()
 def absence_list_view(request):
     # get all the absences that the user can see, sorted by starting date
-    raw_absences = models.Absence.all_visible_by_user(request.user).order_by("start")
-    # paginate them to avoid having too many elements at the same time
-    paginator = Paginator(raw_absences, ELEMENT_PER_PAGE)
+    raw_absences = sharding.fan_out(models.Absence.all_visible_by_user(request.user).order_by("start"))
+    # paginate them to avoid having too many elements at the same time, without counting them since the pages are
+    # browsed one after the other
+    paginator = counts.UncountedPaginator(raw_absences, ELEMENT_PER_PAGE)
 
     # get only the session for the requested page
     page = request.GET.get("page", 0)
@@ -250,9 +303,24 @@ def absence_list_view(request):
     )
 
 
+def _members_count(through) -> Coalesce:
+    # a subquery by relation, joining both relations would count the teachers times the students
+    return Coalesce(Subquery(
+        through.objects.filter(department_id=OuterRef("pk")).order_by().values("department_id").annotate(
+            count=Count("pk")
+        ).values("count")
+    ), 0)
+
+
 @login_required
 def department_view(request: WSGIRequest, department_id: uuid.UUID):
-    department = get_object_or_404(models.Department, id=department_id)
+    department = get_object_or_404(
+        models.Department.objects.annotate(
+            teachers_count=_members_count(models.Department.teachers.through),
+            students_count=_members_count(models.Department.students.through),
+        ),
+        id=department_id
+    )
 
     # check if the user is allowed to see this specific object
     if not department.is_visible_by_user(request.user):
@@ -264,6 +332,8 @@ def department_view(request: WSGIRequest, department_id: uuid.UUID):
         "Palto/department_view.html",
         context=dict(
             department=department,
+            fragments_version=fragments.get_version("department", department.pk),
+            fragments_timeout=settings.FRAGMENT_CACHE_TIMEOUT,
         )
     )
 
@@ -284,3 +354,31 @@ def student_group_view(request: WSGIRequest, group_id: uuid.UUID):
             group=group,
         )
     )
+
+
+def metrics_view(request: WSGIRequest):
+    if settings.METRICS_TOKEN:
+        # if a token is configured, only the scrapers knowing it can read the metrics
+        if not secrets.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            return HttpResponseForbidden()
+
+    elif not request.user.is_staff:
+        # without token, only the staff can read the metrics
+        return HttpResponseForbidden()
+
+    return HttpResponse(metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@staff_member_required
+def slow_queries_view(request: WSGIRequest):
+    # render the slowest queries recorded by the process answering the request
+    return render(
+        request,
+        "Palto/slow_queries.html",
+        context=dict(
+            queries=slow_queries.top(),
+            threshold=settings.SLOW_QUERY_THRESHOLD_MS,
+        )
+    )
@@ -55,8 +55,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Palto.Palto.middleware.MetricsMiddleware',
+    'Palto.Palto.middleware.ServerTimingMiddleware',
+    'Palto.Palto.middleware.SlowQueryMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'corsheaders.middleware.CorsMiddleware',
+    'Palto.Palto.middleware.DatabaseRoutingMiddleware',
+    'Palto.Palto.middleware.DepartmentShardMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,7 +75,8 @@ ROOT_URLCONF = 'Palto.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # same as the Django templates backend, but measure the rendering time for the Server-Timing header
+        'BACKEND': 'Palto.Palto.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -86,6 +92,14 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Palto.wsgi.application'
 
+# Proportion of the requests measured for the Server-Timing header and the "Palto.performance" logger (0 to 1)
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv("SERVER_TIMING_SAMPLE_RATE", "1.0"))
+
+# Duration above which a query is logged in the "Palto.slow_queries" logger with its plan, in milliseconds (0 to disable)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "0"))
+# Number of different slow queries kept by every process for the slow queries page
+SLOW_QUERY_TOP_SIZE = int(os.getenv("SLOW_QUERY_TOP_SIZE", "50"))
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -115,6 +129,109 @@ _DATABASES = {
 
 DATABASES = {"default": _DATABASES[os.getenv("DATABASE_ENGINE", "sqlite")]}
 
+# Read replicas
+# The replicas are defined as a space separated list in the "DATABASE_REPLICAS" environment variable.
+# With sqlite, every entry is a filename. With the other engines, every entry is "host[:port][/name]" and
+# reuse the credentials of the primary database.
+
+DATABASE_REPLICAS: list[str] = []
+
+for _replica_index, _replica_location in enumerate(os.getenv("DATABASE_REPLICAS", "").split()):
+    _replica = DATABASES["default"].copy()
+
+    if _replica["ENGINE"] == "django.db.backends.sqlite3":
+        _replica["NAME"] = BASE_DIR / _replica_location
+    else:
+        _replica_address, _, _replica_name = _replica_location.partition("/")
+        _replica_host, _, _replica_port = _replica_address.partition(":")
+
+        _replica["HOST"] = _replica_host
+        _replica["PORT"] = _replica_port or _replica["PORT"]
+        _replica["NAME"] = _replica_name or _replica["NAME"]
+
+    # during the tests, the replicas are only a view of the primary database
+    _replica["TEST"] = {"MIRROR": "default"}
+
+    DATABASES[f"replica{_replica_index + 1}"] = _replica
+    DATABASE_REPLICAS.append(f"replica{_replica_index + 1}")
+
+# Shards
+# The shards are defined as a space separated list in the "DATABASE_SHARDS" environment variable, with the same format
+# as the replicas. Every department, with all its rows, is stored in one of the shards, while the default database keeps
+# the users, the jobs and the sessions. Every shard must be migrated with "migrate --database shardN".
+
+DATABASE_SHARDS: list[str] = []
+
+for _shard_index, _shard_location in enumerate(os.getenv("DATABASE_SHARDS", "").split()):
+    _shard = DATABASES["default"].copy()
+
+    if _shard["ENGINE"] == "django.db.backends.sqlite3":
+        _shard["NAME"] = BASE_DIR / _shard_location
+    else:
+        _shard_address, _, _shard_name = _shard_location.partition("/")
+        _shard_host, _, _shard_port = _shard_address.partition(":")
+
+        _shard["HOST"] = _shard_host
+        _shard["PORT"] = _shard_port or _shard["PORT"]
+        _shard["NAME"] = _shard_name or _shard["NAME"]
+
+    DATABASES[f"shard{_shard_index + 1}"] = _shard
+    DATABASE_SHARDS.append(f"shard{_shard_index + 1}")
+
+# Connections lifecycle
+# "close": a new connection is opened for every request.
+# "persistent": the connections are kept open between requests and checked before being reused.
+# "pool": the connections are shared in a pool handled by the database backend (postgres only, otherwise persistent).
+# The persistent connections are useless with the development server since it creates a thread for every request.
+
+DATABASE_CONNECTION_MODE = os.getenv("DATABASE_CONNECTION_MODE", "close")
+
+for _database in DATABASES.values():
+    _database["OPTIONS"] = dict(_database.get("OPTIONS", {}))
+
+    if DATABASE_CONNECTION_MODE == "pool" and _database["ENGINE"] == "django.db.backends.postgresql":
+        # the pool keeps the connections alive by itself
+        _database["CONN_MAX_AGE"] = 0
+        _database["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DATABASE_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+            "timeout": int(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+        }
+
+    elif DATABASE_CONNECTION_MODE in ("persistent", "pool"):
+        _database["CONN_MAX_AGE"] = int(os.getenv("DATABASE_CONN_MAX_AGE", "600"))
+        _database["CONN_HEALTH_CHECKS"] = True
+
+    else:
+        _database["CONN_MAX_AGE"] = 0
+
+# Route the rows of the departments to their shard, then the safe requests and the reports to the replicas
+DATABASE_ROUTERS = ["Palto.Palto.routers.DepartmentShardRouter", "Palto.Palto.routers.PrimaryReplicaRouter"]
+
+# Duration during which a client is kept on the primary database after a write, to hide the replication lag
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", "5"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The cache should be shared by all the workers (file or redis) for the invalidations to be visible by all of them.
+
+_CACHES = {
+    "locmem": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "file": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / os.getenv("CACHE_FILE_DIRECTORY", "cache/"),
+    },
+    "redis": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("CACHE_REDIS_URL", "redis://localhost:6379"),
+    },
+}
+
+CACHES = {"default": _CACHES[os.getenv("CACHE_ENGINE", "locmem")]}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -158,6 +275,15 @@ STATIC_ROOT = BASE_DIR / "static-collected/"
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media/"
 
+# Stream the uploaded files to the disk while computing their hash instead of keeping them in memory
+FILE_UPLOAD_HANDLERS = ["Palto.Palto.storage.HashingFileUploadHandler"]
+
+# Protected files (attachments) are sent by the front web server after the permissions check.
+# "nginx" use the X-Accel-Redirect header, "apache" use the X-Sendfile header, "python" stream the file by the worker.
+SENDFILE_BACKEND = os.getenv("SENDFILE_BACKEND", "python")
+# Internal location of nginx serving the media directory
+SENDFILE_URL = os.getenv("SENDFILE_URL", "/protected-media/")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -168,7 +294,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     # Default way to authenticate to the REST api.
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Palto.Palto.api.tokens.RolesJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -186,11 +312,13 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '2/min',
-        'user': '15/min'
+        'user': '15/min',
+        # the scanner devices register the attendances of a whole group in a few seconds
+        'scanner': os.getenv("SCANNER_THROTTLE_RATE", '600/min'),
     },
 
     # Allow up to 30 elements per page
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'Palto.Palto.api.v1.pagination.EstimatedCountPagination',
     'PAGE_SIZE': 30
 }
 
@@ -200,6 +328,27 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Embed the departments and units of the user in the access tokens, avoiding to query them on every request
+JWT_ROLE_CLAIMS = os.getenv("JWT_ROLE_CLAIMS", "false").lower() in ["1", "true"]
+if JWT_ROLE_CLAIMS:
+    SIMPLE_JWT["TOKEN_OBTAIN_SERIALIZER"] = "Palto.Palto.api.tokens.RolesTokenObtainPairSerializer"
+    SIMPLE_JWT["TOKEN_REFRESH_SERIALIZER"] = "Palto.Palto.api.tokens.RolesTokenRefreshSerializer"
+
+
+# Scanner devices
+# duration in seconds during which a device token is trusted without checking the database again
+SCANNER_TOKEN_CACHE_TIMEOUT = int(os.getenv("SCANNER_TOKEN_CACHE_TIMEOUT", "60"))
+# maximal number of device tokens kept in the memory of a process
+SCANNER_TOKEN_CACHE_SIZE = int(os.getenv("SCANNER_TOKEN_CACHE_SIZE", "10000"))
+# sessions of the rosters downloaded by the scanner devices, from the ongoing ones to the ones starting in this delay
+ROSTER_HORIZON_HOURS = int(os.getenv("ROSTER_HORIZON_HOURS", "24"))
+# cards of the rosters, "exact" for the cards with their owner or "bloom" for a Bloom filter of the cards by group
+ROSTER_KIND = os.getenv("ROSTER_KIND", "exact")
+# false positive rate of the Bloom filters of the rosters
+ROSTER_BLOOM_ERROR_RATE = float(os.getenv("ROSTER_BLOOM_ERROR_RATE", "0.001"))
+# duration during which the sent rosters are kept to send only their differences on the next download, in seconds
+ROSTER_CACHE_TIMEOUT = int(os.getenv("ROSTER_CACHE_TIMEOUT", str(60 * 60 * 24 * 7)))
+
 
 # User model
 AUTH_USER_MODEL = "Palto.User"
@@ -214,3 +363,76 @@ CORS_ORIGIN_ALLOW_ALL = True
 LOGIN_URL = "/admin/login/"
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "/"
+
+
+# Calendar feeds
+# Number of days of past sessions included in the calendar feeds
+CALENDAR_FEED_PAST_DAYS = int(os.getenv("CALENDAR_FEED_PAST_DAYS", "90"))
+# Duration during which a generated calendar feed is kept in the cache
+CALENDAR_FEED_CACHE_TIMEOUT = int(os.getenv("CALENDAR_FEED_CACHE_TIMEOUT", str(60 * 60 * 24)))
+
+
+# Pages fragments
+# Duration during which a rendered fragment of a page is kept in the cache
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv("FRAGMENT_CACHE_TIMEOUT", str(60 * 60 * 24)))
+
+
+# Metrics
+# Directory where every process saves its metrics, so they are added together on every scrape.
+# Required with multiple workers, the metrics of a single process are exposed when empty.
+METRICS_DIRECTORY = os.getenv("METRICS_DIRECTORY", "")
+# Minimal interval between two saves of the metrics of a process, in seconds
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Token required in the "Authorization: Bearer <token>" header to read the metrics.
+# If empty, only the staff can read them.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Proportion of the requests counted in the duration and the queries metrics, between 0 and 1
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
+
+# Archives
+# Month starting the academic years, the sessions of the completed years can be moved into the archive tables
+ACADEMIC_YEAR_START_MONTH = int(os.getenv("ACADEMIC_YEAR_START_MONTH", "9"))
+# Number of sessions moved into the archive tables in every transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+
+# Purge
+# Number of rows deleted in every transaction by the purges, the scans can continue between two transactions
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+
+
+# Imports
+# Number of rows of the imported files validated and written together
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Patterns extracting the names of the unit, the group, the teacher and the note from the events of the imported
+# calendars, by default the format of the calendar feeds
+TIMETABLE_SUMMARY_PATTERN = os.getenv("TIMETABLE_SUMMARY_PATTERN", r"^(?P<unit>.+?)\s*\((?P<group>[^()]+)\)$")
+TIMETABLE_DESCRIPTION_PATTERN = os.getenv(
+    "TIMETABLE_DESCRIPTION_PATTERN", r"^(?P<teacher>.+?)(?:\s+-\s+(?P<note>.*))?$"
+)
+
+
+# Changes feeds
+# Maximal number of changes given by every page of the changes feeds
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "100"))
+# Number of days the tombstones of the deleted objects are kept. The clients that didn't synchronise for longer must
+# synchronise again from the start.
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "90"))
+# Number of seconds the changes wait before being given by the changes feeds, longer than the writing transactions :
+# their modification dates are set before they are committed
+CHANGES_SETTLE_SECONDS = int(os.getenv("CHANGES_SETTLE_SECONDS", "60"))
+
+
+# Users search
+# Maximal number of users given by the autocompletion
+USER_SEARCH_LIMIT = int(os.getenv("USER_SEARCH_LIMIT", "10"))
+# Maximal number of words of a search, the next ones are ignored
+USER_SEARCH_MAX_WORDS = int(os.getenv("USER_SEARCH_MAX_WORDS", "4"))
+
+
+# Counts
+# Number of objects above which the lists are counted by the estimate of the database planner, when it can
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv("COUNT_ESTIMATE_THRESHOLD", "10000"))
+# Number of seconds the exact counts of the lists are cached
+COUNT_CACHE_TIMEOUT = int(os.getenv("COUNT_CACHE_TIMEOUT", "30"))